@@ -1,25 +1,94 @@
+import mimetypes
 import os
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory
+import time
+import click
+import metrics
+import quota
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, abort, jsonify, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from blob_store import BlobStore
+from media_stream import send_ranged_file
+from mp4_faststart import try_faststart
+import resumable_upload
+import sqlite_pool
+from search_index import UserSearchIndex
+from thumbnails import ThumbnailPipeline
+import view_counter
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # 请换成随机且安全的key
 UPLOAD_FOLDER = 'static/videos'
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['STREAM_CHUNK_SIZE'] = 256 * 1024  # 无sendfile时每次读取的字节数上限
+# 断点续传：暂存目录不能放在static下，否则未完成的文件会被公开访问
+app.config['UPLOAD_STAGING_FOLDER'] = 'upload_staging'
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024
+app.config['UPLOAD_MAX_SIZE'] = 4 * 1024 * 1024 * 1024
+app.config['UPLOAD_SESSION_TTL'] = 24 * 3600  # 超过该时间未更新的上传会话会被清理
+app.config['UPLOAD_GC_INTERVAL'] = 600
+app.config['VIDEOS_PAGE_SIZE'] = 24  # 视频列表每页条数
+# 封面和缩略图按内容哈希存放，可通过static直接访问
+app.config['THUMBNAIL_FOLDER'] = 'static/thumbs'
+app.config['THUMBNAIL_WORKERS'] = 2
+# 按SHA-256去重存储的视频文件，通过 /stream/<id> 访问；旧视频仍在UPLOAD_FOLDER下
+app.config['BLOB_FOLDER'] = 'video_blobs'
+# 播放计数：进程内累加，按时间间隔或条数阈值批量写库
+app.config['VIEW_FLUSH_INTERVAL'] = 5.0
+app.config['VIEW_FLUSH_THRESHOLD'] = 1000
+app.config['TRENDING_HALF_LIFE'] = 24 * 3600  # 热门分数半衰期（秒）
+app.config['TRENDING_SIZE'] = 12
+# 指标：/metrics 输出 Prometheus 文本；慢请求采样剖析默认关闭，设为毫秒阈值即开启
+app.config['METRICS_PROFILE_SLOW_MS'] = int(os.environ.get('METRICS_PROFILE_SLOW_MS', 0))
+app.config['METRICS_PROFILE_DIR'] = 'profiles'
+# 每个用户的存储配额，None为不限制；用量计数器每隔 QUOTA_RECONCILE_INTERVAL 秒按videos表重算一次
+app.config['QUOTA_MAX_BYTES'] = 10 * 1024 * 1024 * 1024
+app.config['QUOTA_MAX_FILES'] = 1000
+app.config['QUOTA_RECONCILE_INTERVAL'] = 3600
 
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+metrics.init_app(app, video_endpoints={'stream_video'})
+
+for folder in (UPLOAD_FOLDER, app.config['UPLOAD_STAGING_FOLDER'], app.config['THUMBNAIL_FOLDER']):
+    if not os.path.exists(folder):
+        os.makedirs(folder)
 
 # --- 数据库相关 ---
-def get_db_connection():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+DATABASE = 'database.db'
+# 连接池：连接在请求之间复用，统一开启WAL、synchronous=NORMAL、busy_timeout和mmap
+db_pool = sqlite_pool.ConnectionPool(DATABASE, factory=metrics.TimedConnection)
+
+def get_db():
+    # 每个请求借用一个连接，请求结束时归还连接池
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+def query_one(sql, params=()):
+    return sqlite_pool.query_one(get_db(), sql, params)
+
+def query_all(sql, params=()):
+    return sqlite_pool.query_all(get_db(), sql, params)
+
+def execute(sql, params=()):
+    return sqlite_pool.execute(get_db(), sql, params)
+
+def add_missing_columns(c, table, columns):
+    # 旧数据库没有新加的列时补上（SQLite 不支持 ADD COLUMN IF NOT EXISTS）
+    existing = {row[1] for row in c.execute(f'PRAGMA table_info({table})')}
+    for name, decl in columns.items():
+        if name not in existing:
+            c.execute(f'ALTER TABLE {table} ADD COLUMN {name} {decl}')
 
 def init_db():
-    conn = get_db_connection()
+    conn = db_pool.acquire()
     c = conn.cursor()
     # 用户表：id, username, password
     c.execute('''
@@ -39,25 +108,251 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
     ''')
+    # 封面/缩略图路径（相对THUMBNAIL_FOLDER），NULL表示尚未生成，空字符串表示生成失败
+    add_missing_columns(c, 'videos', {'poster': 'TEXT', 'thumbnail': 'TEXT'})
+    # 去重存储：blob_sha256 为空的是旧视频，文件在 UPLOAD_FOLDER/filename
+    add_missing_columns(c, 'videos', {'blob_sha256': 'TEXT'})
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_videos_blob ON videos (blob_sha256)')
+    # 播放次数和热门榜（score 为换算到固定起点的对数衰减分数，见 view_counter.py）
+    add_missing_columns(c, 'videos', {'views': 'INTEGER NOT NULL DEFAULT 0'})
+    # 文件大小（去重前的逻辑大小，计入配额），旧记录为NULL，由用量重算补齐
+    add_missing_columns(c, 'videos', {'size': 'INTEGER'})
+    # 每个用户的存储用量计数器
+    c.execute(quota.SCHEMA)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS trending (
+        video_id INTEGER PRIMARY KEY,
+        score REAL NOT NULL,
+        FOREIGN KEY (video_id) REFERENCES videos (id)
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_trending_score ON trending (score DESC)')
+    # 按 (user_id, id) 的覆盖索引，列表分页查询不需要回表
+    c.execute('DROP INDEX IF EXISTS idx_videos_user_id_id')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_videos_user_listing ON videos (user_id, id, title, filename, thumbnail)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_videos_thumbnail_pending ON videos (id) WHERE thumbnail IS NULL')
+    # 断点续传会话：received 为已连续接收的字节数
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        title TEXT,
+        size INTEGER NOT NULL,
+        chunk_size INTEGER NOT NULL,
+        received INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    ''')
     conn.commit()
-    conn.close()
+    db_pool.release(conn)
 
 init_db()
 
+# 用户名搜索索引（进程内），首次搜索时从数据库增量加载
+user_index = UserSearchIndex()
+
+def sync_user_index():
+    # 其他进程注册的用户 id 更大，按 id 增量补齐即可
+    rows = query_all('SELECT id, username FROM users WHERE id > ? ORDER BY id', (user_index.max_id,))
+    user_index.add_many((r['id'], r['username']) for r in rows)
+
 # --- 辅助函数 ---
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# 最强公共子序列计算（Longest Common Subsequence, LCS）
-def lcs_length(a, b):
-    dp = [[0]*(len(b)+1) for _ in range(len(a)+1)]
-    for i in range(1, len(a)+1):
-        for j in range(1, len(b)+1):
-            if a[i-1] == b[j-1]:
-                dp[i][j] = dp[i-1][j-1] +1
-            else:
-                dp[i][j] = max(dp[i-1][j], dp[i][j-1])
-    return dp[len(a)][len(b)]
+def list_user_videos(user_id, before=None, limit=None):
+    """按 id 倒序的键集分页：返回 (本页视频, 下一页游标)，没有下一页时游标为 None"""
+    limit = limit or app.config['VIDEOS_PAGE_SIZE']
+    if before is None:
+        rows = query_all('SELECT id, user_id, title, filename, thumbnail FROM videos WHERE user_id = ? '
+                         'ORDER BY id DESC LIMIT ?', (user_id, limit + 1))
+    else:
+        rows = query_all('SELECT id, user_id, title, filename, thumbnail FROM videos WHERE user_id = ? AND id < ? '
+                         'ORDER BY id DESC LIMIT ?', (user_id, before, limit + 1))
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['id']
+    return rows, None
+
+# --- 视频文件存储 ---
+blob_store = BlobStore(app.config['BLOB_FOLDER'], app.config['UPLOAD_STAGING_FOLDER'])
+
+def video_path(video):
+    if video['blob_sha256']:
+        return blob_store.path_for(video['blob_sha256'])
+    return os.path.join(app.config['UPLOAD_FOLDER'], video['filename'])
+
+def store_video(tmp_path, digest, size, user_id, filename, title):
+    """把已算好哈希的暂存文件放入去重存储并写入videos表，返回视频id；超出配额时抛 QuotaExceeded，暂存文件留给调用方处理"""
+    with sqlite_pool.write_transaction(get_db()) as conn:
+        # 配额按用户看到的大小计算，与内容是否去重无关
+        quota.charge(conn, user_id, size, 1, app.config['QUOTA_MAX_BYTES'], app.config['QUOTA_MAX_FILES'])
+        is_new = blob_store.add_ref(conn, tmp_path, digest, size)
+        # 相同内容已有缩略图时直接复用
+        thumbs = None if is_new else conn.execute(
+            "SELECT poster, thumbnail FROM videos WHERE blob_sha256 = ? AND thumbnail != '' LIMIT 1",
+            (digest,)).fetchone()
+        cur = conn.execute('INSERT INTO videos (user_id, filename, title, blob_sha256, size, poster, thumbnail) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (user_id, filename, title, digest, size,
+                            thumbs['poster'] if thumbs else None, thumbs['thumbnail'] if thumbs else None))
+    if not thumbs:
+        schedule_thumbnail(cur.lastrowid, blob_store.path_for(digest))
+    return cur.lastrowid
+
+def remove_video(video):
+    size = video['size']
+    if size is None:
+        size = os.path.getsize(video_path(video)) if os.path.exists(video_path(video)) else 0
+    with sqlite_pool.write_transaction(get_db()) as conn:
+        conn.execute('DELETE FROM videos WHERE id = ?', (video['id'],))
+        quota.charge(conn, video['user_id'], -size, -1)
+        conn.execute('DELETE FROM trending WHERE video_id = ?', (video['id'],))
+        if video['blob_sha256']:
+            blob_store.release_ref(conn, video['blob_sha256'])
+    if not video['blob_sha256']:
+        filepath = video_path(video)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+# 把旧视频迁移到去重存储：flask --app app migrate-blobs
+@app.cli.command('migrate-blobs')
+def migrate_blobs_command():
+    rows = query_all('SELECT id, filename FROM videos WHERE blob_sha256 IS NULL ORDER BY id')
+    saved = 0
+    for row in rows:
+        path = os.path.join(app.config['UPLOAD_FOLDER'], row['filename'])
+        if not os.path.exists(path):
+            continue
+        digest, size = blob_store.hash_file(path)
+        with sqlite_pool.write_transaction(get_db()) as conn:
+            if not blob_store.add_ref(conn, path, digest, size):
+                saved += size
+            conn.execute('UPDATE videos SET blob_sha256 = ? WHERE id = ?', (digest, row['id']))
+    print(f'已迁移 {len(rows)} 个视频，去重节省 {saved / 1024 / 1024:.1f} MB')
+
+# --- 存储配额 ---
+def reconcile_usage():
+    """按videos表重算所有用户的用量计数器，返回有漂移的用户数"""
+    conn = db_pool.acquire()
+    try:
+        # 旧记录没有大小：去重存储的取blobs.size，更早的直接stat文件
+        sqlite_pool.execute(conn, 'UPDATE videos SET size = (SELECT size FROM blobs WHERE sha256 = videos.blob_sha256) '
+                                  'WHERE size IS NULL AND blob_sha256 IS NOT NULL')
+        for row in conn.execute('SELECT id, filename FROM videos WHERE size IS NULL AND blob_sha256 IS NULL').fetchall():
+            path = os.path.join(app.config['UPLOAD_FOLDER'], row['filename'])
+            if os.path.exists(path):
+                sqlite_pool.execute(conn, 'UPDATE videos SET size = ? WHERE id = ?', (os.path.getsize(path), row['id']))
+        # 汇总和覆盖在同一个写事务里，期间的上传/删除不会被覆盖掉
+        with sqlite_pool.write_transaction(conn):
+            usage = conn.execute('SELECT users.id, COALESCE(SUM(videos.size), 0), COUNT(videos.id) FROM users '
+                                 'LEFT JOIN videos ON videos.user_id = users.id GROUP BY users.id').fetchall()
+            drifted = quota.reset_usage(conn, usage)
+        if drifted:
+            app.logger.warning('重算存储用量：%d 个用户的计数器有偏差，已修正', drifted)
+        return drifted
+    finally:
+        db_pool.release(conn)
+
+usage_reconciler = quota.Reconciler(reconcile_usage, interval=app.config['QUOTA_RECONCILE_INTERVAL'])
+app.jinja_env.globals['format_bytes'] = quota.format_bytes
+
+def current_usage(user_id):
+    usage_reconciler.start()
+    return quota.get_usage(get_db(), user_id)
+
+# 立即重算存储用量：flask --app app reconcile-usage
+@app.cli.command('reconcile-usage')
+def reconcile_usage_command():
+    print(f'已重算存储用量，{reconcile_usage()} 个用户的计数器有偏差')
+
+# --- 播放计数与热门榜 ---
+def flush_views(deltas, now):
+    # 在后台线程中执行，直接从连接池借连接
+    half_life = app.config['TRENDING_HALF_LIFE']
+    conn = db_pool.acquire()
+    try:
+        with sqlite_pool.write_transaction(conn):
+            ids = list(deltas)
+            conn.executemany('UPDATE videos SET views = views + ? WHERE id = ?',
+                             [(n, video_id) for video_id, n in deltas.items()])
+            placeholders = ','.join('?' * len(ids))
+            old = dict(conn.execute(f'SELECT video_id, score FROM trending WHERE video_id IN ({placeholders})',
+                                    ids).fetchall())
+            existing = {r[0] for r in conn.execute(f'SELECT id FROM videos WHERE id IN ({placeholders})',
+                                                   ids).fetchall()}
+            conn.executemany('INSERT OR REPLACE INTO trending (video_id, score) VALUES (?, ?)',
+                             [(video_id, view_counter.decayed_log_score(old.get(video_id), n, now, half_life))
+                              for video_id, n in deltas.items() if video_id in existing])
+            # 衰减到几乎为零的记录不再需要
+            conn.execute('DELETE FROM trending WHERE score < ?', (view_counter.score_floor(now, half_life),))
+    finally:
+        db_pool.release(conn)
+
+views = view_counter.ViewCounter(flush_views, interval=app.config['VIEW_FLUSH_INTERVAL'],
+                                 max_pending=app.config['VIEW_FLUSH_THRESHOLD'])
+
+def trending_videos(limit=None):
+    return query_all('SELECT videos.id, videos.title, videos.thumbnail, videos.views, users.username '
+                     'FROM trending JOIN videos ON videos.id = trending.video_id '
+                     'JOIN users ON users.id = videos.user_id '
+                     'ORDER BY trending.score DESC LIMIT ?', (limit or app.config['TRENDING_SIZE'],))
+
+# --- 缩略图 ---
+def save_thumbnail_result(video_id, poster, thumbnail):
+    # 在进程池的回调线程中执行，没有请求上下文，直接从连接池借连接
+    conn = db_pool.acquire()
+    try:
+        sqlite_pool.execute(conn, 'UPDATE videos SET poster = ?, thumbnail = ? WHERE id = ?',
+                            (poster, thumbnail, video_id))
+    finally:
+        db_pool.release(conn)
+
+thumbnail_pipeline = ThumbnailPipeline(app.config['THUMBNAIL_FOLDER'], save_thumbnail_result,
+                                       max_workers=app.config['THUMBNAIL_WORKERS'])
+
+def schedule_thumbnail(video_id, path):
+    thumbnail_pipeline.submit(video_id, path)
+
+def thumbnail_url(video):
+    if not video['thumbnail']:
+        return None
+    return url_for('static', filename='thumbs/' + video['thumbnail'])
+
+app.jinja_env.globals['thumbnail_url'] = thumbnail_url
+
+# 补全已有视频的缩略图：flask --app app thumbnails [--retry-failed]
+@app.cli.command('thumbnails')
+@click.option('--retry-failed', is_flag=True, help='重新生成之前失败的缩略图')
+@click.option('--batch', default=32, help='每批提交的视频数')
+def thumbnails_command(retry_failed, batch):
+    condition = "thumbnail IS NULL OR thumbnail = ''" if retry_failed else 'thumbnail IS NULL'
+    last_id, done = 0, 0
+    while True:
+        rows = query_all(f'SELECT id, filename, blob_sha256 FROM videos WHERE ({condition}) AND id > ? '
+                         'ORDER BY id LIMIT ?', (last_id, batch))
+        if not rows:
+            break
+        futures = [thumbnail_pipeline.submit(r['id'], video_path(r)) for r in rows]
+        for future in futures:
+            if future is not None:
+                try:
+                    future.result()
+                except Exception:
+                    pass  # 失败已在回调中记录
+        last_id = rows[-1]['id']
+        done += len(rows)
+        print(f'已处理 {done} 个视频')
+    thumbnail_pipeline.shutdown()
 
 # --- 路由 ---
 
@@ -65,7 +360,7 @@ def lcs_length(a, b):
 def index():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
-    return render_template('index.html')
+    return render_template('index.html', trending=trending_videos())
 
 # 注册
 @app.route('/register', methods=['GET', 'POST'])
@@ -76,16 +371,12 @@ def register():
         if not username or not password:
             flash('用户名和密码不能为空')
             return redirect(url_for('register'))
-        conn = get_db_connection()
-        c = conn.cursor()
         try:
-            c.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
-            conn.commit()
+            cur = execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
+            user_index.add(cur.lastrowid, username)
         except sqlite3.IntegrityError:
             flash('用户名已存在')
-            conn.close()
             return redirect(url_for('register'))
-        conn.close()
         flash('注册成功，请登录')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -96,11 +387,7 @@ def login():
     if request.method == 'POST':
         username = request.form['username'].strip()
         password = request.form['password'].strip()
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
-        user = c.fetchone()
-        conn.close()
+        user = query_one('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
         if user:
             session['user_id'] = user['id']
             session['username'] = user['username']
@@ -124,10 +411,11 @@ def dashboard():
         flash('请先登录')
         return redirect(url_for('login'))
     uid = session['user_id']
-    conn = get_db_connection()
-    videos = conn.execute('SELECT * FROM videos WHERE user_id = ?', (uid,)).fetchall()
-    conn.close()
-    return render_template('dashboard.html', videos=videos)
+    videos, next_cursor = list_user_videos(uid, before=request.args.get('before', type=int))
+    used_bytes, used_files = current_usage(uid)
+    return render_template('dashboard.html', videos=videos, next_cursor=next_cursor,
+                           used_bytes=used_bytes, used_files=used_files,
+                           max_bytes=app.config['QUOTA_MAX_BYTES'], max_files=app.config['QUOTA_MAX_FILES'])
 
 # 上传视频
 @app.route('/upload', methods=['POST'])
@@ -135,7 +423,17 @@ def upload():
     if 'user_id' not in session:
         flash('请先登录')
         return redirect(url_for('login'))
-    if 'file' not in request.files:
+    # 读请求体之前先按 Content-Length 检查配额，读取时超过剩余额度立即中止
+    used_bytes, used_files = current_usage(session['user_id'])
+    max_bytes, max_files = app.config['QUOTA_MAX_BYTES'], app.config['QUOTA_MAX_FILES']
+    try:
+        quota.precheck(used_bytes, used_files, request.content_length, max_bytes, max_files)
+        request.max_content_length = quota.body_limit(used_bytes, max_bytes, app.config['MAX_CONTENT_LENGTH'])
+        has_file = 'file' in request.files
+    except RequestEntityTooLarge as e:
+        flash(e.description if isinstance(e, quota.QuotaExceeded) else '文件过大或超出存储配额')
+        return redirect(url_for('dashboard'))
+    if not has_file:
         flash('未选择文件')
         return redirect(url_for('dashboard'))
     file = request.files['file']
@@ -145,15 +443,17 @@ def upload():
         return redirect(url_for('dashboard'))
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        # 为避免文件名冲突，加上用户id和随机数
-        filename = f"{session['user_id']}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        conn = get_db_connection()
-        conn.execute('INSERT INTO videos (user_id, filename, title) VALUES (?, ?, ?)',
-                     (session['user_id'], filename, title))
-        conn.commit()
-        conn.close()
+        # 边写暂存文件边算SHA-256，相同内容只存一份
+        digest, size, tmp = blob_store.ingest_stream(file.stream)
+        # moov 在文件尾部的 MP4/MOV 重排到前面，浏览器无需先下载尾部即可播放；重排后内容变了，需重新计算哈希
+        if try_faststart(tmp, app.logger, filename=filename):
+            digest, size = blob_store.hash_file(tmp)
+        try:
+            store_video(tmp, digest, size, session['user_id'], filename, title)
+        except quota.QuotaExceeded as e:
+            os.remove(tmp)
+            flash(e.description)
+            return redirect(url_for('dashboard'))
         flash('上传成功')
     else:
         flash('文件格式不支持')
@@ -166,43 +466,50 @@ def delete_video(video_id):
         flash('请先登录')
         return redirect(url_for('login'))
     uid = session['user_id']
-    conn = get_db_connection()
-    video = conn.execute('SELECT * FROM videos WHERE id = ? AND user_id = ?', (video_id, uid)).fetchone()
+    video = query_one('SELECT * FROM videos WHERE id = ? AND user_id = ?', (video_id, uid))
     if video:
-        # 删除文件
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], video['filename'])
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        conn.execute('DELETE FROM videos WHERE id = ?', (video_id,))
-        conn.commit()
+        # 去重存储的文件只在最后一个引用删除时才删除
+        remove_video(video)
         flash('删除成功')
     else:
         flash('视频不存在或没有权限删除')
-    conn.close()
     return redirect(url_for('dashboard'))
 
 # 用户主页 - 显示某个用户的视频列表，可以刷视频
 @app.route('/user/<username>')
 def user_videos(username):
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+    user = query_one('SELECT * FROM users WHERE username = ?', (username,))
     if not user:
-        conn.close()
         flash('用户不存在')
         return redirect(url_for('index'))
-    videos = conn.execute('SELECT * FROM videos WHERE user_id = ?', (user['id'],)).fetchall()
-    conn.close()
-    return render_template('user_videos.html', user=user, videos=videos)
+    videos, next_cursor = list_user_videos(user['id'], before=request.args.get('before', type=int))
+    return render_template('user_videos.html', user=user, videos=videos, next_cursor=next_cursor)
+
+# 用户主页的无限滚动：按游标返回下一页视频
+@app.route('/user/<username>/videos.json')
+def user_videos_json(username):
+    user = query_one('SELECT id FROM users WHERE username = ?', (username,))
+    if not user:
+        return jsonify(error='用户不存在'), 404
+    limit = min(max(request.args.get('limit', app.config['VIDEOS_PAGE_SIZE'], type=int), 1), 100)
+    videos, next_cursor = list_user_videos(user['id'], before=request.args.get('before', type=int), limit=limit)
+    return jsonify(videos=[{
+        'id': v['id'],
+        'title': v['title'],
+        'url': url_for('play_video', video_id=v['id']),
+        'stream_url': url_for('stream_video', video_id=v['id']),
+        'thumbnail_url': thumbnail_url(v),
+    } for v in videos], next_cursor=next_cursor)
 
 # 播放单个视频页面
 @app.route('/video/<int:video_id>')
 def play_video(video_id):
-    conn = get_db_connection()
-    video = conn.execute('SELECT videos.*, users.username FROM videos JOIN users ON videos.user_id = users.id WHERE videos.id = ?', (video_id,)).fetchone()
-    conn.close()
+    video = query_one('SELECT videos.*, users.username FROM videos JOIN users ON videos.user_id = users.id WHERE videos.id = ?', (video_id,))
     if not video:
         flash('视频不存在')
         return redirect(url_for('index'))
+    # 只在内存中累加，后台批量写库
+    views.hit(video_id)
     return render_template('play_video.html', video=video)
 
 # 视频搜索（根据用户名最强公共子序列匹配）
@@ -212,20 +519,153 @@ def search():
     if not keyword:
         flash('请输入搜索关键字')
         return redirect(url_for('index'))
-    conn = get_db_connection()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    # 计算每个用户名和关键词的LCS长度
-    user_scores = []
-    for u in users:
-        score = lcs_length(keyword, u['username'])
-        user_scores.append((u, score))
-    # 按得分降序排序，取前几个相似用户展示
-    user_scores.sort(key=lambda x: x[1], reverse=True)
-    top_users = [u for u, s in user_scores if s > 0][:10]
-    conn.close()
+    sync_user_index()
+    # 先用字符倒排索引筛出候选，再用位并行LCS打分，取得分最高的前10个
+    top_users = [{'id': uid, 'username': name}
+                 for uid, name, score in user_index.search(keyword, limit=10)]
     return render_template('search_results.html', keyword=keyword, users=top_users)
 
-# 静态文件中视频访问，Flask默认static路径已配置，直接访问/static/videos/filename即可
+# --- 断点续传上传 ---
+_last_upload_gc = 0.0
+
+def gc_upload_sessions(force=False):
+    global _last_upload_gc
+    now = time.time()
+    if not force and now - _last_upload_gc < app.config['UPLOAD_GC_INTERVAL']:
+        return 0
+    _last_upload_gc = now
+    return resumable_upload.collect_expired(get_db(), app.config['UPLOAD_STAGING_FOLDER'],
+                                            app.config['UPLOAD_SESSION_TTL'])
+
+def upload_session_status(row):
+    return {
+        'id': row['id'],
+        'filename': row['filename'],
+        'size': row['size'],
+        'chunk_size': row['chunk_size'],
+        'received': row['received'],
+        'next_chunk': row['received'] // row['chunk_size'],
+    }
+
+def get_upload_session(upload_id):
+    return query_one('SELECT * FROM upload_sessions WHERE id = ? AND user_id = ?',
+                     (upload_id, session['user_id']))
+
+# 创建上传会话
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    if 'user_id' not in session:
+        return jsonify(error='请先登录'), 401
+    gc_upload_sessions()
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(str(data.get('filename', '')))
+    title = str(data.get('title', '')).strip()
+    try:
+        size = int(data.get('size', -1))
+    except (TypeError, ValueError):
+        size = -1
+    if not filename or not allowed_file(filename):
+        return jsonify(error='文件格式不支持'), 400
+    if size < 0 or size > app.config['UPLOAD_MAX_SIZE']:
+        return jsonify(error='文件大小无效'), 400
+    # 声明的大小已知，创建会话时就检查配额，完成时在写事务里再按实际大小检查
+    used_bytes, used_files = current_usage(session['user_id'])
+    try:
+        quota.check(used_bytes, used_files, size, 1, app.config['QUOTA_MAX_BYTES'], app.config['QUOTA_MAX_FILES'])
+    except quota.QuotaExceeded as e:
+        return jsonify(error=e.description), 413
+    upload_id = resumable_upload.new_session_id()
+    # 先建空暂存文件再写会话记录，GC 只会清理过期的残留文件
+    open(resumable_upload.staging_path(app.config['UPLOAD_STAGING_FOLDER'], upload_id), 'wb').close()
+    now = time.time()
+    execute('INSERT INTO upload_sessions (id, user_id, filename, title, size, chunk_size, received, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)',
+            (upload_id, session['user_id'], filename, title, size, app.config['UPLOAD_CHUNK_SIZE'], now, now))
+    row = get_upload_session(upload_id)
+    return jsonify(upload_session_status(row)), 201
+
+# 查询上传进度
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    if 'user_id' not in session:
+        return jsonify(error='请先登录'), 401
+    row = get_upload_session(upload_id)
+    if not row:
+        return jsonify(error='上传会话不存在或已过期'), 404
+    return jsonify(upload_session_status(row))
+
+# 写入一个分块，分块必须从已接收位置或之前开始（重传已收到的分块是幂等的）
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    if 'user_id' not in session:
+        return jsonify(error='请先登录'), 401
+    row = get_upload_session(upload_id)
+    if not row:
+        return jsonify(error='上传会话不存在或已过期'), 404
+    chunk_size = row['chunk_size']
+    offset = index * chunk_size
+    header_offset = request.headers.get('Upload-Offset')
+    if header_offset is not None and header_offset != str(offset):
+        return jsonify(error='分块偏移与序号不符', **upload_session_status(row)), 409
+    if offset > row['received'] or offset >= max(row['size'], 1):
+        return jsonify(error='分块不连续', **upload_session_status(row)), 409
+    limit = min(chunk_size, row['size'] - offset)
+    path = resumable_upload.staging_path(app.config['UPLOAD_STAGING_FOLDER'], upload_id)
+    try:
+        written = resumable_upload.write_chunk(request.stream, path, offset, limit)
+    except resumable_upload.ChunkError as e:
+        return jsonify(error=str(e)), 413
+    if written != limit:
+        # 不完整的分块不计入进度，客户端从同一序号重传
+        return jsonify(error='分块不完整', **upload_session_status(row)), 400
+    execute('UPDATE upload_sessions SET received = MAX(received, ?), updated_at = ? WHERE id = ?',
+            (offset + written, time.time(), upload_id))
+    row = get_upload_session(upload_id)
+    return jsonify(upload_session_status(row))
+
+# 完成上传：移动到视频目录并写入videos表
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    if 'user_id' not in session:
+        return jsonify(error='请先登录'), 401
+    row = get_upload_session(upload_id)
+    if not row:
+        return jsonify(error='上传会话不存在或已过期'), 404
+    if row['received'] != row['size']:
+        return jsonify(error='文件尚未上传完整', **upload_session_status(row)), 409
+    # 先认领会话：同一会话的并发完成请求只有一个能删掉这一行，其余的不会再碰暂存文件
+    claimed = execute('DELETE FROM upload_sessions WHERE id = ? AND user_id = ?', (upload_id, session['user_id']))
+    if claimed.rowcount != 1:
+        return jsonify(error='上传会话已完成'), 409
+    staging = resumable_upload.staging_path(app.config['UPLOAD_STAGING_FOLDER'], upload_id)
+    try:
+        # 在暂存文件上完成 faststart，再计算哈希放入去重存储
+        try_faststart(staging, app.logger, filename=row['filename'])
+        digest, size = blob_store.hash_file(staging)
+        video_id = store_video(staging, digest, size, session['user_id'], row['filename'], row['title'])
+    except quota.QuotaExceeded as e:
+        # 会话和暂存文件都留着，客户端腾出空间后可以再次完成
+        execute('INSERT INTO upload_sessions (id, user_id, filename, title, size, chunk_size, received, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (row['id'], row['user_id'], row['filename'], row['title'], row['size'], row['chunk_size'],
+                 row['received'], row['created_at'], time.time()))
+        return jsonify(error=e.description, **upload_session_status(row)), 413
+    return jsonify(video_id=video_id, url=url_for('play_video', video_id=video_id))
+
+# 手动清理过期的上传会话：flask --app app gc-uploads
+@app.cli.command('gc-uploads')
+def gc_uploads_command():
+    print(f'已清理 {gc_upload_sessions(force=True)} 个过期上传会话')
+
+# 视频字节流：支持Range/206、多区间、If-Range和ETag，按videos.id访问
+@app.route('/stream/<int:video_id>')
+def stream_video(video_id):
+    video = query_one('SELECT filename, blob_sha256 FROM videos WHERE id = ?', (video_id,))
+    if not video:
+        abort(404)
+    filepath = video_path(video)
+    mimetype = mimetypes.guess_type(video['filename'])[0] or 'application/octet-stream'
+    return send_ranged_file(filepath, mimetype=mimetype, chunk_size=app.config['STREAM_CHUNK_SIZE'])
 
 if __name__ == '__main__':
     app.run(debug=True)
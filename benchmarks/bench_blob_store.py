@@ -0,0 +1,87 @@
+"""
+去重存储基准
+
+1. 写入吞吐：FileStorage.save()（旧实现） vs BlobStore.ingest_stream()（边写边算 SHA-256）
+2. 存储节省：模拟 N 次上传，内容按 Zipf 分布从 M 个不同视频中抽取
+   （热门视频被大量转发），比较按文件保存与按哈希保存的总大小
+
+    python benchmarks/bench_blob_store.py --size-mb 256 --uploads 500 --distinct 100
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blob_store import BlobStore  # noqa: E402
+from sqlite_pool import write_transaction  # noqa: E402
+
+
+def throughput(workdir, size_mb):
+    from werkzeug.datastructures import FileStorage
+
+    src = os.path.join(workdir, 'src.bin')
+    with open(src, 'wb') as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(size_mb):
+            f.write(block)
+
+    with open(src, 'rb') as f:
+        t0 = time.perf_counter()
+        FileStorage(f).save(os.path.join(workdir, 'saved.bin'))
+        plain = time.perf_counter() - t0
+
+    store = BlobStore(os.path.join(workdir, 'blobs'), os.path.join(workdir, 'staging'))
+    with open(src, 'rb') as f:
+        t0 = time.perf_counter()
+        _, _, tmp = store.ingest_stream(f)
+        hashed = time.perf_counter() - t0
+    os.remove(tmp)
+    print('file.save()      %7.0f MB/s' % (size_mb / plain))
+    print('ingest + sha256  %7.0f MB/s' % (size_mb / hashed))
+
+
+def storage_saved(workdir, uploads, distinct, rng):
+    store = BlobStore(os.path.join(workdir, 'dedup'), os.path.join(workdir, 'staging'))
+    conn = sqlite3.connect(os.path.join(workdir, 'bench.db'))
+    conn.execute('CREATE TABLE blobs (sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, refcount INTEGER NOT NULL)')
+    contents = [os.urandom(rng.randint(64, 512) * 1024) for _ in range(distinct)]
+    weights = [1 / (i + 1) for i in range(distinct)]
+    total = 0
+    for _ in range(uploads):
+        data = rng.choices(contents, weights)[0]
+        total += len(data)
+        tmp = os.path.join(store.staging_dir, 'upload.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        digest, size = store.hash_file(tmp)
+        with write_transaction(conn):
+            store.add_ref(conn, tmp, digest, size)
+    stored = conn.execute('SELECT SUM(size) FROM blobs').fetchone()[0]
+    print('uploads=%d  per-file=%.1f MB  dedup=%.1f MB  saved=%.1f%%' % (
+        uploads, total / 1e6, stored / 1e6, 100 * (1 - stored / total)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--uploads', type=int, default=500)
+    parser.add_argument('--distinct', type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        throughput(workdir, args.size_mb)
+        storage_saved(workdir, args.uploads, args.distinct, random.Random(1))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
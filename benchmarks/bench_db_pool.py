@@ -0,0 +1,113 @@
+"""
+并发数据库基准：每次新建连接（旧实现） vs 连接池 + WAL
+
+N 个线程混合执行仪表板读取（SELECT * FROM videos WHERE user_id = ?）
+和上传写入（INSERT INTO videos），统计总吞吐和锁冲突次数。
+
+    python benchmarks/bench_db_pool.py --threads 8 --ops 2000 --write-ratio 0.1
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_pool import ConnectionPool, execute, query_all  # noqa: E402
+
+SCHEMA = '''
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL);
+CREATE TABLE videos (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, filename TEXT NOT NULL, title TEXT);
+'''
+
+
+def prepare(path, users, videos_per_user):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                     [('u%d' % i, 'x') for i in range(users)])
+    conn.executemany('INSERT INTO videos (user_id, filename, title) VALUES (?, ?, ?)',
+                     [(u + 1, 'f%d.mp4' % v, 't') for u in range(users) for v in range(videos_per_user)])
+    conn.commit()
+    conn.close()
+
+
+def baseline_op(path, is_write, uid):
+    # 与旧 get_db_connection() 相同：每次 connect，默认回滚日志
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    try:
+        if is_write:
+            conn.execute('INSERT INTO videos (user_id, filename, title) VALUES (?, ?, ?)', (uid, 'new.mp4', 't'))
+            conn.commit()
+        else:
+            conn.execute('SELECT * FROM videos WHERE user_id = ?', (uid,)).fetchall()
+    finally:
+        conn.close()
+
+
+def pooled_op(pool, is_write, uid):
+    conn = pool.acquire()
+    try:
+        if is_write:
+            execute(conn, 'INSERT INTO videos (user_id, filename, title) VALUES (?, ?, ?)', (uid, 'new.mp4', 't'))
+        else:
+            query_all(conn, 'SELECT * FROM videos WHERE user_id = ?', (uid,))
+    finally:
+        pool.release(conn)
+
+
+def run(op, threads, ops, write_ratio, users):
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(ops):
+            try:
+                op(rng.random() < write_ratio, rng.randint(1, users))
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    t0 = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return threads * ops / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--write-ratio', type=float, default=0.1)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--videos-per-user', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    base_path = os.path.join(workdir, 'baseline.db')
+    pool_path = os.path.join(workdir, 'pooled.db')
+    prepare(base_path, args.users, args.videos_per_user)
+    prepare(pool_path, args.users, args.videos_per_user)
+
+    tput, errs = run(lambda w, u: baseline_op(base_path, w, u),
+                     args.threads, args.ops, args.write_ratio, args.users)
+    print('baseline  %8.0f ops/s  lock errors=%d' % (tput, errs))
+
+    pool = ConnectionPool(pool_path)
+    tput2, errs2 = run(lambda w, u: pooled_op(pool, w, u),
+                       args.threads, args.ops, args.write_ratio, args.users)
+    pool.close_all()
+    print('pooled    %8.0f ops/s  lock errors=%d  (%.1fx)' % (tput2, errs2, tput2 / tput))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+图像，文本视频.py 打包下载基准：边读边发的 ZIP 与先写临时 ZIP 再发送的对比
+
+    python benchmarks/bench_export.py --videos 8 --video-mb 64 --images 200 --log-mb 64
+
+造一个用户：--videos 个视频、--images 张图片（随机字节，与真实媒体一样几乎不可压缩）、
+--logs 个访问日志（上传时 gzip 压缩存储）。比较：
+- 流式：GET /user/<用户名>/export.zip，文本直接引用 .gz 里的 deflate 数据
+- 临时文件：zipfile 把同样的文件写进临时 ZIP（媒体 stored、文本解压后 deflate），再整个读出
+统计总耗时、首字节耗时、Python 分配的峰值内存（tracemalloc）、临时文件大小，
+以及带 If-Range 从归档中间续传到结尾的耗时。
+"""
+
+import argparse
+import importlib
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_store  # noqa: E402
+
+LINE = '%d.%d.%d.%d - - [17/Oct/2026:07:%02d:%02d +0800] "GET /user/u%d/image/%d.jpg HTTP/1.1" 200 %d "-" "curl/8.5.0"\n'
+
+
+def access_log(rng, size):
+    out = io.StringIO()
+    while out.tell() < size:
+        out.write(LINE % (rng.randint(1, 223), rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254),
+                          rng.randint(0, 59), rng.randint(0, 59), rng.randint(1, 500), rng.randint(1, 10000),
+                          rng.randint(200, 900000)))
+    return out.getvalue().encode()
+
+
+def measure(fn):
+    """返回 (总耗时, 首字节耗时, 峰值内存, 字节数)；fn 产出数据块"""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    first = None
+    total = 0
+    for chunk in fn():
+        if first is None:
+            first = time.perf_counter() - t0
+        total += len(chunk)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, first, peak, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--videos', type=int, default=8)
+    parser.add_argument('--video-mb', type=int, default=64)
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--image-kb', type=int, default=300)
+    parser.add_argument('--logs', type=int, default=4)
+    parser.add_argument('--log-mb', type=int, default=64, help='日志总大小')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)  # users.db 建在当前目录
+    try:
+        app_module = importlib.import_module('图像，文本视频')
+        app = app_module.app
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        app.config['QUOTA_MAX_BYTES'] = app.config['QUOTA_MAX_FILES'] = None
+        app.config['MAX_CONTENT_LENGTH'] = None
+        app_module.init_db()
+        client = app.test_client()
+        client.post('/register', data={'username': 'bench', 'password': 'pw'})
+        client.post('/login', data={'username': 'bench', 'password': 'pw'})
+
+        rng = random.Random(24)
+        uploads = [('clip%d.mp4' % i, args.video_mb * 1024 * 1024) for i in range(args.videos)]
+        uploads += [('img%04d.gif' % i, args.image_kb * 1024) for i in range(args.images)]  # gif 不生成派生图
+        for name, size in uploads:
+            client.post('/upload', data={'file': (io.BytesIO(rng.randbytes(size)), name)},
+                        content_type='multipart/form-data')
+        for i in range(args.logs):
+            data = access_log(rng, args.log_mb * 1024 * 1024 // args.logs)
+            client.post('/upload', data={'file': (io.BytesIO(data), 'access%d.txt' % i)},
+                        content_type='multipart/form-data')
+        raw = sum(size for _, size in uploads) + args.log_mb * 1024 * 1024
+        print('%d 个视频、%d 张图片、%d 个日志，原文共 %.0f MB' % (args.videos, args.images, args.logs, raw / 2 ** 20))
+
+        url = '/user/bench/export.zip'
+
+        def streamed():
+            resp = client.get(url, buffered=False)
+            try:
+                yield from resp.response
+            finally:
+                resp.close()
+
+        def via_tempfile():
+            base = os.path.join(app.config['UPLOAD_FOLDER'], 'bench')
+            with tempfile.TemporaryFile() as tmp:
+                with zipfile.ZipFile(tmp, 'w', allowZip64=True) as z:
+                    for filetype in ('image', 'text', 'video'):
+                        folder = os.path.join(base, filetype)
+                        for name in sorted(os.listdir(folder)):
+                            if name.startswith('.'):
+                                continue  # 块索引、行索引
+                            path = os.path.join(folder, name)
+                            if text_store.is_compressed(path):
+                                with text_store.open_text(path) as src, \
+                                        z.open('text/' + name[:-3], 'w', force_zip64=True) as dst:
+                                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                            else:
+                                z.write(path, filetype + '/' + name, zipfile.ZIP_STORED)
+                # 临时 ZIP 也会写在磁盘上，这里记下它的大小
+                via_tempfile.size = tmp.tell()
+                tmp.seek(0)
+                yield from iter(lambda: tmp.read(256 * 1024), b'')
+
+        print('%-10s %10s %10s %12s %12s' % ('', '总耗时', '首字节', '峰值内存', '大小'))
+        for label, fn in (('流式', streamed), ('临时文件', via_tempfile)):
+            elapsed, first, peak, total = measure(fn)
+            print('%-10s %8.0f ms %8.1f ms %9.1f MB %9.1f MB' % (label, elapsed * 1e3, first * 1e3, peak / 2 ** 20,
+                                                                   total / 2 ** 20))
+        print('临时文件方式另需 %.1f MB 临时磁盘空间' % (via_tempfile.size / 2 ** 20))
+
+        # 下载到一半断开，带 If-Range 从中间续传到结尾
+        head = client.get(url, headers={'Range': 'bytes=0-0'})
+        etag, size = head.headers['ETag'], int(head.headers['Content-Range'].rsplit('/', 1)[1])
+
+        def resumed():
+            resp = client.get(url, headers={'Range': 'bytes=%d-' % (size // 2), 'If-Range': etag}, buffered=False)
+            assert resp.status_code == 206, resp.status_code
+            try:
+                yield from resp.response
+            finally:
+                resp.close()
+        elapsed, first, peak, total = measure(resumed)
+        print('从 %.0f MB 处续传 %8.0f ms %8.1f ms %9.1f MB %9.1f MB' % (
+            size / 2 / 2 ** 20, elapsed * 1e3, first * 1e3, peak / 2 ** 20, total / 2 ** 20))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
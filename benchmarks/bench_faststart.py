@@ -0,0 +1,98 @@
+"""
+faststart 首帧时间基准
+
+对每个样例文件分别估算处理前后浏览器的首帧时间（time-to-first-frame）：
+- moov 在前：一次请求，读到 moov 结束和第一个数据块即可解码
+- moov 在后：读到 mdat 头后放弃，再发 Range 请求取尾部 moov，
+  最后再请求第一个数据块，共三个往返
+估算公式为 往返次数 * RTT + 需要下载的字节数 / 带宽。
+同时测量重排本身的耗时和吞吐。
+
+    python benchmarks/bench_faststart.py [sample.mp4 ...] --rtt-ms 80 --mbps 20
+不给文件时用 moviepy 生成一个 moov 在尾部的样例。
+"""
+
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mp4_faststart  # noqa: E402
+
+FIRST_FRAME_BYTES = 64 * 1024
+
+
+def layout(path):
+    """返回 (moov 起点, moov 长度, 第一个 mdat 起点, 最小块偏移)"""
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        boxes = mp4_faststart.top_level_boxes(fd, os.fstat(fd).st_size)
+        moov = next(b for b in boxes if b[0] == b'moov')
+        mdat = next(b for b in boxes if b[0] == b'mdat')
+        raw = os.pread(fd, moov[2], moov[1])
+    header = 16 if struct.unpack_from('>I', raw, 0)[0] == 1 else 8
+    children = mp4_faststart._parse_children(raw[header:])
+    first_chunk = min(min(mp4_faststart._read_offsets(box)[1] or [mdat[1]])
+                      for box in mp4_faststart._walk_chunk_offset_boxes(children))
+    return moov[1], moov[2], mdat[1], first_chunk
+
+
+def ttff(path, rtt, bytes_per_sec):
+    moov_start, moov_size, mdat_start, first_chunk = layout(path)
+    if moov_start < mdat_start:
+        needed = max(moov_start + moov_size, first_chunk + FIRST_FRAME_BYTES)
+        return rtt + needed / bytes_per_sec, needed
+    needed = (mdat_start + 16) + moov_size + FIRST_FRAME_BYTES
+    return 3 * rtt + needed / bytes_per_sec, needed
+
+
+def make_sample(directory, seconds):
+    import numpy as np
+    try:
+        from moviepy import VideoClip
+    except ImportError:
+        from moviepy.editor import VideoClip
+
+    def frame(t):
+        noise = np.random.default_rng(int(t * 30)).integers(0, 255, (360, 640, 3), dtype='uint8')
+        return noise
+
+    path = os.path.join(directory, 'sample.mp4')
+    VideoClip(frame, duration=seconds).write_videofile(path, fps=30, audio=False, logger=None)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--rtt-ms', type=float, default=80)
+    parser.add_argument('--mbps', type=float, default=20)
+    parser.add_argument('--sample-seconds', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    files = args.files or [make_sample(workdir, args.sample_seconds)]
+    rtt = args.rtt_ms / 1000
+    bps = args.mbps * 1000 * 1000 / 8
+    for src in files:
+        path = os.path.join(workdir, 'work_' + os.path.basename(src))
+        shutil.copyfile(src, path)
+        size = os.path.getsize(path)
+        before, before_bytes = ttff(path, rtt, bps)
+        t0 = time.perf_counter()
+        changed = mp4_faststart.faststart(path)
+        elapsed = time.perf_counter() - t0
+        after, after_bytes = ttff(path, rtt, bps)
+        print('%s  %.1f MB  remuxed=%s in %.3fs (%.0f MB/s)' % (
+            os.path.basename(src), size / 1e6, changed, elapsed, size / 1e6 / max(elapsed, 1e-9)))
+        print('  ttff before=%.0fms (%d bytes)  after=%.0fms (%d bytes)' % (
+            before * 1000, before_bytes, after * 1000, after_bytes))
+
+
+if __name__ == '__main__':
+    main()
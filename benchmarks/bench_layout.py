@@ -0,0 +1,92 @@
+"""
+用户目录布局基准：单个用户 N 个文件时平铺目录与哈希分片目录的对比
+
+    python benchmarks/bench_layout.py --files 100000 --lookups 20000
+
+- create：创建 N 个空文件（含分片目录的 makedirs）
+- lookup：随机文件名 storage_layout.locate()，即 uploaded_file 的查找路径
+- list：列出全部文件（平铺 os.listdir，分片为逐个 scandir 子目录）
+每项测试前会尽量丢弃页缓存（需要 root 写 /proc/sys/vm/drop_caches），否则结果是热缓存的数据。
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage_layout  # noqa: E402
+
+
+def drop_caches():
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as f:
+            f.write('3')
+        return True
+    except OSError:
+        return False
+
+
+def list_files(folder, version):
+    if version == 1:
+        return len(os.listdir(folder))
+    count = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir() and storage_layout.is_shard_dir(entry.name):
+                count += len(os.listdir(entry.path))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--dir', default=None, help='测试目录所在位置（默认系统临时目录）')
+    args = parser.parse_args()
+
+    names = ['video_%07d.mp4' % i for i in range(args.files)]
+    rng = random.Random(0)
+    probes = [rng.choice(names) for _ in range(args.lookups)]
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        for version in sorted(storage_layout.LAYOUTS):
+            folder = os.path.join(workdir, 'v%d' % version)
+            os.makedirs(folder)
+            t0 = time.perf_counter()
+            for name in names:
+                path = storage_layout.path_for(folder, name, version)
+                if version != 1:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            create = time.perf_counter() - t0
+
+            cold = drop_caches()
+            t0 = time.perf_counter()
+            for name in probes:
+                if storage_layout.locate(folder, name, version) is None:
+                    raise SystemExit('missing %s' % name)
+            lookup = time.perf_counter() - t0
+
+            drop_caches()
+            t0 = time.perf_counter()
+            listed = list_files(folder, version)
+            listing = time.perf_counter() - t0
+            if listed != args.files:
+                raise SystemExit('listed %d of %d files' % (listed, args.files))
+
+            print('layout %d (%-10s) create %8.0f files/s   lookup %6.1f us   list %7.1f ms%s' % (
+                version, type(storage_layout.LAYOUTS[version]).__name__.replace('Layout', ''),
+                args.files / create, lookup / args.lookups * 1e6, listing * 1e3,
+                '' if cold else '   (热缓存)'))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+图像，文本视频.py 媒体缓存基准：回访用户文件页时的请求数、传输字节和耗时
+
+    python benchmarks/bench_media_cache.py --images 40 --videos 4 --video-mb 20
+
+造一个用户，--images 张图片（预先生成好派生图）和 --videos 个视频，
+用一个简单的“浏览器缓存”模拟访问 /user/<用户名>：页面里的每张图片取 WebP 640w，
+视频只取开头 1MB（播放器取元数据的 Range 请求）。比较三种回访：
+- 无缓存：每个资源都完整下载（首次访问，或者缓存被清掉）
+- 协商缓存：链接不带版本号，每个资源带 If-None-Match 验证，命中时为 304
+- 版本化链接：max-age + immutable 期间内不发请求，只请求页面本身
+字节数为响应头加响应体。
+"""
+
+import argparse
+import importlib
+import io
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import image_variants  # noqa: E402
+
+VIDEO_HEAD = 1024 * 1024
+
+
+def wire_bytes(resp):
+    headers = sum(len(k) + len(v) + 4 for k, v in resp.headers.items())
+    return len('HTTP/1.1 %s\r\n' % resp.status) + headers + 2 + len(resp.data)
+
+
+def page_resources(html):
+    """页面里浏览器实际会请求的资源：<picture> 取 WebP 640w，视频取 <source>"""
+    urls = []
+    for srcset in re.findall(r'<source type="image/webp" srcset="([^"]+)"', html):
+        for candidate in srcset.split(','):
+            url = candidate.strip().split(' ')[0].replace('&amp;', '&')
+            if 'w=640' in url:
+                urls.append(url)
+    for url in re.findall(r'<source src="([^"]+)" type="video/mp4">', html):
+        urls.append(url.replace('&amp;', '&'))
+    return urls
+
+
+class Browser:
+    """只实现这里用到的缓存规则：immutable 且未过期直接用缓存，否则带 If-None-Match 验证"""
+
+    def __init__(self, client, strip_version=False):
+        self.client = client
+        self.strip_version = strip_version
+        self.cache = {}
+
+    def get(self, url):
+        if self.strip_version:
+            url = re.sub(r'v=[^&]+&?', '', url).rstrip('?&')
+        headers = {'Range': 'bytes=0-%d' % (VIDEO_HEAD - 1)} if '/video/' in url else {}
+        cached = self.cache.get(url)
+        if cached is not None:
+            if 'immutable' in cached['cache_control']:
+                return 0, 0
+            headers['If-None-Match'] = cached['etag']
+        resp = self.client.get(url, headers=headers)
+        assert resp.status_code in (200, 206, 304), (url, resp.status_code)
+        if resp.status_code != 304:
+            self.cache[url] = {'etag': resp.headers.get('ETag'), 'cache_control': resp.headers.get('Cache-Control', '')}
+        return 1, wire_bytes(resp)
+
+    def visit(self, page_url):
+        resp = self.client.get(page_url)
+        requests, total = 1, wire_bytes(resp)
+        for url in page_resources(resp.get_data(as_text=True)):
+            n, b = self.get(url)
+            requests += n
+            total += b
+        return requests, total
+
+
+def timed_visit(make_browser, page_url, repeat, warm):
+    best = None
+    for _ in range(repeat):
+        browser = make_browser()
+        if warm:
+            browser.visit(page_url)
+        t0 = time.perf_counter()
+        requests, total = browser.visit(page_url)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return requests, total, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--image-size', type=int, default=2000, help='原图宽度（像素）')
+    parser.add_argument('--videos', type=int, default=4)
+    parser.add_argument('--video-mb', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)  # users.db 建在当前目录
+    try:
+        app_module = importlib.import_module('图像，文本视频')
+        app = app_module.app
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        app.config['IMAGE_VARIANT_FOLDER'] = app_module.variant_pipeline.cache_dir = os.path.join(workdir, 'variants')
+        app_module.init_db()
+
+        client = app.test_client()
+        client.post('/register', data={'username': 'bench', 'password': 'pw'})
+        client.post('/login', data={'username': 'bench', 'password': 'pw'})
+        app.config['QUOTA_MAX_BYTES'] = None
+        for i in range(args.images):
+            image = Image.effect_noise((args.image_size, args.image_size * 3 // 4), 40 + i).convert('RGB')
+            buf = io.BytesIO()
+            image.save(buf, 'JPEG', quality=85)
+            buf.seek(0)
+            client.post('/upload', data={'file': (buf, 'img%03d.jpg' % i)}, content_type='multipart/form-data')
+        for i in range(args.videos):
+            data = io.BytesIO(os.urandom(args.video_mb * 1024 * 1024))
+            client.post('/upload', data={'file': (data, 'clip%d.mp4' % i)}, content_type='multipart/form-data')
+        # 派生图同步生成好，不让进程池的进度影响计时
+        app_module.variant_pipeline.shutdown()
+        conn = sqlite3.connect(app_module.DATABASE)
+        for (digest, filename) in conn.execute("SELECT sha256, filename FROM files WHERE filetype='image'"):
+            image_variants.generate_variants(os.path.join(app.config['UPLOAD_FOLDER'], 'bench', 'image', filename),
+                                             app.config['IMAGE_VARIANT_FOLDER'], digest)
+        conn.close()
+
+        page_url = '/user/bench'
+        rows = [
+            ('无缓存', lambda: Browser(client), False),
+            ('协商缓存', lambda: Browser(client, strip_version=True), True),
+            ('版本化链接', lambda: Browser(client), True),
+        ]
+        print('%d 张图片，%d 个视频（各取开头 %d KB）' % (args.images, args.videos, VIDEO_HEAD // 1024))
+        for label, make_browser, warm in rows:
+            requests, total, best = timed_visit(make_browser, page_url, args.repeat, warm)
+            print('%-8s %4d 个请求  %10.1f KB  %8.1f ms' % (label, requests, total / 1024, best * 1e3))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+用户名搜索基准：原先的全表 DP-LCS 扫描 vs 倒排索引 + 位并行 LCS
+
+    python benchmarks/bench_search.py --sizes 10000 100000 1000000
+
+1M 用户时旧实现单次查询需要数十秒，可用 --skip-baseline-above 跳过。
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import UserSearchIndex  # noqa: E402
+
+
+def lcs_length(a, b):
+    # 旧实现，原样保留自 app.py
+    dp = [[0]*(len(b)+1) for _ in range(len(a)+1)]
+    for i in range(1, len(a)+1):
+        for j in range(1, len(b)+1):
+            if a[i-1] == b[j-1]:
+                dp[i][j] = dp[i-1][j-1] + 1
+            else:
+                dp[i][j] = max(dp[i-1][j], dp[i][j-1])
+    return dp[len(a)][len(b)]
+
+
+def baseline_search(users, keyword):
+    user_scores = [(u, lcs_length(keyword, u[1])) for u in users]
+    user_scores.sort(key=lambda x: x[1], reverse=True)
+    return [u[0] for u, s in user_scores if s > 0][:10]
+
+
+def make_users(n, rng):
+    alphabet = string.ascii_lowercase + string.digits + '_'
+    return [(i, ''.join(rng.choice(alphabet) for _ in range(rng.randint(4, 14))))
+            for i in range(1, n + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--skip-baseline-above', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    for n in args.sizes:
+        users = make_users(n, rng)
+        keywords = [name[:rng.randint(3, 8)] for _, name in rng.sample(users, args.queries)]
+
+        t0 = time.perf_counter()
+        index = UserSearchIndex()
+        index.add_many(users)
+        build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        results = [[uid for uid, _, _ in index.search(k)] for k in keywords]
+        fast = (time.perf_counter() - t0) / len(keywords)
+
+        line = f'users={n:>8}  build={build:7.2f}s  index={fast * 1000:9.2f}ms/query'
+        if n <= args.skip_baseline_above:
+            t0 = time.perf_counter()
+            expected = [baseline_search(users, k) for k in keywords[:3]]
+            slow = (time.perf_counter() - t0) / 3
+            assert expected == results[:3], 'ranking mismatch'
+            line += f'  baseline={slow * 1000:9.2f}ms/query  speedup={slow / fast:6.1f}x'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
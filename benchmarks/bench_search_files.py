@@ -0,0 +1,136 @@
+"""
+图像，文本视频.py 搜索页基准：SQL 查询次数与响应时间
+
+    python benchmarks/bench_search_files.py --users 200 --texts 5 --text-kb 1024
+
+造 --users 个匹配关键字的用户，每人若干图片/视频记录和 --texts 个 --text-kb KB 的文本文件，
+比较：
+- 旧实现：每个用户一条 SELECT files，渲染时把每个文本文件整个读进页面（在这里按原逻辑重放）
+- 新实现：GET /search，一条联表查询取一页用户及每种类型前几个文件，文本预览来自 files.snippet
+新实现分页，“全部页”为顺着下一页链接取完所有匹配用户的总和。
+"""
+
+import argparse
+import importlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def legacy_search(db_path, upload_folder, q):
+    """重放旧的 search()：N+1 查询，并读出每个文本文件的全部内容"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    queries = 0
+    text_bytes = 0
+    rows = conn.execute('SELECT id, username FROM users WHERE username LIKE ?', ('%' + q + '%',)).fetchall()
+    queries += 1
+    for row in rows:
+        files = conn.execute('SELECT id, filename, filetype FROM files WHERE user_id=?', (row['id'],)).fetchall()
+        queries += 1
+        for f in files:
+            if f['filetype'] == 'text':
+                with open(os.path.join(upload_folder, row['username'], 'text', f['filename']),
+                          'r', encoding='utf-8', errors='ignore') as fp:
+                    fp.read()
+                    text_bytes += os.fstat(fp.fileno()).st_size
+    conn.close()
+    return queries, text_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--others', type=int, default=5000, help='不匹配关键字的用户数')
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--videos', type=int, default=5)
+    parser.add_argument('--texts', type=int, default=5)
+    parser.add_argument('--text-kb', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)  # users.db 建在当前目录
+    try:
+        app_module = importlib.import_module('图像，文本视频')
+        app = app_module.app
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        app_module.init_db()
+
+        line = ('这是一行用来测试搜索预览的文本 lorem ipsum dolor sit amet\n' * 20).encode()
+        body = (line * (args.text_kb * 1024 // len(line) + 1))[:args.text_kb * 1024]
+        conn = sqlite3.connect(app_module.DATABASE)
+        names = ['bench%05d' % i for i in range(args.users)] + ['other%05d' % i for i in range(args.others)]
+        conn.executemany('INSERT INTO users (username, password_hash) VALUES (?, ?)', [(n, 'x') for n in names])
+        files = []
+        for user_id, name in enumerate(names[:args.users], start=1):
+            text_dir = os.path.join(app.config['UPLOAD_FOLDER'], name, 'text')
+            os.makedirs(text_dir)
+            for i in range(args.images):
+                files.append((user_id, 'img%d.png' % i, 'image', 1000, None))
+            for i in range(args.videos):
+                files.append((user_id, 'clip%d.mp4' % i, 'video', 1000, None))
+            for i in range(args.texts):
+                path = os.path.join(text_dir, 'note%d.txt' % i)
+                with open(path, 'wb') as f:
+                    f.write(body)
+                files.append((user_id, 'note%d.txt' % i, 'text', len(body), app_module.read_snippet(path)))
+        conn.executemany('INSERT INTO files (user_id, filename, filetype, size, snippet) VALUES (?, ?, ?, ?, ?)', files)
+        conn.commit()
+        conn.close()
+
+        best = None
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            queries, text_bytes = legacy_search(app_module.DATABASE, app.config['UPLOAD_FOLDER'], 'bench')
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        print('旧实现  全部 %d 个用户  %5d 条查询  读文本 %7.1f MB  %8.1f ms（不含渲染）' % (
+            args.users, queries, text_bytes / 1024 / 1024, best * 1e3))
+
+        # 统计每个请求的 SQL 条数
+        counter = {'n': 0}
+        get_db = app_module.get_db
+
+        def counted_get_db():
+            conn = get_db()
+            conn.set_trace_callback(lambda sql: counter.__setitem__('n', counter['n'] + 1))
+            return conn
+        app_module.get_db = counted_get_db
+
+        client = app.test_client()
+        best_first = best_all = None
+        for _ in range(args.repeat):
+            counter['n'] = 0
+            pages = 0
+            url = '/search?q=bench'
+            t0 = time.perf_counter()
+            while url:
+                resp = client.get(url)
+                assert resp.status_code == 200
+                pages += 1
+                if pages == 1:
+                    first = time.perf_counter() - t0
+                    first_queries = counter['n']
+                html = resp.get_data(as_text=True)
+                marker = html.find('>下一页</a>')
+                url = html[html.rfind('href="', 0, marker) + 6:marker - 1].replace('&amp;', '&') if marker >= 0 else None
+            total = time.perf_counter() - t0
+            best_first = first if best_first is None else min(best_first, first)
+            best_all = total if best_all is None else min(best_all, total)
+        print('新实现  第一页           %5d 条查询  %8.1f ms（含渲染）' % (first_queries, best_first * 1e3))
+        print('新实现  全部 %3d 页       %5d 条查询  %8.1f ms（含渲染）' % (pages, counter['n'], best_all * 1e3))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+视频拖动（seek）基准：/static/videos/<file> vs /stream/<id>
+
+在 WSGI 层直接调用 app，环境中提供一个模拟 sendfile 的 wsgi.file_wrapper：
+响应体若就是该 wrapper，则视为由内核零拷贝发送，不计入用户态拷贝字节；
+否则逐块迭代响应体，统计经过 Python 的字节数和首字节延迟。
+
+    python benchmarks/bench_stream.py --size-mb 256 --seeks 200
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SendfileWrapper:
+    """模拟服务器的 wsgi.file_wrapper；服务器拿到它时走 sendfile"""
+
+    def __init__(self, filelike, blksize=8192):
+        self.filelike = filelike
+        self.blksize = blksize
+
+    def __iter__(self):
+        while True:
+            data = self.filelike.read(self.blksize)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.filelike.close()
+
+
+def run(app, path, range_header):
+    from werkzeug.test import EnvironBuilder
+
+    environ = EnvironBuilder(path=path, headers={'Range': range_header}).get_environ()
+    environ['wsgi.file_wrapper'] = SendfileWrapper
+    status_headers = {}
+
+    def start_response(status, headers, exc_info=None):
+        status_headers['status'] = status
+        status_headers['headers'] = dict(headers)
+
+    t0 = time.perf_counter()
+    body = app.wsgi_app(environ, start_response)
+    copied = 0
+    first = None
+    try:
+        if isinstance(body, SendfileWrapper):
+            first = time.perf_counter() - t0
+        else:
+            for chunk in body:
+                if first is None:
+                    first = time.perf_counter() - t0
+                copied += len(chunk)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return first or 0.0, copied, status_headers['status']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--seeks', type=int, default=200)
+    parser.add_argument('--range-kb', type=int, default=1024)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import app as video_app  # noqa: E402  app.py 在当前目录下创建数据库和上传目录
+
+    app = video_app.app
+    app.static_folder = os.path.join(workdir, 'static')
+    filename = 'bench.mp4'
+    size = args.size_mb * 1024 * 1024
+    with open(os.path.join(video_app.UPLOAD_FOLDER, filename), 'wb') as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.size_mb):
+            f.write(block)
+    conn = video_app.db_pool.acquire()
+    with conn:
+        conn.execute("INSERT INTO users (username, password) VALUES ('bench', 'x')")
+        cur = conn.execute("INSERT INTO videos (user_id, filename, title) VALUES (1, ?, 'bench')", (filename,))
+    video_id = cur.lastrowid
+    video_app.db_pool.release(conn)
+
+    rng = random.Random(0)
+    span = args.range_kb * 1024
+    offsets = [rng.randrange(0, size - span) for _ in range(args.seeks)]
+    targets = [('static', '/static/videos/' + filename), ('stream', '/stream/%d' % video_id)]
+    for name, path in targets:
+        latencies, copied_total = [], 0
+        for off in offsets:
+            first, copied, status = run(app, path, 'bytes=%d-%d' % (off, off + span - 1))
+            assert status.startswith('206'), status
+            latencies.append(first)
+            copied_total += copied
+        latencies.sort()
+        print('%-7s seek p50=%.3fms p99=%.3fms  userspace bytes copied=%d (%.1f MB)' % (
+            name,
+            statistics.median(latencies) * 1000,
+            latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            copied_total, copied_total / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+页面模板渲染基准：render_template_string(内联源码)（旧写法，每次解析+编译）
+vs render_template(注册名)（启动时预编译）
+
+    python benchmarks/bench_templates.py --seconds 2
+
+覆盖 p.py 的首页、搜索结果页、用户视频页，以及 图像，文本视频.py 的
+搜索页和用户文件页。数据库用临时文件，页面数据直接构造。
+"""
+
+import argparse
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def rate(fn, seconds):
+    fn()
+    n = 0
+    deadline = time.perf_counter() + seconds
+    t0 = time.perf_counter()
+    while time.perf_counter() < deadline:
+        fn()
+        n += 1
+    return n / (time.perf_counter() - t0)
+
+
+def report(name, app, render_string, render_name, source, template, context, seconds):
+    with app.test_request_context('/'):
+        before = rate(lambda: render_string(source, **context), seconds)
+        after = rate(lambda: render_name(template, **context), seconds)
+    print('%-24s %9.0f/s -> %9.0f/s  (x%.1f)' % (name, before, after, after / before))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--videos', type=int, default=24)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    try:
+        from flask import render_template, render_template_string
+        from flask_login import AnonymousUserMixin
+
+        p = importlib.import_module('p')
+        user = SimpleNamespace(username='alice', is_authenticated=True)
+        videos = [SimpleNamespace(filename='clip_%03d.mp4' % i) for i in range(args.videos)]
+        results = [{'id': i, 'username': 'alice%d' % i} for i in range(20)]
+        pages = [
+            ('p.py /', p.index_html, 'index.html',
+             dict(videos=videos, next_cursor='clip_023.mp4', search_results=None, keyword=None,
+                  current_user=user)),
+            ('p.py /search', p.index_html, 'index.html',
+             dict(videos=[], search_results=results, keyword='ali', current_user=AnonymousUserMixin())),
+            ('p.py /user/<name>', p.user_videos_html, 'user_videos.html',
+             dict(user=user, videos=videos, next_cursor=None, current_user=AnonymousUserMixin())),
+        ]
+        for name, source, template, context in pages:
+            report(name, p.app, render_template_string, render_template, source, template, context,
+                   args.seconds)
+
+        m = importlib.import_module('图像，文本视频')
+        files = [{'id': i, 'filename': 'f%d.png' % i, 'filetype': 'image'} for i in range(10)]
+        texts = [{'id': i, 'filename': 't%d.txt' % i, 'filetype': 'text'} for i in range(3)]
+        users = [{'id': 1, 'username': 'alice', 'images': files, 'videos': [], 'texts': texts}]
+        pages = [
+            ('图像 /search', m.SEARCH_HTML, 'search.html',
+             dict(users=users, query='ali', get_text_content=lambda u, f: 'hello ' * 50)),
+            ('图像 /user/<name>', m.USER_FILES_HTML, 'user_files.html',
+             dict(username='alice', images=files, videos=[], texts=texts,
+                  get_text_content=lambda u, f: 'hello ' * 50)),
+        ]
+        for name, source, template, context in pages:
+            report(name, m.app, render_template_string, render_template, source, template, context,
+                   args.seconds)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
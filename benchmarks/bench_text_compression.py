@@ -0,0 +1,154 @@
+"""
+图像，文本视频.py 文本压缩存储基准：磁盘占用、传输字节、读取耗时
+
+    python benchmarks/bench_text_compression.py --log-mb 64
+
+语料（尽量接近真实上传的文本）：
+- 源代码：本机 Python 标准库的 .py 文件，每个文件一次上传
+- 访问日志：按 nginx combined 格式生成，IP、路径、UA、耗时随机
+- 中文文本：本仓库的 README 和源文件（中文注释、文档字符串较多）
+全部通过 /upload 上传（上传时压缩），然后统计：
+- 每类语料的原文大小、磁盘上 .gz 大小
+- GET .../raw 在 Accept-Encoding: gzip 与不带时的传输字节和耗时
+- 列表页预览（只解压开头）与分页查看深处一页的耗时
+"""
+
+import argparse
+import glob
+import importlib
+import io
+import os
+import random
+import shutil
+import sys
+import sysconfig
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_pages  # noqa: E402
+
+PATHS = ['/', '/search', '/user/%s', '/user/%s/image/%d.jpg', '/user/%s/video/clip%d.mp4', '/upload', '/login']
+AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148',
+    'Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0',
+    'curl/8.5.0',
+]
+
+
+def access_log(rng, size):
+    out = io.StringIO()
+    t = 1700000000
+    while out.tell() < size:
+        t += rng.randint(0, 3)
+        path = rng.choice(PATHS)
+        if '%s' in path:
+            path = path.replace('%s', 'user%d' % rng.randint(1, 500), 1)
+        if '%d' in path:
+            path = path % rng.randint(1, 10000)
+        out.write('%d.%d.%d.%d - - [%s +0800] "GET %s HTTP/1.1" %d %d "-" "%s" %.3f\n' % (
+            rng.randint(1, 223), rng.randint(0, 255), rng.randint(0, 255), rng.randint(1, 254),
+            time.strftime('%d/%b/%Y:%H:%M:%S', time.gmtime(t)), path, rng.choice((200, 200, 200, 304, 404)),
+            rng.randint(200, 900000), rng.choice(AGENTS), rng.random()))
+    return out.getvalue().encode()
+
+
+def corpus(args):
+    rng = random.Random(7)
+    stdlib = sorted(glob.glob(os.path.join(sysconfig.get_paths()['stdlib'], '*.py')))
+    for path in stdlib[:args.source_files]:
+        with open(path, 'rb') as f:
+            yield '源代码', 'src_' + os.path.basename(path)[:-3] + '.txt', f.read()
+    for i in range(args.logs):
+        yield '访问日志', 'access%d.txt' % i, access_log(rng, args.log_mb * 1024 * 1024 // args.logs)
+    for i, path in enumerate(sorted(glob.glob(os.path.join(ROOT, '*.py'))) + [os.path.join(ROOT, 'README.md')]):
+        with open(path, 'rb') as f:
+            yield '中文文本', 'zh%d.txt' % i, f.read()
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source-files', type=int, default=200)
+    parser.add_argument('--log-mb', type=int, default=64)
+    parser.add_argument('--logs', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)  # users.db 建在当前目录
+    try:
+        app_module = importlib.import_module('图像，文本视频')
+        app = app_module.app
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        app.config['QUOTA_MAX_BYTES'] = app.config['QUOTA_MAX_FILES'] = None
+        app.config['MAX_CONTENT_LENGTH'] = None
+        app_module.init_db()
+        client = app.test_client()
+        client.post('/register', data={'username': 'bench', 'password': 'pw'})
+        client.post('/login', data={'username': 'bench', 'password': 'pw'})
+
+        stats = {}
+        files = []
+        upload_time = 0.0
+        for kind, name, data in corpus(args):
+            t0 = time.perf_counter()
+            resp = client.post('/upload', data={'file': (io.BytesIO(data), name)}, content_type='multipart/form-data')
+            upload_time += time.perf_counter() - t0
+            assert resp.status_code == 302, resp.status_code
+            stored = app_module.stored_path('bench', 'text', name)
+            s = stats.setdefault(kind, [0, 0, 0])
+            s[0] += 1
+            s[1] += len(data)
+            s[2] += os.path.getsize(stored)
+            files.append((kind, name, len(data)))
+
+        print('%-8s %6s %12s %12s %7s' % ('语料', '文件数', '原文', '磁盘', '压缩比'))
+        total_raw = total_disk = 0
+        for kind, (count, raw, disk) in stats.items():
+            total_raw += raw
+            total_disk += disk
+            print('%-8s %6d %10.1f MB %10.1f MB %6.1fx' % (kind, count, raw / 2 ** 20, disk / 2 ** 20, raw / disk))
+        print('%-8s %6d %10.1f MB %10.1f MB %6.1fx  （上传含压缩共 %.1f s）' % (
+            '合计', len(files), total_raw / 2 ** 20, total_disk / 2 ** 20, total_raw / total_disk, upload_time))
+
+        # 传输：每个文件取一次原文
+        for label, headers in (('gzip', {'Accept-Encoding': 'gzip'}), ('identity', {})):
+            def fetch_all():
+                wire = 0
+                for _, name, _ in files:
+                    resp = client.get('/user/bench/text/%s/raw' % name, headers=headers)
+                    wire += len(resp.data)
+                return wire
+            elapsed, wire = best_of(args.repeat, fetch_all)
+            print('GET raw  %-8s  传输 %8.1f MB  %8.1f ms' % (label, wire / 2 ** 20, elapsed * 1e3))
+
+        # 预览只解压开头；分页查看取最大的日志文件最后一页（行索引已建好）
+        elapsed, _ = best_of(args.repeat, lambda: client.get('/user/bench').data)
+        print('列表页（%d 个预览）          %8.1f ms' % (len(files), elapsed * 1e3))
+        kind, name, size = max(files, key=lambda f: f[2])
+        path = app_module.stored_path('bench', 'text', name)
+        total_lines = text_pages.read_page(path, 0, 1)['total_lines']
+        elapsed, _ = best_of(args.repeat, lambda: client.get('/user/bench/text/%s/lines?start=%d' % (
+            name, total_lines - 200)).data)
+        print('查看 %.0f MB 日志的最后一页      %8.1f ms' % (size / 2 ** 20, elapsed * 1e3))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+图像，文本视频.py 全文搜索基准：批量建索引耗时、索引体积、查询延迟
+
+    python benchmarks/bench_text_search.py --total-mb 1024 --file-kb 256
+
+造 --users 个用户共 --total-mb MB 的中英混合文本（按齐夫分布从词表取词），
+用 `flask index-texts` 同样的流程（iter_text_documents + bulk_index）建索引，然后测：
+- 罕见词：只埋在少数文件里的词，走 trigram 索引
+- 常见词：几乎每个文件都有，走索引但要对大量命中排序
+- 两字中文 / 两字英文：不足 3 个字符，退回 LIKE 扫描（取够一页即停）
+每种查询报告 p50 / p99（毫秒）。
+"""
+
+import argparse
+import importlib
+import itertools
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_search  # noqa: E402
+
+HANZI = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+RARE_WORD = '罕见词条qzx'
+
+
+def make_vocabulary(rng, size):
+    words = []
+    for i in range(size):
+        if i % 3 == 0:
+            words.append(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 9))))
+        else:
+            words.append(''.join(rng.choice(HANZI) for _ in range(rng.randint(2, 4))))
+    return words
+
+
+def write_text(path, rng, words, cum_weights, size, plant):
+    out = []
+    n = 0
+    while n < size:
+        line = ' '.join(rng.choices(words, cum_weights=cum_weights, k=40)) + '\n'
+        out.append(line)
+        n += len(line.encode())
+    if plant:
+        out.insert(rng.randrange(len(out)), RARE_WORD + '\n')
+    with open(path, 'wb') as f:
+        f.write(''.join(out).encode()[:size + len(RARE_WORD) * 3])
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--total-mb', type=int, default=1024)
+    parser.add_argument('--file-kb', type=int, default=256)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--vocab', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=200)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--workdir', help='默认为临时目录，结束后删除')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp()
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)  # users.db 建在当前目录
+    try:
+        app_module = importlib.import_module('图像，文本视频')
+        app = app_module.app
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        app_module.init_db()
+
+        rng = random.Random(42)
+        words = make_vocabulary(rng, args.vocab)
+        cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+        n_files = args.total_mb * 1024 // args.file_kb
+        conn = sqlite3.connect(app_module.DATABASE)
+        conn.executemany('INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                         [('user%04d' % i, 'x') for i in range(args.users)])
+        t0 = time.perf_counter()
+        rows = []
+        for i in range(n_files):
+            user = i % args.users
+            text_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'user%04d' % user, 'text')
+            os.makedirs(text_dir, exist_ok=True)
+            name = 'doc%06d.txt' % i
+            path = os.path.join(text_dir, name)
+            write_text(path, rng, words, cum_weights, args.file_kb * 1024, plant=(i % 500 == 7))
+            rows.append((user + 1, name, 'text', os.path.getsize(path)))
+        conn.executemany('INSERT INTO files (user_id, filename, filetype, size) VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+        total = sum(r[3] for r in rows)
+        print('生成 %d 个文件，共 %.1f MB，%.1f s' % (n_files, total / 1024 / 1024, time.perf_counter() - t0))
+
+        db_before = os.path.getsize(app_module.DATABASE)
+        conn.row_factory = sqlite3.Row
+        t0 = time.perf_counter()
+        indexed, _ = text_search.bulk_index(conn, app_module.iter_text_documents(conn), batch=args.batch,
+                                            max_bytes=app.config['TEXT_INDEX_MAX_BYTES'])
+        elapsed = time.perf_counter() - t0
+        index_size = os.path.getsize(app_module.DATABASE) - db_before
+        print('建索引 %d 个文件  %.1f s  %.1f MB/s  索引体积 %.1f MB（原文的 %.2f 倍）' % (
+            indexed, elapsed, total / 1024 / 1024 / elapsed, index_size / 1024 / 1024, index_size / total))
+
+        # 常见词取词表里最高频的几个
+        cases = [
+            ('罕见词', RARE_WORD),
+            ('常见词', max(words[:10], key=len)),
+            ('两字中文', words[1][:2]),
+            ('两字英文', 'qz'),
+        ]
+        page_size = app.config['TEXT_SEARCH_PAGE_SIZE']
+        for label, q in cases:
+            samples = []
+            hits = 0
+            for i in range(args.queries):
+                offset = (i % 3) * page_size
+                t0 = time.perf_counter()
+                results, _ = text_search.search(conn, q, limit=page_size, offset=offset)
+                samples.append(time.perf_counter() - t0)
+                hits = max(hits, len(results))
+            print('%-6s %-14r 一页 %2d 条  p50 %8.1f ms  p99 %8.1f ms' % (
+                label, q, hits, percentile(samples, 0.5) * 1e3, percentile(samples, 0.99) * 1e3))
+        conn.close()
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
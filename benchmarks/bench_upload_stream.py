@@ -0,0 +1,105 @@
+"""
+p.py 流式上传基准：不同大小文件上传时服务端进程的峰值 RSS 与吞吐
+
+    python benchmarks/bench_upload_stream.py --sizes-mb 16 64 256 1024
+
+在子进程里用 werkzeug 起 p.py，客户端用 http.client 边生成边发送 multipart 请求体，
+每次上传后读取服务端 /proc/<pid>/status 的 VmHWM（历史峰值 RSS）。
+"""
+
+import argparse
+import http.client
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER = '''
+import sys
+sys.path.insert(0, %(root)r)
+import p
+from werkzeug.serving import make_server
+p.app.config.update(UPLOAD_FOLDER=%(uploads)r, MAX_CONTENT_LENGTH=None)
+with p.app.app_context():
+    p.db.create_all()
+server = make_server("127.0.0.1", 0, p.app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+'''
+
+
+def peak_rss_mb(pid):
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def request(port, method, path, body=None, headers=None, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    headers = dict(headers or {})
+    if cookie:
+        headers['Cookie'] = cookie
+    conn.request(method, path, body=body, headers=headers)
+    resp = conn.getresponse()
+    resp.read()
+    conn.close()
+    return resp
+
+
+def upload(port, cookie, size_mb):
+    boundary = 'benchboundary'
+    head = ('--%s\r\nContent-Disposition: form-data; name="video_file"; filename="clip.mp4"\r\n'
+            'Content-Type: video/mp4\r\n\r\n' % boundary).encode()
+    tail = ('\r\n--%s--\r\n' % boundary).encode()
+    block = os.urandom(1024 * 1024)
+
+    def body():
+        yield head
+        for _ in range(size_mb):
+            yield block
+        yield tail
+
+    length = len(head) + size_mb * len(block) + len(tail)
+    t0 = time.perf_counter()
+    resp = request(port, 'POST', '/', body=body(), cookie=cookie, headers={
+        'Content-Type': 'multipart/form-data; boundary=' + boundary, 'Content-Length': str(length)})
+    if resp.status != 302:
+        raise SystemExit('upload failed: %d' % resp.status)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[16, 64, 256, 1024])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(workdir, 'bench.db'))
+    server = subprocess.Popen([sys.executable, '-c', SERVER % {'root': ROOT, 'uploads': workdir}],
+                              stdout=subprocess.PIPE, env=env, text=True)
+    try:
+        port = int(server.stdout.readline())
+        form = {'Content-Type': 'application/x-www-form-urlencoded'}
+        creds = urllib.parse.urlencode({'username': 'bench', 'password': 'pw'})
+        request(port, 'POST', '/register', creds, form)
+        resp = request(port, 'POST', '/login', creds, form)
+        cookie = resp.getheader('Set-Cookie').split(';', 1)[0]
+        print('idle            peak RSS %7.1f MB' % peak_rss_mb(server.pid))
+        for size_mb in args.sizes_mb:
+            elapsed = upload(port, cookie, size_mb)
+            print('%6d MB  %7.0f MB/s  peak RSS %7.1f MB' % (size_mb, size_mb / elapsed, peak_rss_mb(server.pid)))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
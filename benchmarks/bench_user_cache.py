@@ -0,0 +1,102 @@
+"""
+p.py 登录用户缓存基准：已登录用户的请求吞吐
+
+    python benchmarks/bench_user_cache.py --requests 5000 --threads 1
+
+比较 USER_CACHE_TTL=0（每次查库）和开启缓存两种情况下单次 load_user 的耗时，以及 req/s：
+- media：GET /uploads/<user>/<file> + 随机 Range（拖动进度条）
+- page：GET /user/<user>（页面里用到 current_user）
+Flask-Login 只在访问 current_user 时才调用 user_loader，所以 media
+请求只有在路由里检查当前用户时才会受益。
+"""
+
+import argparse
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(app, cookie_client, requests, threads, size, page):
+    per_thread = requests // threads
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        client._cookies = cookie_client._cookies
+        for _ in range(per_thread):
+            if page:
+                r = client.get('/user/bench')
+            else:
+                start = rng.randrange(0, size - 65536)
+                r = client.get('/uploads/bench/clip.mp4',
+                               headers={'Range': 'bytes=%d-%d' % (start, start + 65535)})
+            if r.status_code not in (200, 206):
+                errors.append(r.status_code)
+
+    t0 = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    if errors:
+        raise SystemExit('unexpected status codes: %r' % errors[:5])
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--size-mb', type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    try:
+        import p
+
+        p.app.config['UPLOAD_FOLDER'] = workdir
+        with p.app.app_context():
+            p.db.create_all()
+        client = p.app.test_client()
+        client.post('/register', data={'username': 'bench', 'password': 'pw'})
+        client.post('/login', data={'username': 'bench', 'password': 'pw'})
+        size = args.size_mb * 1024 * 1024
+        client.post('/', data={'video_file': (io.BytesIO(os.urandom(size)), 'clip.mp4')},
+                    content_type='multipart/form-data')
+
+        ttl = p.user_cache.ttl
+        for cache_ttl in (0, ttl):
+            p.user_cache.ttl = cache_ttl
+            p.user_cache.clear()
+            t0 = time.perf_counter()
+            for _ in range(args.requests):
+                # 每次都是新的请求上下文（新的 session），和真实请求一样
+                with p.app.test_request_context('/'):
+                    p.load_user('1')
+            print('load_user %-8s %8.1f us/call' % ('cached' if cache_ttl else 'from DB',
+                                                  (time.perf_counter() - t0) / args.requests * 1e6))
+        for name, page in (('media', False), ('page', True)):
+            p.user_cache.ttl = 0
+            p.user_cache.clear()
+            uncached = run(p.app, client, args.requests, args.threads, size, page)
+            p.user_cache.ttl = ttl
+            cached = run(p.app, client, args.requests, args.threads, size, page)
+            print('%-6s load_user from DB %8.0f req/s   cached %8.0f req/s  (x%.2f)' % (
+                name, uncached, cached, cached / uncached))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
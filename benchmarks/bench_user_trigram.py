@@ -0,0 +1,104 @@
+"""
+p.py 用户名搜索基准：trigram 倒排 + 排序 top-N vs 原来的 ilike('%kw%')
+
+    python benchmarks/bench_user_trigram.py --users 1000000 --queries 200
+
+数据直接用 sqlite3 批量写入临时库（和 p.py 的建号事件写出的内容一致），
+然后在 p.py 的应用上下文里分别计时 search_users(kw, 10) 和 ilike(...).all()。
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SYLLABLES = ['ka', 'li', 'mo', 'ra', 'zen', 'to', 'shi', 'an', 'bel', 'chu', 'do', 'fei', 'gu', 'hao',
+             'jin', 'xia', 'yu', 'wei', 'ne', 'qi', 'ste', 'ven', 'mar', 'ia', 'ol', 'son']
+
+
+def make_names(n, rng):
+    names = set()
+    while len(names) < n:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if rng.random() < 0.5:
+            name += str(rng.randint(0, 9999))
+        names.add(name)
+    return sorted(names)
+
+
+def populate(db_path, names, trigrams_fn):
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    with conn:
+        conn.executemany('INSERT INTO "user" (id, username, password_hash) VALUES (?, ?, ?)',
+                         ((i + 1, name, 'x') for i, name in enumerate(names)))
+        conn.executemany('INSERT INTO username_trigram (trigram, name_len, user_id) VALUES (?, ?, ?)',
+                         ((t, len(name), i + 1) for i, name in enumerate(names) for t in trigrams_fn(name)))
+        conn.execute('INSERT INTO username_trigram_df (trigram, df) '
+                     'SELECT trigram, COUNT(*) FROM username_trigram GROUP BY trigram')
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def timed(fn, queries):
+    samples = []
+    for q in queries:
+        t0 = time.perf_counter()
+        fn(q)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    try:
+        import p  # noqa: E402
+
+        with p.app.app_context():
+            p.db.create_all()
+        rng = random.Random(1)
+        t0 = time.perf_counter()
+        names = make_names(args.users, rng)
+        populate(db_path, names, p.username_trigrams)
+        print('users=%d  build=%.1fs' % (args.users, time.perf_counter() - t0))
+
+        queries = []
+        for _ in range(args.queries):
+            name = rng.choice(names)
+            length = rng.randint(2, min(6, len(name)))
+            start = rng.randint(0, len(name) - length)
+            queries.append(name[start:start + length])
+
+        with p.app.app_context():
+            ilike = timed(lambda q: p.User.query.filter(p.User.username.ilike(f'%{q}%')).all(), queries)
+            trigram = timed(lambda q: p.search_users(q, limit=args.limit,
+                                                     scan_limit=p.app.config['SEARCH_SUGGEST_SCAN_LIMIT']),
+                            queries)
+            suggest = timed(lambda q: p.app.test_client().get('/search/suggest', query_string={'q': q}),
+                            queries)
+        print('ilike(%%kw%%).all()        p50 %8.2f ms  p99 %8.2f ms' % ilike)
+        print('search_users top-%-3d     p50 %8.2f ms  p99 %8.2f ms' % ((args.limit,) + trigram))
+        print('GET /search/suggest      p50 %8.2f ms  p99 %8.2f ms' % suggest)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
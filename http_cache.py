@@ -0,0 +1,47 @@
+"""
+媒体文件的 HTTP 缓存：强 ETag、304 短路、带版本号的 immutable URL
+
+ETag 由文件大小和 mtime_ns 组成，只需要 stat，不用打开文件。
+上传时把同样的两个值存进 files 表，页面里的媒体链接带上 ?v=<版本>（与 ETag 相同）：
+- v 与当前文件一致：内容不会再变（覆盖上传后版本号跟着变，链接也变），
+  返回 Cache-Control: public, max-age=一年, immutable，回访时浏览器不再发请求
+- 没有 v 或 v 已过期（旧链接、旧记录）：no-cache，每次用 If-None-Match 验证，命中时返回 304
+"""
+
+from flask import request
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def make_etag(st):
+    return '%x-%x' % (st.st_size, st.st_mtime_ns)
+
+
+def version(size, mtime_ns):
+    """files 表里记录的版本号，没有记录时为 None（链接不带 v）"""
+    if size is None or mtime_ns is None:
+        return None
+    return '%x-%x' % (size, mtime_ns)
+
+
+def is_not_modified(etag, mtime):
+    """按 If-None-Match（优先）或 If-Modified-Since 判断客户端缓存是否仍然有效"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def apply(response, etag, mtime, immutable, max_age=IMMUTABLE_MAX_AGE):
+    response.set_etag(etag)
+    response.last_modified = int(mtime)
+    # 整个替换掉 send_file 默认的 Cache-Control
+    if immutable:
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % max_age
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def not_modified_response(app, etag, mtime, immutable, max_age=IMMUTABLE_MAX_AGE):
+    return apply(app.response_class(status=304), etag, mtime, immutable, max_age)
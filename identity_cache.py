@@ -0,0 +1,87 @@
+"""
+登录用户的进程内缓存（LRU + TTL）
+
+Flask-Login 每个请求都调用 user_loader，拖动进度条时每个 Range 请求都会查一次库。
+这里按用户 id 缓存加载结果，失效靠“版本号”：
+- 每个 id 映射到版本数组中的一个槽（id % slots），缓存条目记下写入时的版本
+- invalidate(id) 把槽内版本加一，版本不一致的条目视为失效
+- 给定 shared_path 时版本数组放在 mmap 的共享文件里（如 /dev/shm 下），
+  同一台机器上的多个 worker 进程互相可见；加一时用 flock 串行化
+缓存的数据本身仍在各进程内，失效广播只是改一个 8 字节整数。
+
+加载流程：先取 version(id)，再查库，最后 put(id, 值, 该版本)。
+这样查库期间发生的失效不会被写进缓存。
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+_SLOT = struct.Struct('Q')
+
+
+class IdentityCache:
+    def __init__(self, maxsize=10000, ttl=60.0, shared_path=None, slots=1 << 16):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.slots = slots
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fd = None
+        if shared_path:
+            self._fd = os.open(shared_path, os.O_RDWR | os.O_CREAT, 0o600)
+            size = slots * _SLOT.size
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._versions = mmap.mmap(self._fd, size)
+        else:
+            self._versions = bytearray(slots * _SLOT.size)
+
+    def _offset(self, key):
+        return (int(key) % self.slots) * _SLOT.size
+
+    def version(self, key):
+        return _SLOT.unpack_from(self._versions, self._offset(key))[0]
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, version, expires = entry
+            if expires < now or version != self.version(key):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, version):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        offset = self._offset(key)
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            current = _SLOT.unpack_from(self._versions, offset)[0]
+            _SLOT.pack_into(self._versions, offset, (current + 1) & 0xFFFFFFFFFFFFFFFF)
+        finally:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,160 @@
+"""
+图片的多尺寸派生图（WebP + JPEG）
+
+上传后把原图提交到有界的进程池，按 WIDTHS 生成若干宽度的 WebP 和 JPEG，
+缓存路径为 <缓存目录>/ab/<sha256>_<宽度>.<webp|jpg>：按内容哈希和宽度命名，
+同样内容的图片只生成一次，重新上传同名文件时哈希变了自然换成新文件。
+原图比某个宽度小时不放大，该宽度直接用原图宽度生成。
+
+早于本功能上传的图片在第一次被请求时才生成（ensure()）：
+- 同一进程内按哈希合并为一个任务，多个请求等同一个 future
+- 子进程生成前对 <sha256>.lock 加 flock，多个 worker 进程同时请求同一张图时
+  后到的等前一个写完，检查文件已存在就直接返回
+"""
+
+import fcntl
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (320, 640, 1280)
+FORMATS = {'webp': '.webp', 'jpeg': '.jpg'}
+# 动图和其他格式直接用原图
+SOURCE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+
+def variant_path(cache_dir, digest, width, fmt):
+    return os.path.join(cache_dir, digest[:2], '%s_%d%s' % (digest, width, FORMATS[fmt]))
+
+
+def snap_width(width):
+    """把请求的宽度归到 WIDTHS 中不小于它的最小值，避免任意宽度撑爆缓存"""
+    for w in WIDTHS:
+        if width <= w:
+            return w
+    return WIDTHS[-1]
+
+
+def _save(image, path, fmt):
+    tmp = path + '.tmp-' + uuid.uuid4().hex[:8]
+    if fmt == 'webp':
+        image.save(tmp, 'WEBP', quality=78, method=4)
+    else:
+        image.save(tmp, 'JPEG', quality=82, optimize=True, progressive=True)
+    os.replace(tmp, path)
+
+
+def generate_variants(src_path, cache_dir, digest, widths=WIDTHS):
+    """在子进程中运行：生成全部宽度和格式，已存在的跳过；返回生成的文件数"""
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.join(cache_dir, digest[:2]), exist_ok=True)
+    lock_fd = os.open(os.path.join(cache_dir, digest[:2], digest + '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        todo = [(w, fmt) for w in widths for fmt in FORMATS
+                if not os.path.exists(variant_path(cache_dir, digest, w, fmt))]
+        if not todo:
+            return 0
+        with Image.open(src_path) as im:
+            # 手机照片的方向写在 EXIF 里，先转正；只要 RGB，丢掉透明通道（JPEG 不支持）
+            image = ImageOps.exif_transpose(im)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            else:
+                image = image.convert('RGB')
+            # 从大到小缩放，每一级从上一级缩，比每次都从原图缩快
+            current = image
+            for w in sorted({w for w, _ in todo}, reverse=True):
+                if current.width > w:
+                    h = max(1, round(current.height * w / current.width))
+                    current = current.resize((w, h), Image.LANCZOS, reducing_gap=3.0)
+                for fmt in FORMATS:
+                    if (w, fmt) in todo:
+                        _save(current, variant_path(cache_dir, digest, w, fmt), fmt)
+        return len(todo)
+    finally:
+        os.close(lock_fd)
+
+
+def image_size(path):
+    """只读文件头取原图宽高，读不出来时返回 (None, None)"""
+    try:
+        from PIL import Image
+        with Image.open(path) as im:
+            width, height = im.size
+            # EXIF 方向为旋转 90/270 度时，显示的宽高与存储的相反
+            if im.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+    except Exception:
+        return None, None
+
+
+class VariantPipeline:
+    """有界的派生图任务队列，同一个哈希同时只有一个任务"""
+
+    def __init__(self, cache_dir, max_workers=2, max_pending=64):
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = {}
+        self._failed = set()  # 生成失败的哈希（损坏的图片），本进程内不再重试
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, digest, src_path):
+        """提交任务；已在排队时返回同一个 future，队列已满时返回 None"""
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None:
+                return future
+            if len(self._pending) >= self.max_pending:
+                return None
+            future = self._get_executor().submit(generate_variants, src_path, self.cache_dir, digest)
+            self._pending[digest] = future
+        future.add_done_callback(lambda f: self._finish(digest, f))
+        return future
+
+    def _finish(self, digest, future):
+        error = future.exception()
+        with self._lock:
+            self._pending.pop(digest, None)
+            if error is not None:
+                self._failed.add(digest)
+        if error is not None:
+            logger.error('生成派生图失败: %s', digest, exc_info=error)
+
+    def ensure(self, digest, src_path, width, fmt, timeout=5.0):
+        """返回派生图路径；还没有时提交（或加入已有的）任务并等待，超时、失败或队列满时返回 None"""
+        path = variant_path(self.cache_dir, digest, width, fmt)
+        if os.path.exists(path):
+            return path
+        if digest in self._failed:
+            return None
+        future = self.submit(digest, src_path)
+        if future is None:
+            return None
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            # 超时或生成失败，这次先用原图
+            return None
+        return path if os.path.exists(path) else None
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,199 @@
+"""
+视频字节流服务：HTTP Range / 206 / If-Range / ETag
+
+浏览器拖动进度条或 preload="metadata" 时会发出大量 Range 请求。
+这里直接按请求的字节区间返回文件内容：
+- 单区间：区间一直到文件末尾时，定位到起点后交给 wsgi.file_wrapper
+  （gunicorn / waitress / mod_wsgi 可使用 sendfile 零拷贝）；file_wrapper 会读到 EOF，
+  不以 Content-Length 为界，所以中间区间和没有 file_wrapper 时都用 os.pread
+  分块读取，每块不超过 chunk_size。
+- 多区间：返回 multipart/byteranges，逐块生成。
+"""
+
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import Response, request
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def make_etag(st):
+    """由 inode、大小、修改时间构造强 ETag（不读取文件内容）"""
+    return '"%x-%x-%x"' % (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def parse_range(header, size):
+    """
+    解析 Range 头，返回 [(start, end), ...]（end 包含在内）。
+    头无法识别时返回 None（按整体文件处理），所有区间都越界时抛 RangeNotSatisfiable。
+    """
+    if not header:
+        return None
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        try:
+            if first == '':
+                # 后缀区间：最后 N 个字节
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and start > end:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size and start <= end:
+            ranges.append((start, end))
+    if not ranges:
+        raise RangeNotSatisfiable()
+    if len(ranges) > MAX_RANGES:
+        # 区间过多时合并为一个覆盖区间，防止被用来放大请求
+        ranges = [(min(r[0] for r in ranges), max(r[1] for r in ranges))]
+    return ranges
+
+
+def _if_range_matches(value, etag, mtime):
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith('"') or value.startswith('W/'):
+        # If-Range 要求强比较
+        return value == etag
+    try:
+        return int(parsedate_to_datetime(value).timestamp()) >= int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+def _etag_in(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tags = [t.strip() for t in header.split(',')]
+    weak = etag if etag.startswith('W/') else 'W/' + etag
+    return etag in tags or weak in tags
+
+
+class RangeBody:
+    """
+    按段输出文件内容的响应体。segments 中每项为 bytes（原样输出）
+    或 (offset, length)（用 os.pread 分块读取）。
+    用类而不是生成器，保证响应未被迭代（如 HEAD）时 close() 也会关闭文件。
+    """
+
+    def __init__(self, fd, segments, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.fd = fd
+        self.segments = segments
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        for seg in self.segments:
+            if isinstance(seg, bytes):
+                yield seg
+                continue
+            offset, remaining = seg
+            while remaining > 0:
+                data = os.pread(self.fd, min(self.chunk_size, remaining), offset)
+                if not data:
+                    return
+                offset += len(data)
+                remaining -= len(data)
+                yield data
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def send_ranged_file(path, mimetype='application/octet-stream', chunk_size=DEFAULT_CHUNK_SIZE,
+                     cache_control='public, max-age=3600'):
+    """按当前请求的 Range 头返回文件的全部或部分内容"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return Response(status=404)
+    st = os.fstat(fd)
+    size = st.st_size
+    etag = make_etag(st)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': formatdate(st.st_mtime, usegmt=True),
+        'Cache-Control': cache_control,
+    }
+
+    if _etag_in(request.headers.get('If-None-Match'), etag):
+        os.close(fd)
+        return Response(status=304, headers=headers)
+
+    ranges = None
+    if _if_range_matches(request.headers.get('If-Range'), etag, st.st_mtime):
+        try:
+            ranges = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            os.close(fd)
+            headers['Content-Range'] = 'bytes */%d' % size
+            return Response(status=416, headers=headers)
+
+    if ranges is None:
+        return _single_part(fd, 0, size, size, mimetype, headers, chunk_size, status=200)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        return _single_part(fd, start, end - start + 1, size, mimetype, headers, chunk_size, status=206)
+    return _multi_part(fd, ranges, size, mimetype, headers, chunk_size)
+
+
+def _single_part(fd, start, length, size, mimetype, headers, chunk_size, status):
+    headers['Content-Length'] = str(length)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and start + length == size:
+        # file_wrapper 一直读到 EOF，只在区间恰好到文件末尾时使用，可走 sendfile
+        f = os.fdopen(fd, 'rb', buffering=0)
+        f.seek(start)
+        body = file_wrapper(f, chunk_size)
+    else:
+        body = RangeBody(fd, [(start, length)], chunk_size)
+    return Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
+
+
+def _multi_part(fd, ranges, size, mimetype, headers, chunk_size):
+    boundary = uuid.uuid4().hex
+    segments = []
+    length = 0
+    for start, end in ranges:
+        head = ('\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+                % (boundary, mimetype, start, end, size)).encode('ascii')
+        segments.append(head)
+        segments.append((start, end - start + 1))
+        length += len(head) + end - start + 1
+    tail = ('\r\n--%s--\r\n' % boundary).encode('ascii')
+    segments.append(tail)
+    length += len(tail)
+
+    headers['Content-Length'] = str(length)
+    return Response(RangeBody(fd, segments, chunk_size), status=206, headers=headers,
+                    direct_passthrough=True, content_type='multipart/byteranges; boundary=' + boundary)
@@ -0,0 +1,300 @@
+"""
+运行时指标：请求耗时、SQL 耗时、模板渲染耗时、视频字节数
+
+所有指标保存在进程内，/metrics 以 Prometheus 文本格式输出。
+- init_app(app)：请求中间件 + 模板渲染信号 + /metrics 路由
+- TimedConnection：sqlite3.connect(..., factory=TimedConnection) 后按语句形状统计耗时
+- instrument_sqlalchemy()：监听 SQLAlchemy Engine 的执行事件
+- 可选的采样剖析：METRICS_PROFILE_SLOW_MS 大于 0 时，后台线程定时采集
+  正在处理请求的线程栈，超过阈值的请求把折叠栈（flamegraph.pl 可直接读取）
+  写到 METRICS_PROFILE_DIR，只保留最慢的 METRICS_PROFILE_KEEP 个
+"""
+
+import bisect
+import heapq
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter as _Counter
+from functools import lru_cache
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append('%s="%s"' % extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [各桶计数..., +Inf 计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for labelvalues, series in sorted(items):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), series):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket%s %d' % (self.name, _labels(self.labelnames, labelvalues, ('le', le)),
+                                                 cumulative))
+            lines.append('%s_sum%s %r' % (self.name, _labels(self.labelnames, labelvalues), series[-1]))
+            lines.append('%s_count%s %d' % (self.name, _labels(self.labelnames, labelvalues), cumulative))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s counter' % self.name]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append('%s%s %r' % (self.name, _labels(self.labelnames, labelvalues), value))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_LATENCY = REGISTRY.histogram('http_request_duration_seconds', '请求处理耗时',
+                                     ('endpoint', 'method', 'status'))
+SQL_LATENCY = REGISTRY.histogram('sql_query_duration_seconds', '按语句形状统计的 SQL 执行耗时', ('shape',))
+TEMPLATE_RENDER = REGISTRY.histogram('template_render_duration_seconds', '模板渲染耗时', ('template',))
+BYTES_SERVED = REGISTRY.counter('media_bytes_served_total', '媒体路由返回的字节数', ('endpoint',))
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=1024)
+def query_shape(sql):
+    """去掉字面量、合并 IN (?, ?, ...) 和空白，作为低基数的指标标签"""
+    shape = _LITERALS.sub('?', sql)
+    shape = _IN_LISTS.sub('IN (...)', shape)
+    return _SPACES.sub(' ', shape).strip()[:200]
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - t0, query_shape(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - t0, query_shape(sql))
+
+
+class TimedConnection(sqlite3.Connection):
+    """conn.execute 与 conn.cursor().execute 都会被计时"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - t0, query_shape(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - t0, query_shape(sql))
+
+
+def instrument_sqlalchemy():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info['metrics_start'].pop()
+        SQL_LATENCY.observe(time.perf_counter() - start, query_shape(statement))
+
+
+class SamplingProfiler:
+    """定时采集请求线程的调用栈，慢请求输出折叠栈文件"""
+
+    def __init__(self, directory, threshold, keep=20, interval=0.005):
+        self.directory = directory
+        self.threshold = threshold
+        self.keep = keep
+        self.interval = interval
+        self._active = {}   # 线程 id -> Counter(折叠栈)
+        self._slowest = []  # 小顶堆 (耗时, 文件路径)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self._run, name='metrics-profiler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in active:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                                 frame.f_lineno))
+                    frame = frame.f_back
+                stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        with self._lock:
+            self._active[threading.get_ident()] = _Counter()
+
+    def stop(self, elapsed, label):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+            if not stacks or elapsed < self.threshold:
+                return
+            if len(self._slowest) >= self.keep and elapsed <= self._slowest[0][0]:
+                return
+            path = os.path.join(self.directory, '%d-%s-%dms.folded' % (
+                time.time() * 1000, re.sub(r'[^\w.-]', '_', label), elapsed * 1000))
+            heapq.heappush(self._slowest, (elapsed, path))
+            evicted = heapq.heappop(self._slowest)[1] if len(self._slowest) > self.keep else None
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+        if evicted:
+            try:
+                os.remove(evicted)
+            except FileNotFoundError:
+                pass
+
+
+def init_app(app, video_endpoints=()):
+    """挂载请求计时、模板计时和 /metrics；video_endpoints 中的路由额外统计返回字节数"""
+    from flask import Response, before_render_template, g, request, template_rendered
+
+    video_endpoints = set(video_endpoints)
+    render_starts = threading.local()
+    profiler = None
+    slow_ms = app.config.get('METRICS_PROFILE_SLOW_MS', 0)
+    if slow_ms:
+        profiler = SamplingProfiler(app.config.get('METRICS_PROFILE_DIR', 'profiles'), slow_ms / 1000,
+                                    keep=app.config.get('METRICS_PROFILE_KEEP', 20))
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+        if profiler is not None:
+            profiler.start()
+
+    @app.after_request
+    def _count_bytes(response):
+        g._metrics_status = response.status_code
+        endpoint = request.endpoint or 'unknown'
+        if endpoint in video_endpoints and response.content_length:
+            BYTES_SERVED.inc(response.content_length, endpoint)
+        return response
+
+    @app.teardown_request
+    def _record(exc):
+        # 视图抛异常时 after_request 不一定执行，计时和结束采样放在 teardown 里才不会漏掉 5xx
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        status = '5xx' if exc is not None else '%dxx' % (g.pop('_metrics_status', 500) // 100)
+        REQUEST_LATENCY.observe(elapsed, endpoint, request.method, status)
+        if profiler is not None:
+            profiler.stop(elapsed, endpoint)
+
+    def _before_render(sender, template, context, **extra):
+        stack = getattr(render_starts, 'stack', None)
+        if stack is None:
+            stack = render_starts.stack = []
+        stack.append(time.perf_counter())
+
+    def _rendered(sender, template, context, **extra):
+        stack = getattr(render_starts, 'stack', None)
+        if stack:
+            TEMPLATE_RENDER.observe(time.perf_counter() - stack.pop(), template.name or '<string>')
+
+    before_render_template.connect(_before_render, app, weak=False)
+    template_rendered.connect(_rendered, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
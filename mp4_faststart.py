@@ -0,0 +1,240 @@
+"""
+MP4/MOV faststart：把位于文件末尾的 moov 移到 mdat 之前
+
+很多手机和剪辑软件导出的 MP4 把 moov（索引）写在最后，浏览器必须先取到文件尾部
+才能开始播放。这里只解析顶层 box，把 moov 读进内存（通常只有几百 KB），
+修正其中 stco/co64 的块偏移后写到 mdat 前面；mdat 等其余数据按区间直接复制
+（copy_file_range / 定长缓冲），不重新编码也不整体读入内存。
+结果先写到同目录临时文件，再 os.replace 原子替换。
+"""
+
+import os
+import struct
+import uuid
+
+FASTSTART_EXTENSIONS = {'mp4', 'mov', 'm4v'}
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# 需要向下递归才能找到 stco/co64 的容器 box
+_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+
+class FaststartError(Exception):
+    pass
+
+
+def _read_exact(fd, length, offset):
+    data = os.pread(fd, length, offset)
+    if len(data) != length:
+        raise FaststartError('文件被截断')
+    return data
+
+
+def top_level_boxes(fd, file_size):
+    """返回顶层 box 列表 [(类型, 起始偏移, 总长度), ...]"""
+    boxes = []
+    offset = 0
+    while offset + 8 <= file_size:
+        size, box_type = struct.unpack('>I4s', _read_exact(fd, 8, offset))
+        if size == 1:
+            size = struct.unpack('>Q', _read_exact(fd, 8, offset + 8))[0]
+        elif size == 0:
+            size = file_size - offset
+        if size < 8 or offset + size > file_size:
+            raise FaststartError('box 长度无效: %r' % box_type)
+        boxes.append((box_type, offset, size))
+        offset += size
+    return boxes
+
+
+def needs_faststart(path):
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        boxes = top_level_boxes(fd, os.fstat(fd).st_size)
+    return _moov_after_mdat(boxes)
+
+
+def _moov_after_mdat(boxes):
+    types = [b[0] for b in boxes]
+    if b'moov' not in types or b'mdat' not in types or b'moof' in types:
+        # 没有索引、没有数据或是分片 MP4，不处理
+        return False
+    return types.index(b'moov') > types.index(b'mdat')
+
+
+def _parse_children(data):
+    children = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header or offset + size > len(data):
+            raise FaststartError('moov 内部 box 长度无效')
+        payload = data[offset + header:offset + size]
+        if box_type in _CONTAINERS:
+            children.append([box_type, _parse_children(payload)])
+        else:
+            children.append([box_type, payload])
+        offset += size
+    return children
+
+
+def _serialize(children):
+    out = []
+    for box_type, body in children:
+        payload = _serialize(body) if isinstance(body, list) else body
+        size = len(payload) + 8
+        if size > 0xFFFFFFFF:
+            out.append(struct.pack('>I4sQ', 1, box_type, size + 8))
+        else:
+            out.append(struct.pack('>I4s', size, box_type))
+        out.append(payload)
+    return b''.join(out)
+
+
+def _walk_chunk_offset_boxes(children):
+    for box in children:
+        if isinstance(box[1], list):
+            yield from _walk_chunk_offset_boxes(box[1])
+        elif box[0] in (b'stco', b'co64'):
+            yield box
+
+
+def _read_offsets(box):
+    version_flags, count = struct.unpack_from('>II', box[1], 0)
+    fmt = '>%d%s' % (count, 'Q' if box[0] == b'co64' else 'I')
+    return version_flags, list(struct.unpack_from(fmt, box[1], 8))
+
+
+def _write_offsets(box, version_flags, offsets):
+    fmt = '>%d%s' % (len(offsets), 'Q' if box[0] == b'co64' else 'I')
+    box[1] = struct.pack('>II', version_flags, len(offsets)) + struct.pack(fmt, *offsets)
+
+
+def _upgrade_to_co64(children):
+    for box in _walk_chunk_offset_boxes(children):
+        if box[0] == b'stco':
+            version_flags, offsets = _read_offsets(box)
+            box[0] = b'co64'
+            _write_offsets(box, version_flags, offsets)
+
+
+def _shift_offsets(children, regions):
+    """
+    修正块偏移：regions 为 [(起始, 结束, 后移字节数), ...]，原先位于 [起始, 结束) 的数据
+    整体后移对应字节数（各区间互不重叠，一次遍历完成，避免重复平移）。
+    32 位 stco 放不下时返回 False（调用方改用 co64 重试）。
+    """
+    for box in _walk_chunk_offset_boxes(children):
+        version_flags, offsets = _read_offsets(box)
+        shifted = []
+        for o in offsets:
+            for region_start, region_end, shift in regions:
+                if region_start <= o < region_end:
+                    o += shift
+                    break
+            shifted.append(o)
+        if box[0] == b'stco' and any(o > 0xFFFFFFFF for o in shifted):
+            return False
+        _write_offsets(box, version_flags, shifted)
+    return True
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _copy_range(src_fd, dst_fd, offset, length):
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    while length > 0:
+        n = 0
+        if copy_file_range is not None:
+            try:
+                n = copy_file_range(src_fd, dst_fd, min(length, 1 << 30), offset)
+            except OSError:
+                copy_file_range = None
+        if not n:
+            data = os.pread(src_fd, min(COPY_BUFFER_SIZE, length), offset)
+            if not data:
+                raise FaststartError('复制时文件被截断')
+            _write_all(dst_fd, data)
+            n = len(data)
+        offset += n
+        length -= n
+
+
+def faststart(path):
+    """需要时就地把 moov 移到文件前部，返回是否做了改动"""
+    with open(path, 'rb') as src:
+        fd = src.fileno()
+        boxes = top_level_boxes(fd, os.fstat(fd).st_size)
+        if not _moov_after_mdat(boxes):
+            return False
+        moov_index = next(i for i, b in enumerate(boxes) if b[0] == b'moov')
+        _, moov_start, moov_size = boxes[moov_index]
+        if moov_size > MAX_MOOV_SIZE:
+            raise FaststartError('moov 过大')
+        raw = _read_exact(fd, moov_size, moov_start)
+        header = 16 if struct.unpack_from('>I', raw, 0)[0] == 1 else 8
+        moov = [[b'moov', _parse_children(raw[header:])]]
+        if any(box[0] == b'cmov' for box in moov[0][1]):
+            raise FaststartError('不支持压缩的 moov')
+
+        # moov 插到第一个 mdat 之前，两者之间（含 mdat）的数据后移 len(新moov)；
+        # 原 moov 之后若还有数据（如第二个 mdat），只后移新旧 moov 的长度差
+        insert_index = next(i for i, b in enumerate(boxes) if b[0] == b'mdat')
+        insert_at = boxes[insert_index][1]
+        # 修正偏移不改变 moov 大小；stco 溢出时全部换成 co64（moov 变大）后重算
+        for force_co64 in (False, True):
+            trial = [[b'moov', _copy_tree(moov[0][1])]]
+            if force_co64:
+                _upgrade_to_co64(trial)
+            new_size = len(_serialize(trial))
+            regions = [(insert_at, moov_start, new_size),
+                       (moov_start + moov_size, float('inf'), new_size - moov_size)]
+            if _shift_offsets(trial, regions):
+                break
+        new_moov = _serialize(trial)
+
+        tmp = '%s.faststart-%s' % (path, uuid.uuid4().hex[:8])
+        out_fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            _copy_range(fd, out_fd, 0, insert_at)
+            _write_all(out_fd, new_moov)
+            for i, (box_type, start, size) in enumerate(boxes):
+                if i < insert_index or i == moov_index:
+                    continue
+                _copy_range(fd, out_fd, start, size)
+            os.fsync(out_fd)
+        except BaseException:
+            os.close(out_fd)
+            os.remove(tmp)
+            raise
+        os.close(out_fd)
+    os.replace(tmp, path)
+    return True
+
+
+def _copy_tree(children):
+    return [[t, _copy_tree(b) if isinstance(b, list) else b] for t, b in children]
+
+
+def try_faststart(path, logger=None, filename=None):
+    """上传流程中使用：只处理 MP4/MOV（按 filename 或 path 的扩展名判断），失败时保留原文件"""
+    ext = (filename or path).rsplit('.', 1)[-1].lower()
+    if ext not in FASTSTART_EXTENSIONS:
+        return False
+    try:
+        return faststart(path)
+    except (FaststartError, OSError, struct.error) as e:
+        if logger is not None:
+            logger.warning('faststart 处理失败，保留原文件 %s: %s', path, e)
+        return False
@@ -2,23 +2,40 @@
 flask db init
 flask db migrate -m "init"
 flask db upgrade
+flask reconcile-videos   # 从已有的 static/uploads 目录补齐 Video 表
+flask migrate-layout     # 把平铺的用户目录在线迁移到分片布局
 """
 
 
+import heapq
 import os
+import time
+from datetime import datetime
+import click
 from flask import (
-    Flask, render_template_string, redirect,
-    url_for, flash, request, send_from_directory, abort
+    Flask, Request, render_template, redirect,
+    url_for, flash, request, send_from_directory, jsonify, abort
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session, object_session
 from flask_migrate import Migrate
 from flask_login import (
     LoginManager, UserMixin,
     login_user, logout_user,
     login_required, current_user
 )
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from mp4_faststart import try_faststart
+from identity_cache import IdentityCache
+from streaming_upload import UploadSink
+import quota
+import storage_layout
+import metrics
+import template_registry
+import zip_stream
 
 # -----------------------
 # CONFIGURATION
@@ -29,13 +46,34 @@ UPLOAD_ROOT = os.path.join(BASE_DIR, "static", "uploads")
 app = Flask(__name__)
 app.config.update(
     SECRET_KEY="devsecret",
-    SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(BASE_DIR, "app.db"),
+    SQLALCHEMY_DATABASE_URI=os.environ.get("DATABASE_URL", "sqlite:///" + os.path.join(BASE_DIR, "app.db")),
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
     UPLOAD_FOLDER=UPLOAD_ROOT,
     MAX_CONTENT_LENGTH=200 * 1024 * 1024,  # 200MB
-    ALLOWED_EXTENSIONS={"mp4", "mov", "avi", "mkv"}
+    ALLOWED_EXTENSIONS={"mp4", "mov", "avi", "mkv"},
+    UPLOAD_FSYNC="file",  # none / file / full（连目录一起 fsync），见 streaming_upload.py
+    STORAGE_LAYOUT=storage_layout.LATEST,  # 新上传文件使用的目录布局，见 storage_layout.py
+    QUOTA_MAX_BYTES=5 * 1024 * 1024 * 1024,  # 每个用户的存储配额，None 为不限制
+    QUOTA_MAX_FILES=500,
+    QUOTA_RECONCILE_INTERVAL=3600,  # 后台按 Video 表重算用量计数器的间隔（秒）
+    # 慢请求采样剖析阈值（毫秒），0 为关闭
+    METRICS_PROFILE_SLOW_MS=int(os.environ.get("METRICS_PROFILE_SLOW_MS", 0)),
+    VIDEOS_PAGE_SIZE=24,  # 视频列表每页条数
+    TEMPLATE_CACHE_DIR=None,  # jinja 字节码缓存目录，None 为系统临时目录
+    USER_CACHE_TTL=60,  # 登录用户缓存秒数，0 为不缓存
+    USER_CACHE_SIZE=10000,
+    # 多 worker 部署时设为同一个本机文件（如 /dev/shm/video-user-cache），失效在进程间可见
+    USER_CACHE_SHARED_PATH=os.environ.get("USER_CACHE_SHARED_PATH"),
+    SEARCH_RESULTS_LIMIT=50,  # 搜索页最多返回的用户数
+    SEARCH_SUGGEST_LIMIT=10,  # 自动补全条数
+    SEARCH_SCAN_LIMIT=2000,  # 每轮最多扫描的候选数，保证热门子串的查询耗时有上界
+    SEARCH_SUGGEST_SCAN_LIMIT=300,
 )
 
+# 请求/SQL/模板耗时与视频字节数，/metrics 输出 Prometheus 文本
+metrics.init_app(app, video_endpoints={"uploaded_file"})
+metrics.instrument_sqlalchemy()
+
 # 确保上传目录存在
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
@@ -57,15 +95,143 @@ class User(UserMixin, db.Model):
     def check_password(self, pwd):
         return check_password_hash(self.password_hash, pwd)
 
+# 用户名前缀搜索按 lower(username) 范围扫描
+db.Index("ix_user_username_lower", db.func.lower(User.username))
+
+# 每个用户的存储用量计数器，与 Video 记录在同一个事务里增减，见 quota.py
+class UserUsage(db.Model):
+    __tablename__ = "user_usage"
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    files = db.Column(db.Integer, nullable=False, default=0)
+    reconciled_at = db.Column(db.Float)
+
+# 用户名 trigram 倒排：(trigram, name_len, user_id) 为主键，同一 trigram 的用户按用户名长度连续存放，
+# 按倒排顺序截断候选时留下的是最短的用户名。
+# 用户名转小写后前面补两个 \x02、后面补一个 \x03，前缀查询可以直接用锚定的 trigram
+class UsernameTrigram(db.Model):
+    __tablename__ = "username_trigram"
+    trigram = db.Column(db.String(3), primary_key=True)
+    name_len = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True, index=True)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+# 每个 trigram 的倒排长度，查询时据此从最稀有的倒排开始求交
+class UsernameTrigramStat(db.Model):
+    __tablename__ = "username_trigram_df"
+    trigram = db.Column(db.String(3), primary_key=True)
+    df = db.Column(db.Integer, nullable=False)
+
+def username_trigrams(name):
+    padded = "\x02\x02" + name.lower() + "\x03"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _update_trigrams(connection, user_id, removed=(), added=(), name_len=0):
+    table = UsernameTrigram.__table__
+    if removed:
+        connection.execute(table.delete().where(table.c.user_id == user_id, table.c.trigram.in_(removed)))
+        connection.execute(text("UPDATE username_trigram_df SET df = df - 1 WHERE trigram = :t"),
+                           [{"t": t} for t in removed])
+    if added:
+        connection.execute(table.insert(), [{"trigram": t, "name_len": name_len, "user_id": user_id}
+                                            for t in added])
+        connection.execute(text("INSERT INTO username_trigram_df (trigram, df) VALUES (:t, 1) "
+                                "ON CONFLICT (trigram) DO UPDATE SET df = df + 1"),
+                           [{"t": t} for t in added])
+
+# 建号、改名、删号时同步维护倒排，无论从哪个路由改的 User
+@event.listens_for(User, "after_insert")
+def _index_new_user(mapper, connection, user):
+    _update_trigrams(connection, user.id, added=username_trigrams(user.username), name_len=len(user.username))
+
+@event.listens_for(User, "after_update")
+def _reindex_renamed_user(mapper, connection, user):
+    history = db.inspect(user).attrs.username.history
+    if history.has_changes():
+        # 提交后属性已过期时改名前的值不会被加载，以表里现有的倒排为准
+        table = UsernameTrigram.__table__
+        rows = connection.execute(db.select(table.c.trigram, table.c.name_len)
+                                  .where(table.c.user_id == user.id)).all()
+        old = {t for t, _ in rows}
+        new = username_trigrams(user.username)
+        if any(n != len(user.username) for _, n in rows):
+            # 长度是主键的一部分，长度变了整组重写
+            _update_trigrams(connection, user.id, removed=old, added=new, name_len=len(user.username))
+        else:
+            _update_trigrams(connection, user.id, removed=old - new, added=new - old, name_len=len(user.username))
+
+@event.listens_for(User, "after_delete")
+def _unindex_user(mapper, connection, user):
+    _update_trigrams(connection, user.id, removed=username_trigrams(user.username))
+
+# 视频元数据：上传/删除时同步写入，列表页直接查表，不再扫描目录
+class Video(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    owner_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mtime = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sha256 = db.Column(db.String(64))  # 上传时边写边算；reconcile 补录的记录为空
+    crc32 = db.Column(db.BigInteger)  # 同上，打包下载时用；为空或文件被改过时导出时补算
+    # 文件当前所在的目录布局版本（storage_layout.LAYOUTS）
+    layout = db.Column(db.SmallInteger, nullable=False, default=1, server_default="1")
+
+    # 唯一索引同时服务于按文件名排序的分页查询
+    __table_args__ = (db.UniqueConstraint("owner_id", "filename", name="uq_video_owner_filename"),)
+
 # -----------------------
 # LOGIN MANAGER
 # -----------------------
 login = LoginManager(app)
 login.login_view = "login"
 
+user_cache = IdentityCache(maxsize=app.config["USER_CACHE_SIZE"], ttl=app.config["USER_CACHE_TTL"],
+                           shared_path=app.config["USER_CACHE_SHARED_PATH"])
+
 @login.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """
+    先查进程内缓存。缓存的是不绑定 session 的 User 副本，只读使用；
+    需要修改用户时先 db.session.get(User, id) 取出再改。
+    """
+    uid = int(user_id)
+    user = user_cache.get(uid)
+    if user is None:
+        version = user_cache.version(uid)
+        row = db.session.get(User, uid)
+        if row is None:
+            return None
+        user = User(id=row.id, username=row.username, password_hash=row.password_hash)
+        user_cache.put(uid, user, version)
+    return user
+
+# 改密码/改名、删号后让缓存失效。等事务提交后再失效，
+# 否则其他请求可能在提交前重新读到旧数据并写回缓存
+def _invalidate_user_on_commit(user):
+    session = object_session(user)
+    if session is not None:
+        session.info.setdefault("invalidate_users", set()).add(user.id)
+
+@event.listens_for(User, "after_update")
+def _user_changed(mapper, connection, user):
+    state = db.inspect(user).attrs
+    if state.password_hash.history.has_changes() or state.username.history.has_changes():
+        _invalidate_user_on_commit(user)
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, user):
+    _invalidate_user_on_commit(user)
+
+@event.listens_for(Session, "after_commit")
+def _flush_user_invalidations(session):
+    for uid in session.info.pop("invalidate_users", ()):
+        user_cache.invalidate(uid)
+
+@event.listens_for(Session, "after_rollback")
+def _drop_user_invalidations(session):
+    session.info.pop("invalidate_users", None)
 
 # -----------------------
 # HELPERS
@@ -77,10 +243,353 @@ def allowed_file(filename):
     )
 
 def user_folder(username):
-    """返回某个用户的上传目录，不存在则创建"""
-    folder = os.path.join(app.config["UPLOAD_FOLDER"], username)
-    os.makedirs(folder, exist_ok=True)
-    return folder
+    """返回某个用户的上传目录（只拼路径，需要写入时再创建）"""
+    return os.path.join(app.config["UPLOAD_FOLDER"], username)
+
+class UploadRequest(Request):
+    """已登录用户向首页上传时，文件部分直接流式写进用户目录（见 streaming_upload.py）"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint == "index" and current_user.is_authenticated:
+            # 写盘前先按 Content-Length 检查配额；写入时超过剩余额度立即中止
+            used_bytes, used_files = get_usage(current_user.id)
+            max_bytes = app.config["QUOTA_MAX_BYTES"]
+            quota.precheck(used_bytes, used_files, total_content_length, max_bytes, app.config["QUOTA_MAX_FILES"])
+            max_size, error = app.config["MAX_CONTENT_LENGTH"], RequestEntityTooLarge
+            if max_bytes is not None and (max_size is None or max_bytes - used_bytes < max_size):
+                max_size, error = max(max_bytes - used_bytes, 0), quota.QuotaExceeded
+            folder = user_folder(current_user.username)
+            os.makedirs(folder, exist_ok=True)
+            return UploadSink(folder, max_size=max_size, error=error)
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+app.request_class = UploadRequest
+
+def video_path(username, video):
+    return storage_layout.path_for(user_folder(username), video.filename, video.layout)
+
+def list_videos(owner_id, after=None, limit=None):
+    """
+    按文件名分页列出某用户的视频，after 为上一页最后一个文件名。
+    返回 (videos, next_cursor)，没有下一页时 next_cursor 为 None。
+    """
+    limit = limit or app.config["VIDEOS_PAGE_SIZE"]
+    q = Video.query.filter_by(owner_id=owner_id)
+    if after:
+        q = q.filter(Video.filename > after)
+    videos = q.order_by(Video.filename).limit(limit + 1).all()
+    next_cursor = videos[limit - 1].filename if len(videos) > limit else None
+    return videos[:limit], next_cursor
+
+def get_usage(user_id):
+    usage = db.session.get(UserUsage, user_id)
+    return (usage.bytes, usage.files) if usage else (0, 0)
+
+def _clamp(expr):
+    return db.case((expr < 0, 0), else_=expr)
+
+def charge_usage(user_id, add_bytes, add_files):
+    """
+    在当前事务里增减用量，随调用方一起提交。先 UPDATE 再读回检查：
+    UPDATE 会先拿到写锁，并发上传在这里串行化，不会丢失更新。
+    增加后超额时抛 QuotaExceeded，调用方负责回滚。
+    """
+    table = UserUsage.__table__
+    updated = db.session.execute(
+        table.update().where(table.c.user_id == user_id)
+        .values(bytes=_clamp(table.c.bytes + add_bytes), files=_clamp(table.c.files + add_files))
+    ).rowcount
+    if not updated:
+        db.session.add(UserUsage(user_id=user_id, bytes=max(add_bytes, 0), files=max(add_files, 0)))
+        db.session.flush()
+    used_bytes, used_files = db.session.execute(
+        db.select(table.c.bytes, table.c.files).where(table.c.user_id == user_id)).one()
+    quota.check(used_bytes - add_bytes, used_files - add_files, add_bytes, add_files,
+                app.config["QUOTA_MAX_BYTES"], app.config["QUOTA_MAX_FILES"])
+
+def record_video(user, path, sha256=None, crc32=None, layout=1):
+    """上传完成后写入（或覆盖）元数据并计入用量；超出配额时回滚并抛 QuotaExceeded"""
+    st = os.stat(path)
+    name = os.path.basename(path)
+    video = Video.query.filter_by(owner_id=user.id, filename=name).first()
+    if video is None:
+        video = Video(owner_id=user.id, filename=name)
+        db.session.add(video)
+        add_bytes, add_files = st.st_size, 1
+    else:
+        add_bytes, add_files = st.st_size - video.size, 0
+    video.size = st.st_size
+    video.mtime = st.st_mtime
+    video.sha256 = sha256
+    video.crc32 = crc32
+    video.layout = layout
+    try:
+        charge_usage(user.id, add_bytes, add_files)
+    except quota.QuotaExceeded:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    return video
+
+# 候选在 SQL 里按排序代理排好再取前几个：关键字出现的位置（没出现的排最后），再按用户名长度
+_RANK_ORDER = " ORDER BY instr(lower({0}), :kw) = 0, instr(lower({0}), :kw), length({0}), {0} LIMIT :keep"
+
+def _trigram_candidates(grams, kw, cap, keep, anchor=None):
+    """
+    按倒排长度从短到长求交：取最稀有的至多 4 个 trigram 驱动连接（anchor 总在其中，
+    候选就都是前缀匹配），其余 trigram 留给子串校验。
+    最稀有的倒排只扫描用户名最短的 cap 条，截掉的只会是更长的用户名。
+    """
+    grams = (set(grams) | {anchor}) if anchor else set(grams)
+    stats = UsernameTrigramStat.__table__
+    df = dict(db.session.execute(db.select(stats.c.trigram, stats.c.df).where(stats.c.trigram.in_(grams))).all())
+    if len(df) < len(grams) or min(df.values()) <= 0:
+        return []
+    if anchor:
+        grams = sorted([anchor] + sorted(grams - {anchor}, key=df.get)[:3], key=df.get)
+    else:
+        grams = sorted(grams, key=df.get)[:4]
+    # 最稀有的倒排按主键 (trigram, name_len, user_id) 顺序取；CROSS JOIN 固定连接顺序，其余按主键逐个探测
+    sql = ("SELECT u.id, u.username FROM (SELECT user_id, name_len FROM username_trigram "
+           "WHERE trigram = :g0 ORDER BY name_len LIMIT :cap) t0")
+    where = []
+    for i in range(1, len(grams)):
+        sql += f" CROSS JOIN username_trigram t{i}"
+        where.append(f"t{i}.trigram = :g{i} AND t{i}.name_len = t0.name_len AND t{i}.user_id = t0.user_id")
+    sql += ' CROSS JOIN "user" u WHERE ' + " AND ".join(where + ["u.id = t0.user_id"])
+    sql += _RANK_ORDER.format("u.username")
+    params = {f"g{i}": g for i, g in enumerate(grams)}
+    params.update(kw=kw, cap=cap, keep=keep)
+    return db.session.execute(text(sql), params).all()
+
+def _prefix_candidates(kw, cap, keep):
+    """
+    ASCII 前缀：lower(username) 表达式索引上的范围扫描（SQLite 的 lower() 只转换 ASCII），耗时与命中数成正比。
+    最多扫描 cap 个，返回排好序的前 keep 个和扫描到的个数
+    """
+    sql = ('SELECT id, username, count(*) OVER () FROM (SELECT id, username FROM "user" '
+           "WHERE lower(username) >= :kw AND lower(username) < :hi LIMIT :cap)" + _RANK_ORDER.format("username"))
+    rows = db.session.execute(text(sql), {"kw": kw, "hi": kw + "\U0010ffff", "cap": cap, "keep": keep}).all()
+    return [(uid, name) for uid, name, _ in rows], rows[0][2] if rows else 0
+
+def _trigram_range_candidates(kw, cap, keep):
+    """两个字符的子串：用户名每次出现 ab 都有一个以 ab 开头的 trigram（末尾有 \x03 填充），主键范围扫描即可"""
+    sql = ('SELECT u.id, u.username FROM (SELECT DISTINCT user_id FROM username_trigram '
+           'WHERE trigram >= :kw AND trigram < :hi LIMIT :cap) t CROSS JOIN "user" u WHERE u.id = t.user_id'
+           + _RANK_ORDER.format("u.username"))
+    return db.session.execute(text(sql), {"kw": kw, "hi": kw + "\U0010ffff", "cap": cap, "keep": keep}).all()
+
+def _like_candidates(kw, cap, keep):
+    """单个字符：匹配的行多，带 LIMIT 的 LIKE 很快凑够"""
+    pattern = "%" + kw.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    sql = ('SELECT id, username FROM (SELECT id, username FROM "user" '
+           "WHERE lower(username) LIKE :pattern ESCAPE '\\' LIMIT :cap)" + _RANK_ORDER.format("username"))
+    return db.session.execute(text(sql), {"kw": kw, "pattern": pattern, "cap": cap, "keep": keep}).all()
+
+def _match_rank(name, keyword):
+    """完全匹配 < 前缀匹配 < 子串匹配，同档内匹配位置越靠前、用户名越短越靠前"""
+    low = name.lower()
+    pos = low.find(keyword)
+    if pos < 0:
+        return None
+    return (0 if low == keyword else 1 if pos == 0 else 2, pos, len(name), name)
+
+def search_users(keyword, limit=None, scan_limit=None):
+    """
+    用户名子串搜索，返回按匹配质量排好序的前 limit 个 (id, username)。
+    完全匹配直接查 username 唯一索引；前缀匹配在 lower(username) 索引上范围扫描，
+    超过 scan_limit 个（或关键字不是 ASCII）时改查带前缀锚点的 trigram；
+    前缀匹配不够 limit 个再查任意位置的子串：三个字符以上求 trigram 倒排交集，
+    两个字符走 trigram 主键范围扫描，单个字符退回带 LIMIT 的 LIKE。
+    每轮最多扫描 scan_limit 个候选，只有前几个在 SQL 里按匹配位置、用户名长度排好后取回来核对。
+    """
+    limit = limit or app.config["SEARCH_RESULTS_LIMIT"]
+    cap = scan_limit or app.config["SEARCH_SCAN_LIMIT"]
+    # 多取一些，给只含 trigram、不含整个关键字的候选留余量
+    keep = 2 * limit
+    kw = keyword.strip().lower()
+    if not kw:
+        return []
+    inner = {kw[i:i + 3] for i in range(len(kw) - 2)}
+    anchor = "\x02\x02" + kw if len(kw) == 1 else "\x02" + kw[:2]
+
+    ranked = {}
+    def collect(rows):
+        for uid, name in rows:
+            rank = _match_rank(name, kw)
+            if rank is not None:
+                ranked[uid] = (rank, uid, name)
+
+    collect(db.session.execute(text('SELECT id, username FROM "user" WHERE username IN (:name, :kw)'),
+                               {"name": keyword.strip(), "kw": kw}))
+    rows, scanned = _prefix_candidates(kw, cap, keep) if kw.isascii() else ([], cap)
+    collect(rows)
+    if scanned >= cap:
+        collect(_trigram_candidates(inner, kw, cap, keep, anchor=anchor))
+    if len(ranked) < limit:
+        if inner:
+            collect(_trigram_candidates(inner, kw, cap, keep))
+        elif len(kw) == 2:
+            collect(_trigram_range_candidates(kw, cap, keep))
+        else:
+            collect(_like_candidates(kw, cap, keep))
+    return [(uid, name) for _, uid, name in heapq.nsmallest(limit, ranked.values())]
+
+@app.cli.command("reindex-usernames")
+def reindex_usernames_command():
+    """为已有用户重建用户名 trigram 倒排和倒排长度统计"""
+    conn = db.session.connection()
+    conn.execute(UsernameTrigram.__table__.delete())
+    conn.execute(UsernameTrigramStat.__table__.delete())
+    rows = [{"trigram": t, "name_len": len(name), "user_id": uid}
+            for uid, name in db.session.query(User.id, User.username) for t in username_trigrams(name)]
+    if rows:
+        conn.execute(UsernameTrigram.__table__.insert(), rows)
+    conn.execute(text("INSERT INTO username_trigram_df (trigram, df) "
+                      "SELECT trigram, COUNT(*) FROM username_trigram GROUP BY trigram"))
+    db.session.commit()
+    click.echo(f"已重建 {User.query.count()} 个用户的索引")
+
+def reconcile_usage():
+    """按 Video 表重算所有用户的用量计数器，返回有偏差的用户数"""
+    usage, videos = UserUsage.__table__, Video.__table__
+    total_bytes = (db.select(db.func.coalesce(db.func.sum(videos.c.size), 0))
+                   .where(videos.c.owner_id == usage.c.user_id).scalar_subquery())
+    total_files = (db.select(db.func.count()).select_from(videos)
+                   .where(videos.c.owner_id == usage.c.user_id).scalar_subquery())
+    # 先补齐还没有计数器的用户；这条写语句同时拿到写锁，汇总与覆盖之间不会插进上传/删除
+    db.session.execute(usage.insert().from_select(
+        ["user_id", "bytes", "files"],
+        db.select(User.id, db.literal(0), db.literal(0)).where(User.id.not_in(db.select(usage.c.user_id)))))
+    drifted = db.session.scalar(db.select(db.func.count()).select_from(usage)
+                                .where(db.or_(usage.c.bytes != total_bytes, usage.c.files != total_files)))
+    db.session.execute(usage.update().values(bytes=total_bytes, files=total_files, reconciled_at=time.time()))
+    db.session.commit()
+    if drifted:
+        app.logger.warning("重算存储用量：%d 个用户的计数器有偏差，已修正", drifted)
+    return drifted
+
+def _reconcile_usage_in_background():
+    with app.app_context():
+        return reconcile_usage()
+
+usage_reconciler = quota.Reconciler(_reconcile_usage_in_background, interval=app.config["QUOTA_RECONCILE_INTERVAL"])
+app.jinja_env.globals["format_bytes"] = quota.format_bytes
+
+@app.cli.command("reconcile-usage")
+def reconcile_usage_command():
+    """按 Video 表立即重算用户存储用量"""
+    click.echo(f"已重算存储用量，{reconcile_usage()} 个用户的计数器有偏差")
+
+def _scan_user_dir(path):
+    """列出用户目录下的视频文件及其所在布局：根目录下为平铺，分片子目录里为分片布局"""
+    sharded = storage_layout.LAYOUTS[storage_layout.LATEST]
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_file():
+                if allowed_file(entry.name):
+                    yield entry, 1
+            elif entry.is_dir() and storage_layout.is_shard_dir(entry.name):
+                with os.scandir(entry.path) as shard:
+                    for f in shard:
+                        # 分片与文件名不符的文件不属于任何布局，留给人工处理
+                        if f.is_file() and allowed_file(f.name) and sharded.shard(f.name) == entry.name:
+                            yield f, sharded.version
+
+@app.cli.command("migrate-layout")
+@click.option("--to", "target", default=storage_layout.LATEST, show_default=True, type=int, help="目标布局版本")
+@click.option("--batch", default=200, show_default=True, help="每批迁移的文件数")
+@click.option("--pause", default=0.0, show_default=True, help="批与批之间暂停的秒数，降低对线上 IO 的影响")
+def migrate_layout_command(target, batch, pause):
+    """
+    在线迁移：每批先把文件硬链接到新位置，提交数据库里的 layout，再删除旧路径。
+    任何时刻文件都至少在一个位置上，uploaded_file 按布局依次查找，服务不中断。
+    可以随时中断后重跑。
+    """
+    if target not in storage_layout.LAYOUTS:
+        raise click.BadParameter(f"未知布局版本 {target}")
+    moved = missing = conflicts = 0
+    last_id = 0
+    while True:
+        rows = (db.session.query(Video, User.username).join(User, User.id == Video.owner_id)
+                .filter(Video.layout != target, Video.id > last_id)
+                .order_by(Video.id).limit(batch).all())
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+        stale = []
+        for video, username in rows:
+            src = video_path(username, video)
+            dst = storage_layout.path_for(user_folder(username), video.filename, target)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.link(src, dst)
+            except FileNotFoundError:
+                missing += 1
+                continue
+            except FileExistsError:
+                # 上次迁移中断时已经链接过
+                if not os.path.samefile(src, dst):
+                    conflicts += 1
+                    continue
+            video.layout = target
+            stale.append(src)
+        db.session.commit()
+        for path in stale:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        moved += len(stale)
+        click.echo(f"已迁移 {moved} 个文件")
+        if pause:
+            time.sleep(pause)
+    click.echo(f"完成：迁移 {moved} 个，文件缺失 {missing} 个，目标位置冲突 {conflicts} 个")
+
+@app.cli.command("reconcile-videos")
+@click.option("--batch", default=500, show_default=True, help="每批提交的行数")
+def reconcile_videos_command(batch):
+    """用 os.scandir 扫描 static/uploads，补齐缺失记录、更新大小、删除文件已不存在的记录"""
+    added = updated = removed = 0
+    users = {u.username: u for u in User.query.all()}
+    root = app.config["UPLOAD_FOLDER"]
+    pending = 0
+    with os.scandir(root) as user_dirs:
+        for user_dir in user_dirs:
+            user = users.get(user_dir.name)
+            if user is None or not user_dir.is_dir():
+                continue
+            known = {v.filename: v for v in Video.query.filter_by(owner_id=user.id)}
+            for entry, layout in _scan_user_dir(user_dir.path):
+                st = entry.stat()
+                video = known.pop(entry.name, None)
+                if video is None:
+                    db.session.add(Video(owner_id=user.id, filename=entry.name,
+                                         size=st.st_size, mtime=st.st_mtime, layout=layout,
+                                         created_at=datetime.utcfromtimestamp(st.st_mtime)))
+                    added += 1
+                elif video.size != st.st_size or video.mtime != st.st_mtime or video.layout != layout:
+                    video.size, video.mtime, video.layout = st.st_size, st.st_mtime, layout
+                    updated += 1
+                else:
+                    continue
+                pending += 1
+                if pending >= batch:
+                    db.session.commit()
+                    pending = 0
+            for video in known.values():
+                db.session.delete(video)
+                removed += 1
+            db.session.commit()
+            pending = 0
+    # 用户目录已被整体删除的记录
+    for user in users.values():
+        if not os.path.isdir(user_folder(user.username)):
+            removed += Video.query.filter_by(owner_id=user.id).delete()
+    db.session.commit()
+    click.echo(f"新增 {added} 条，更新 {updated} 条，删除 {removed} 条")
+    # 记录变了，用量计数器跟着重算
+    reconcile_usage()
 
 # -----------------------
 # TEMPLATES
@@ -97,7 +606,7 @@ base_html = '''
     rel="stylesheet"
   >
   <style>
-    body {{ padding-top: 70px; }}
+    body { padding-top: 70px; }
   </style>
 </head>
 <body>
@@ -164,13 +673,44 @@ index_html = '''
         placeholder="搜索用户名"
         name="username"
         value="{{ keyword or '' }}"
+        list="user-suggestions"
+        autocomplete="off"
+        id="user-search"
       >
+      <datalist id="user-suggestions"></datalist>
       <button class="btn btn-outline-success" type="submit">搜索</button>
     </form>
   </div>
 </div>
+<script>
+  // 输入时请求补全接口，只保留最后一次请求的结果
+  (function () {
+    const input = document.getElementById('user-search');
+    const list = document.getElementById('user-suggestions');
+    let timer = null, seq = 0;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        const q = input.value.trim();
+        const mine = ++seq;
+        if (!q) { list.innerHTML = ''; return; }
+        fetch('{{ url_for('search_suggest') }}?q=' + encodeURIComponent(q))
+          .then(r => r.json())
+          .then(data => {
+            if (mine !== seq) return;
+            list.innerHTML = '';
+            data.users.forEach(u => {
+              const opt = document.createElement('option');
+              opt.value = u.username;
+              list.appendChild(opt);
+            });
+          });
+      }, 120);
+    });
+  })();
+</script>
 
-{% if search_results is defined %}
+{% if search_results is not none %}
   <div class="mb-4">
     <h5>搜索结果：</h5>
     <ul class="list-group">
@@ -198,16 +738,24 @@ index_html = '''
     </div>
   </div>
 
+  <!-- 存储用量：来自用量计数器，不遍历目录 -->
+  {% if usage %}
+  <p class="text-muted">
+    已用 {{ format_bytes(usage[0]) }}{% if config.QUOTA_MAX_BYTES %} / {{ format_bytes(config.QUOTA_MAX_BYTES) }}{% endif %}，
+    {{ usage[1] }} 个文件{% if config.QUOTA_MAX_FILES %} / 上限 {{ config.QUOTA_MAX_FILES }} 个{% endif %}
+  </p>
+  {% endif %}
+
   <h5>我的视频列表</h5>
   <div class="row">
     {% for vid in videos %}
       <div class="col-md-3 mb-3">
         <div class="card">
-          <video class="card-img-top" controls style="max-height:200px;">
-            <source src="{{ url_for('uploaded_file', username=current_user.username, filename=vid) }}">
+          <video class="card-img-top" controls preload="metadata" style="max-height:200px;">
+            <source src="{{ url_for('uploaded_file', username=current_user.username, filename=vid.filename) }}">
           </video>
           <div class="card-body p-2 text-center">
-            <form action="{{ url_for('delete_video', filename=vid) }}" method="post"
+            <form action="{{ url_for('delete_video', filename=vid.filename) }}" method="post"
                   onsubmit="return confirm('确定删除该视频？');">
               <button class="btn btn-sm btn-danger">删除</button>
             </form>
@@ -216,6 +764,9 @@ index_html = '''
       </div>
     {% endfor %}
   </div>
+  {% if next_cursor %}
+    <a class="btn btn-outline-secondary" href="{{ url_for('index', after=next_cursor) }}">下一页</a>
+  {% endif %}
 {% else %}
   <p>请先 <a href="{{ url_for('login') }}">登录</a> 以上传和查看视频。</p>
 {% endif %}
@@ -228,12 +779,15 @@ user_videos_html = '''
 {% block title %}{{ user.username }} 的视频{% endblock %}
 {% block content %}
 <h4>{{ user.username }} 的视频</h4>
+{% if videos %}
+  <p><a href="{{ url_for('export_videos', username=user.username) }}">打包下载全部视频（ZIP）</a></p>
+{% endif %}
 <div class="row">
   {% for vid in videos %}
     <div class="col-md-3 mb-3">
       <div class="card">
-        <video class="card-img-top" controls style="max-height:200px;">
-          <source src="{{ url_for('uploaded_file', username=user.username, filename=vid) }}">
+        <video class="card-img-top" controls preload="metadata" style="max-height:200px;">
+          <source src="{{ url_for('uploaded_file', username=user.username, filename=vid.filename) }}">
         </video>
       </div>
     </div>
@@ -242,6 +796,9 @@ user_videos_html = '''
     <p>该用户还没有上传视频。</p>
   {% endif %}
 </div>
+{% if next_cursor %}
+  <a class="btn btn-outline-secondary" href="{{ url_for('user_videos', username=user.username, after=next_cursor) }}">下一页</a>
+{% endif %}
 {% endblock %}
 '''
 
@@ -287,6 +844,15 @@ register_html = '''
 {% endblock %}
 '''
 
+# 启动时注册并预编译全部页面模板，路由按名字渲染
+template_registry.register_templates(app, {
+    "base.html": base_html,
+    "index.html": index_html,
+    "user_videos.html": user_videos_html,
+    "login.html": login_html,
+    "register.html": register_html,
+}, cache_dir=app.config["TEMPLATE_CACHE_DIR"])
+
 # -----------------------
 # ROUTES
 # -----------------------
@@ -299,48 +865,78 @@ def index():
     """
     # 上传处理
     if request.method == "POST" and current_user.is_authenticated:
-        file = request.files.get("video_file")
+        try:
+            file = request.files.get("video_file")
+        except RequestEntityTooLarge as e:
+            # 配额不足或超过单文件上限，临时文件已由 UploadSink.close() 清理
+            flash(e.description if isinstance(e, quota.QuotaExceeded) else "文件过大", "danger")
+            return redirect(url_for("index"))
         if not file or file.filename == "":
             flash("请选择一个视频文件", "warning")
         elif not allowed_file(file.filename):
             flash("不支持的文件格式", "danger")
         else:
+            # 文件内容在解析表单时已写入用户目录下的临时文件，这里只需发布
+            sink = file.stream
             fname = secure_filename(file.filename)
-            dst = os.path.join(user_folder(current_user.username), fname)
-            # 避免覆盖
-            base, ext = os.path.splitext(fname)
-            counter = 1
-            while os.path.exists(dst):
-                fname = f"{base}_{counter}{ext}"
-                dst = os.path.join(user_folder(current_user.username), fname)
-                counter += 1
-            file.save(dst)
-            flash("上传成功！", "success")
+            if not allowed_file(fname):
+                # 纯中文等文件名经 secure_filename 后只剩扩展名，改用内容哈希命名
+                fname = sink.hexdigest()[:16] + "." + file.filename.rsplit(".", 1)[1].lower()
+            layout = app.config["STORAGE_LAYOUT"]
+            folder = user_folder(current_user.username)
+            dst = sink.publish(fname, fsync=app.config["UPLOAD_FSYNC"],
+                               path_for=lambda name: storage_layout.path_for(folder, name, layout),
+                               taken=lambda name: Video.query.filter_by(
+                                   owner_id=current_user.id, filename=name).first() is not None
+                               or storage_layout.locate(folder, name) is not None)
+            # moov 在文件尾部时重排到前面，边下边播
+            if try_faststart(dst, app.logger):
+                sink.rehash()
+            try:
+                record_video(current_user, dst, sha256=sink.hexdigest(), crc32=sink.crc32, layout=layout)
+            except quota.QuotaExceeded as e:
+                os.remove(dst)
+                flash(e.description, "danger")
+            else:
+                flash("上传成功！", "success")
         return redirect(url_for("index"))
 
     # 列出当前用户的视频文件
-    videos = []
+    videos, next_cursor, usage = [], None, None
     if current_user.is_authenticated:
-        folder = user_folder(current_user.username)
-        videos = sorted(os.listdir(folder))
-    return render_template_string(index_html,
-                                  videos=videos,
-                                  search_results=None,
-                                  keyword=None,
-                                  current_user=current_user,
-                                  )
+        videos, next_cursor = list_videos(current_user.id, request.args.get("after"))
+        usage_reconciler.start()
+        usage = get_usage(current_user.id)
+    return render_template("index.html",
+                           videos=videos,
+                           next_cursor=next_cursor,
+                           usage=usage,
+                           search_results=None,
+                           keyword=None,
+                           current_user=current_user,
+                           )
 
 @app.route("/delete/<filename>", methods=["POST"])
 @login_required
 def delete_video(filename):
     """删除当前用户上传的视频"""
     safe_name = secure_filename(filename)
-    path = os.path.join(user_folder(current_user.username), safe_name)
-    if os.path.exists(path):
-        os.remove(path)
-        flash("删除成功", "success")
-    else:
+    folder = user_folder(current_user.username)
+    video = Video.query.filter_by(owner_id=current_user.id, filename=safe_name).first()
+    if video is None and storage_layout.locate(folder, safe_name) is None:
         flash("文件不存在", "danger")
+    else:
+        # 迁移中断时新旧位置可能各有一个硬链接，全部删掉
+        for version in storage_layout.LAYOUTS:
+            try:
+                os.remove(storage_layout.path_for(folder, safe_name, version))
+            except FileNotFoundError:
+                pass
+        if video is not None:
+            db.session.delete(video)
+            charge_usage(current_user.id, -video.size, -1)
+            db.session.commit()
+        flash("删除成功", "success")
     return redirect(url_for("index"))
 
 @app.route("/uploads/<username>/<filename>")
@@ -348,10 +944,33 @@ def uploaded_file(username, filename):
     """提供视频静态资源访问"""
     safe_username = secure_filename(username)
     safe_filename = secure_filename(filename)
-    path = os.path.join(user_folder(safe_username), safe_filename)
-    if not os.path.exists(path):
+    # 按布局从新到旧查找，不查库；迁移过程中文件总在其中一个位置
+    folder = user_folder(safe_username)
+    path = storage_layout.locate(folder, safe_filename, app.config["STORAGE_LAYOUT"])
+    if path is None:
         abort(404)
-    return send_from_directory(user_folder(safe_username), safe_filename)
+    return send_from_directory(folder, os.path.relpath(path, folder))
+
+@app.route("/user/<username>/export.zip")
+def export_videos(username):
+    """把某个用户的所有视频打包成一个 ZIP 下载（原样存入、边读边发，可断点续传，见 zip_stream.py）"""
+    user = User.query.filter_by(username=username).first_or_404()
+    folder = user_folder(user.username)
+    entries = []
+    for video in Video.query.filter_by(owner_id=user.id).order_by(Video.filename):
+        path = storage_layout.locate(folder, video.filename, app.config["STORAGE_LAYOUT"])
+        if path is None:
+            continue
+        st = os.stat(path)
+        crc = video.crc32
+        if (video.size, video.mtime) != (st.st_size, st.st_mtime):
+            # 文件在记录之外被改过，reconcile-videos 同步记录之前每次现算
+            crc = zip_stream.file_crc32(path)
+        elif crc is None:
+            crc = video.crc32 = zip_stream.file_crc32(path)
+        entries.append(zip_stream.stored(video.filename, path, st, crc))
+    db.session.commit()
+    return zip_stream.send_archive(zip_stream.ZipLayout(entries), user.username + ".zip")
 
 @app.route("/search", methods=["POST"])
 def search():
@@ -359,21 +978,32 @@ def search():
     keyword = request.form.get("username", "").strip()
     results = []
     if keyword:
-        results = User.query.filter(User.username.ilike(f"%{keyword}%")).all()
+        results = [{"id": uid, "username": name} for uid, name in search_users(keyword)]
         if not results:
             flash("未找到匹配用户", "info")
-    return render_template_string(index_html,
-                                  search_results=results,
-                                  keyword=keyword,
-                                  videos=[],
-                                  current_user=current_user)
+    usage = get_usage(current_user.id) if current_user.is_authenticated else None
+    return render_template("index.html",
+                           search_results=results,
+                           keyword=keyword,
+                           videos=[],
+                           usage=usage,
+                           current_user=current_user)
+
+@app.route("/search/suggest")
+def search_suggest():
+    """搜索框自动补全"""
+    q = request.args.get("q", "")[:64]
+    users = search_users(q, limit=app.config["SEARCH_SUGGEST_LIMIT"],
+                         scan_limit=app.config["SEARCH_SUGGEST_SCAN_LIMIT"]) if q.strip() else []
+    return jsonify(users=[{"username": name, "url": url_for("user_videos", username=name)} for _, name in users])
 
 @app.route("/user/<username>")
 def user_videos(username):
     """浏览某个用户的所有视频"""
     user = User.query.filter_by(username=username).first_or_404()
-    vids = sorted(os.listdir(user_folder(user.username)))
-    return render_template_string(user_videos_html, user=user, videos=vids, current_user=current_user)
+    vids, next_cursor = list_videos(user.id, request.args.get("after"))
+    return render_template("user_videos.html", user=user, videos=vids, next_cursor=next_cursor,
+                           current_user=current_user)
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -394,7 +1024,7 @@ def register():
             db.session.commit()
             flash("注册成功，请登录！", "success")
             return redirect(url_for("login"))
-    return render_template_string(register_html, current_user=current_user)
+    return render_template("register.html", current_user=current_user)
 
 @app.route("/login", methods=["GET", "POST"])
 def login():
@@ -410,33 +1040,15 @@ def login():
         else:
             login_user(user)
             return redirect(url_for("index"))
-    return render_template_string(login_html, current_user=current_user)
+    return render_template("login.html", current_user=current_user)
 
 @app.route("/logout")
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for("index"))
 
-# 注册 base 模板
-@app.context_processor
-def inject_base():
-    return dict(
-        base=base_html
-    )
-
-from jinja2 import Template
-
-# Trick: render_template_string with extends requires base.html registered.
-# Patch Flask's template loader temporarily:
-from flask import template_rendered
-
-from jinja2 import DictLoader
-
-app.jinja_loader = DictLoader({
-    'base.html': base_html,
-})
-
 if __name__ == "__main__":
     # 提示：首次运行需初始化数据库：
     # flask db init
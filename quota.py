@@ -0,0 +1,131 @@
+"""
+用户存储配额
+
+每个用户一行计数器 (bytes, files)，在写入/删除文件记录的同一个事务里增减，
+仪表盘显示用量只读这一行，不需要遍历用户目录。
+
+检查分三步：
+- 读请求体之前：文件数已满，或 Content-Length 明显超过剩余额度，直接 413
+- 读请求体时：request.max_content_length 设为剩余额度（加上 multipart 开销；Flask 3.1 起可按请求设置），
+  没有 Content-Length 的请求读到上限立即中止，不会先把整个文件写到磁盘
+- 落库时：在写事务里按真实大小 charge()，超额则抛 QuotaExceeded 回滚；
+  并发上传以这一步为准
+
+计数器可能和实际记录漂移（进程在写文件与提交之间崩溃、手工改库等），
+Reconciler 在后台定期按记录重算并覆盖。
+
+app.py 和 图像，文本视频.py 使用这里的 sqlite 辅助函数；p.py 用 SQLAlchemy 模型，
+只用 check() / body_limit() 和 Reconciler。
+"""
+
+import logging
+import threading
+import time
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+logger = logging.getLogger(__name__)
+
+# multipart 边界、字段头和其他表单字段的开销上限
+MULTIPART_SLACK = 64 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS user_usage (
+    user_id INTEGER PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    reconciled_at REAL
+)
+'''
+
+
+class QuotaExceeded(RequestEntityTooLarge):
+    description = '超出存储配额'
+
+
+def check(used_bytes, used_files, add_bytes, add_files, max_bytes=None, max_files=None):
+    """加上本次的增量后超过上限时抛 QuotaExceeded；上限为 None 表示不限制"""
+    if add_bytes > 0 and max_bytes is not None and used_bytes + add_bytes > max_bytes:
+        raise QuotaExceeded('存储空间不足：已用 %s / %s' % (format_bytes(used_bytes), format_bytes(max_bytes)))
+    if add_files > 0 and max_files is not None and used_files + add_files > max_files:
+        raise QuotaExceeded('文件数已达上限：%d / %d' % (used_files, max_files))
+
+
+def body_limit(used_bytes, max_bytes, configured=None):
+    """本次请求体最多允许读取的字节数，用作 request.max_content_length"""
+    if max_bytes is None:
+        return configured
+    left = max(max_bytes - used_bytes, 0) + MULTIPART_SLACK
+    return left if configured is None else min(left, configured)
+
+
+def precheck(used_bytes, used_files, content_length, max_bytes=None, max_files=None):
+    """读请求体之前的检查：Content-Length 包含 multipart 开销，只在明显超额时拒绝"""
+    check(used_bytes, used_files, max((content_length or 0) - MULTIPART_SLACK, 0), 1, max_bytes, max_files)
+
+
+def format_bytes(n):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return '%.0f %s' % (n, unit) if unit == 'B' else '%.1f %s' % (n, unit)
+        n /= 1024
+
+
+# --- sqlite 计数器（调用方负责事务） ---
+
+def get_usage(conn, user_id):
+    row = conn.execute('SELECT bytes, files FROM user_usage WHERE user_id = ?', (user_id,)).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def charge(conn, user_id, add_bytes, add_files, max_bytes=None, max_files=None):
+    """在调用方的写事务里增减用量；增加后超额时抛 QuotaExceeded，由调用方回滚"""
+    used_bytes, used_files = get_usage(conn, user_id)
+    check(used_bytes, used_files, add_bytes, add_files, max_bytes, max_files)
+    conn.execute('INSERT INTO user_usage (user_id, bytes, files) VALUES (?, MAX(?, 0), MAX(?, 0)) '
+                 'ON CONFLICT(user_id) DO UPDATE SET bytes = MAX(bytes + ?, 0), files = MAX(files + ?, 0)',
+                 (user_id, add_bytes, add_files, add_bytes, add_files))
+
+
+def reset_usage(conn, usage, now=None):
+    """用重算的结果覆盖计数器，usage 为 [(user_id, bytes, files)]；返回有漂移的用户数"""
+    now = time.time() if now is None else now
+    old = dict((r[0], (r[1], r[2])) for r in conn.execute('SELECT user_id, bytes, files FROM user_usage'))
+    drifted = sum(1 for user_id, b, f in usage if old.get(user_id, (0, 0)) != (b, f))
+    conn.executemany('INSERT INTO user_usage (user_id, bytes, files, reconciled_at) VALUES (?, ?, ?, ?) '
+                     'ON CONFLICT(user_id) DO UPDATE SET bytes = excluded.bytes, files = excluded.files, '
+                     'reconciled_at = excluded.reconciled_at',
+                     [(user_id, b, f, now) for user_id, b, f in usage])
+    return drifted
+
+
+class Reconciler:
+    """后台线程，每 interval 秒调用一次 reconcile_fn()；首次 start() 时才启动"""
+
+    def __init__(self, reconcile_fn, interval=3600.0):
+        self.reconcile_fn = reconcile_fn
+        self.interval = interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='quota-reconciler', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        try:
+            return self.reconcile_fn()
+        except Exception:
+            logger.exception('重算用户存储用量失败，下次再试')
+            return None
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,75 @@
+"""
+断点续传上传的文件操作部分
+
+协议（路由在 app.py 中）：
+    POST /uploads                         创建会话 {filename, size, title}
+    PUT  /uploads/<id>/chunks/<n>         写入第 n 块，Upload-Offset 头给出字节偏移
+    GET  /uploads/<id>                    查询已接收字节数
+    POST /uploads/<id>/complete           校验长度，放入视频存储并写入 videos 表
+
+每块数据从请求体按固定大小缓冲区直接写入暂存文件，内存占用与文件大小无关。
+"""
+
+import os
+import time
+import uuid
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class ChunkError(Exception):
+    pass
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def staging_path(staging_folder, session_id):
+    return os.path.join(staging_folder, session_id + '.part')
+
+
+def write_chunk(stream, path, offset, max_bytes, buffer_size=BUFFER_SIZE):
+    """把请求体写到暂存文件的 offset 处，返回写入字节数；超过 max_bytes 时抛 ChunkError"""
+    written = 0
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        while True:
+            data = stream.read(buffer_size)
+            if not data:
+                break
+            if written + len(data) > max_bytes:
+                raise ChunkError('分块超过允许的大小')
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(fd, view, offset + written)
+                view = view[n:]
+                written += n
+    finally:
+        os.close(fd)
+    return written
+
+
+def collect_expired(conn, staging_folder, ttl):
+    """删除超过 ttl 秒未更新的上传会话及其暂存文件，返回清理的会话数"""
+    cutoff = time.time() - ttl
+    rows = conn.execute('SELECT id FROM upload_sessions WHERE updated_at < ?', (cutoff,)).fetchall()
+    for row in rows:
+        try:
+            os.remove(staging_path(staging_folder, row['id']))
+        except FileNotFoundError:
+            pass
+        conn.execute('DELETE FROM upload_sessions WHERE id = ?', (row['id'],))
+    conn.commit()
+    # 没有对应会话记录的残留暂存文件（例如进程在建会话时崩溃）
+    active = {r['id'] for r in conn.execute('SELECT id FROM upload_sessions').fetchall()}
+    with os.scandir(staging_folder) as it:
+        for entry in it:
+            if not entry.name.endswith('.part') or entry.name[:-5] in active:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    return len(rows)
@@ -0,0 +1,121 @@
+"""
+用户名模糊搜索索引
+
+app.py 的 search() 原先对 users 全表逐行计算 LCS。这里改为：
+1. 字符倒排索引：键为 (字符, 第k次出现)，值为至少含 k 个该字符的用户 id 列表。
+   对关键词中每个字符的前 k 次出现统计命中数，就得到 LCS 的上界
+   sum(min(关键词中c的次数, 用户名中c的次数))，上界为 0 的用户不可能被选中。
+2. 按上界从高到低分桶，只对候选用位并行（bit-parallel）LCS 打分，
+   用大小为 k 的堆维护前 k 名，一旦上界低于堆中最低分就提前结束。
+
+排序规则与原实现一致：得分降序，同分时按用户 id 升序（即原先 SELECT 的顺序），
+只返回得分大于 0 的用户。
+"""
+
+import bisect
+import heapq
+import threading
+from collections import Counter, defaultdict
+
+
+def lcs_length_bitparallel(a, b):
+    """位并行 LCS（Allison-Dix / Hyyrö），复杂度 O(len(b) * len(a)/w)"""
+    if not a or not b:
+        return 0
+    masks = {}
+    for i, ch in enumerate(a):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    return _lcs_with_masks(masks, len(a), b)
+
+
+def _lcs_with_masks(masks, n, b):
+    full = (1 << n) - 1
+    v = full
+    for ch in b:
+        m = masks.get(ch)
+        if m is None:
+            continue
+        u = v & m
+        v = ((v + u) | (v - u)) & full
+    # v 中为 0 的位数即 LCS 长度
+    return n - bin(v).count('1')
+
+
+class UserSearchIndex:
+    """线程安全的内存用户名索引，增量维护"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(list)  # (字符, 第k次) -> [user_id, ...] 升序
+        self._names = {}                    # user_id -> username
+        self.max_id = 0
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, user_id, username):
+        with self._lock:
+            if user_id in self._names:
+                return
+            self._names[user_id] = username
+            for ch, cnt in Counter(username).items():
+                for k in range(cnt):
+                    posting = self._postings[(ch, k)]
+                    # 通常按 id 递增插入，乱序时回退到有序插入
+                    if posting and posting[-1] > user_id:
+                        bisect.insort(posting, user_id)
+                    else:
+                        posting.append(user_id)
+            if user_id > self.max_id:
+                self.max_id = user_id
+
+    def add_many(self, rows):
+        for user_id, username in rows:
+            self.add(user_id, username)
+
+    def search(self, keyword, limit=10):
+        """返回 [(user_id, username, score), ...]，按得分降序、id 升序"""
+        if not keyword or limit <= 0:
+            return []
+        with self._lock:
+            bounds = Counter()
+            for ch, cnt in Counter(keyword).items():
+                for k in range(cnt):
+                    posting = self._postings.get((ch, k))
+                    if posting:
+                        bounds.update(posting)
+            names = self._names
+            # 上界分桶，桶内 id 升序
+            buckets = defaultdict(list)
+            for uid, bound in bounds.items():
+                buckets[bound].append(uid)
+
+            masks = {}
+            for i, ch in enumerate(keyword):
+                masks[ch] = masks.get(ch, 0) | (1 << i)
+            n = len(keyword)
+
+            # 堆元素为 (score, -uid)，堆顶是当前第 k 名（最差的一个）
+            heap = []
+            for bound in sorted(buckets, reverse=True):
+                if len(heap) == limit and bound < heap[0][0]:
+                    break
+                ids = buckets[bound]
+                ids.sort()
+                for uid in ids:
+                    if len(heap) == limit:
+                        worst_score, worst_neg = heap[0]
+                        if bound < worst_score or (bound == worst_score and -uid <= worst_neg):
+                            # 同一桶内 id 递增，后面的只会更差
+                            break
+                    score = _lcs_with_masks(masks, n, names[uid])
+                    if score <= 0:
+                        continue
+                    item = (score, -uid)
+                    if len(heap) < limit:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+            ranked = sorted(heap, reverse=True)
+            return [(-neg, names[-neg], score) for score, neg in ranked]
+
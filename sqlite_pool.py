@@ -0,0 +1,92 @@
+"""
+SQLite 连接池
+
+每个请求从池中借一个连接（挂在 flask.g 上），请求结束时归还，
+连接在请求之间复用，省去每次 connect 和 PRAGMA 的开销，
+预编译语句缓存（cached_statements）也随连接一起保留。
+
+新连接统一设置：
+- journal_mode=WAL：读写不再互相阻塞
+- synchronous=NORMAL：WAL 下仍保证一致性，提交时不再每次 fsync
+- busy_timeout：写锁冲突时等待而不是立即报 database is locked
+- mmap_size：读操作走内存映射
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterable, List, Optional
+
+
+class ConnectionPool:
+    def __init__(self, path: str, max_idle: int = 16, busy_timeout_ms: int = 5000,
+                 mmap_size: int = 256 * 1024 * 1024, cached_statements: int = 256,
+                 factory: type = sqlite3.Connection):
+        self.path = path
+        self.factory = factory
+        self.max_idle = max_idle
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 连接只会被一个线程同时使用，但归还后可能被其他线程借走
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000,
+                               check_same_thread=False, cached_statements=self.cached_statements,
+                               factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            # 请求中途出错留下的未提交事务
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def query_one(conn: sqlite3.Connection, sql: str, params: Iterable[Any] = ()) -> Optional[sqlite3.Row]:
+    return conn.execute(sql, tuple(params)).fetchone()
+
+
+def query_all(conn: sqlite3.Connection, sql: str, params: Iterable[Any] = ()) -> List[sqlite3.Row]:
+    return conn.execute(sql, tuple(params)).fetchall()
+
+
+def execute(conn: sqlite3.Connection, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+    """执行单条写语句并提交；多条语句需要同一事务时用 `with conn:`"""
+    with conn:
+        return conn.execute(sql, tuple(params))
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection):
+    """BEGIN IMMEDIATE：开始时就拿到写锁，适合“先读后写”且需要与文件操作保持一致的场景"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
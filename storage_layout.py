@@ -0,0 +1,57 @@
+"""
+用户上传目录的磁盘布局
+
+- 版本 1（flat）：<用户目录>/<文件名>，旧版所有文件平铺在一个目录
+- 版本 2（hash shard）：<用户目录>/<md5(文件名) 前两位>/<文件名>，
+  256 个子目录，单个用户十万个文件时每个目录约 400 个
+
+分片只由文件名决定，按名字找文件不需要查库。数据库里每条 Video 记录
+它当前所在的布局版本（Video.layout），迁移工具按批把文件搬到新布局并更新记录。
+"""
+
+import hashlib
+import os
+
+
+class FlatLayout:
+    version = 1
+
+    def relpath(self, filename):
+        return filename
+
+
+class HashShardLayout:
+    version = 2
+
+    def __init__(self, width=2):
+        self.width = width
+
+    def shard(self, filename):
+        return hashlib.md5(filename.encode('utf-8'), usedforsecurity=False).hexdigest()[:self.width]
+
+    def relpath(self, filename):
+        return os.path.join(self.shard(filename), filename)
+
+
+LAYOUTS = {layout.version: layout for layout in (FlatLayout(), HashShardLayout())}
+LATEST = max(LAYOUTS)
+
+
+def path_for(folder, filename, version):
+    return os.path.join(folder, LAYOUTS[version].relpath(filename))
+
+
+def locate(folder, filename, preferred=LATEST):
+    """先按 preferred 版本找，再按其他版本从新到旧找；都不存在时返回 None"""
+    versions = [preferred] + sorted((v for v in LAYOUTS if v != preferred), reverse=True)
+    for version in versions:
+        path = path_for(folder, filename, version)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def is_shard_dir(name, version=LATEST):
+    layout = LAYOUTS[version]
+    width = getattr(layout, 'width', None)
+    return width is not None and len(name) == width and all(c in '0123456789abcdef' for c in name)
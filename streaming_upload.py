@@ -0,0 +1,116 @@
+"""
+流式接收上传文件
+
+werkzeug 解析 multipart 时按固定大小的块读取 request.stream，并把文件部分写进
+Request._get_file_stream() 返回的对象。这里提供 UploadSink 作为这个对象：
+- 直接写到目标目录下的隐藏临时文件（同一文件系统，发布时只需改名）
+- 写入时累计大小、计算 SHA-256 和 CRC-32（打包下载用），不再先落到 werkzeug 的临时文件再 file.save() 复制一遍
+- 超过 max_size 立即中止（请求没有 Content-Length 时 MAX_CONTENT_LENGTH 管不到），
+  抛出 error 指定的异常（默认 413 RequestEntityTooLarge，配额不足时可换成 quota.QuotaExceeded）
+
+publish() 用 O_CREAT|O_EXCL 原子地占住文件名，再 os.replace 覆盖占位文件：
+重名时改用 “名字_哈希前8位”，再冲突用随机后缀，不需要逐个 stat 试探。
+目标路径可以由 path_for(名字) 决定（如按文件名分片的子目录），
+taken(名字) 用来排除数据库里已经登记、但文件在别处（旧布局）的名字。
+
+fsync 策略：
+- none：交给操作系统回写
+- file：发布前 fsync 文件内容
+- full：再 fsync 目录，保证掉电后文件名也在
+"""
+
+import hashlib
+import os
+import tempfile
+import uuid
+import zlib
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+FSYNC_POLICIES = ('none', 'file', 'full')
+
+
+class UploadSink:
+    def __init__(self, folder, max_size=None, error=RequestEntityTooLarge):
+        self.folder = folder
+        self.max_size = max_size
+        self.error = error
+        fd, self.path = tempfile.mkstemp(dir=folder, prefix='.upload-', suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.crc32 = 0
+        self.size = 0
+        self.published = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            # 解析中途抛出的异常不会走到 werkzeug 关闭文件那一步，这里自己清理
+            self.close()
+            raise self.error()
+        self._hash.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    # werkzeug 的 FileStorage 还会用到 read/seek/tell 等
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def publish(self, filename, fsync='file', path_for=None, taken=None):
+        """把临时文件以 filename（重名时加后缀）发布到目录中，返回最终路径"""
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('unknown fsync policy: %r' % fsync)
+        self._file.flush()
+        if fsync != 'none':
+            os.fsync(self._file.fileno())
+        self._file.close()
+        base, ext = os.path.splitext(filename)
+        for name in (filename, f'{base}_{self.hexdigest()[:8]}{ext}', f'{base}_{uuid.uuid4().hex[:12]}{ext}'):
+            if taken is not None and taken(name):
+                continue
+            dst = path_for(name) if path_for else os.path.join(self.folder, name)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.close(os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            except FileExistsError:
+                continue
+            os.replace(self.path, dst)
+            break
+        else:
+            raise FileExistsError(dst)
+        if fsync == 'full':
+            dir_fd = os.open(os.path.dirname(dst), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self.published = dst
+        return dst
+
+    def rehash(self):
+        """发布后文件被改写过（如 faststart），重新计算大小、哈希和 CRC"""
+        h = hashlib.sha256()
+        crc = 0
+        size = 0
+        with open(self.published, 'rb') as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if not data:
+                    break
+                h.update(data)
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+        self._hash, self.crc32, self.size = h, crc, size
+
+    def close(self):
+        """请求结束时 werkzeug 会调用；没有发布的临时文件在这里删除"""
+        if not self._file.closed:
+            self._file.close()
+        if self.published is None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
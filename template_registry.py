@@ -0,0 +1,27 @@
+"""
+内联模板注册表
+
+p.py 和 图像，文本视频.py 的页面模板都写在代码里。这里在启动时把它们按名字
+装进 DictLoader，路由改用 render_template(名字)：
+- 每个模板只解析/编译一次，之后由 jinja 的模板缓存直接返回
+- FileSystemBytecodeCache 把编译结果写到磁盘，新起的进程加载时跳过编译
+- {% extends "base.html" %} 直接在注册表里找到基础模板，不再依赖 templates/ 目录
+"""
+
+import os
+
+from jinja2 import DictLoader, FileSystemBytecodeCache
+
+
+def register_templates(app, templates, cache_dir=None):
+    """
+    templates: {模板名: 源码}。cache_dir 为字节码缓存目录，
+    默认用 jinja 在系统临时目录下按用户区分的目录。
+    """
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.jinja_loader = DictLoader(dict(templates))
+    # 预编译：第一个请求不再承担编译开销
+    for name in templates:
+        app.jinja_env.get_template(name)
@@ -0,0 +1,210 @@
+"""
+大文本文件分页查看
+
+文件用 mmap 打开（gzip 压缩存储的文件用 text_store.GzipBlockReader 按块解压），
+只有实际读到的页进内存。第一次查看时扫描一遍全文，
+每 stride 行记下一次行首的字节偏移，存成同目录下的 .<文件名>.lines：
+
+    头部 HEADER（魔数、版本、文件大小、mtime_ns、stride、总行数、BOM 长度、编码名）
+    之后是 uint64 小端偏移数组，第 k 项为第 k*stride 行的行首
+
+偏移都是原文中的偏移；磁盘上的文件大小或 mtime 变了（同名覆盖）时重建。取第 n 行时先 pread 一个偏移，
+再从那里往后数不到 stride 行，所以每个请求的内存与文件大小无关：
+一页最多 max_lines 行，每行最多 max_line_bytes 字节（超长的行截断）。
+
+编码只看文件开头 PREFIX_BYTES 字节：BOM 优先，其次能按 UTF-8 解码就是 UTF-8，
+再试 GB18030，都不行按 Latin-1。UTF-16 以两字节为单位找换行。
+"""
+
+import codecs
+import os
+import struct
+import uuid
+
+import text_store
+
+MAGIC = b'TXLI'
+VERSION = 1
+HEADER = struct.Struct('<4sHQqIQB16s')
+PREFIX_BYTES = 64 * 1024
+STRIDE = 1000
+SCAN_CHUNK = 1024 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# 换行符的字节形式；UTF-16 时换行必须落在两字节边界上
+_NEWLINES = {'utf-16-le': b'\n\x00', 'utf-16-be': b'\x00\n'}
+
+
+def index_path(path):
+    head, tail = os.path.split(path)
+    return os.path.join(head, '.' + tail + '.lines')
+
+
+def detect_encoding(prefix):
+    """按文件开头的一段字节判断编码，返回 (编码名, BOM 长度)"""
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding, len(bom)
+    for encoding in ('utf-8', 'gb18030'):
+        try:
+            # 截断处可能落在多字节字符中间，final=False 不把它当错误
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding, 0
+        except UnicodeDecodeError:
+            pass
+    return 'latin-1', 0
+
+
+class LineIndex:
+    """一个文本文件的稀疏行偏移索引，偏移数组留在磁盘上按需 pread"""
+
+    def __init__(self, path, size, mtime_ns, stride, total_lines, bom, encoding):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.stride = stride
+        self.total_lines = total_lines
+        self.bom = bom
+        self.encoding = encoding
+
+    @classmethod
+    def load(cls, path, stride=STRIDE):
+        """读缓存的索引；不存在或已过期时扫描文件重建"""
+        st = os.stat(path)
+        try:
+            with open(index_path(path), 'rb') as f:
+                header = HEADER.unpack(f.read(HEADER.size))
+            magic, version, size, mtime_ns, cached_stride, total_lines, bom, encoding = header
+            if (magic, version, size, mtime_ns, cached_stride) == (MAGIC, VERSION, st.st_size, st.st_mtime_ns, stride):
+                return cls(path, size, mtime_ns, stride, total_lines, bom, encoding.rstrip(b'\0').decode())
+        except (OSError, struct.error):
+            pass
+        return cls.build(path, stride)
+
+    @classmethod
+    def build(cls, path, stride=STRIDE):
+        st = os.stat(path)
+        with text_store.open_text(path) as f:
+            encoding, bom = detect_encoding(f.read(PREFIX_BYTES))
+        tmp = index_path(path) + '.tmp-' + uuid.uuid4().hex[:8]
+        with text_store.open_buffer(path) as buf:
+            with open(tmp, 'wb') as out:
+                out.write(b'\0' * HEADER.size)
+                if len(buf):
+                    total_lines = _write_offsets(buf, out, bom, len(buf), stride, encoding)
+                else:
+                    out.write(struct.pack('<Q', 0))
+                    total_lines = 0
+                out.seek(0)
+                out.write(HEADER.pack(MAGIC, VERSION, st.st_size, st.st_mtime_ns, stride, total_lines,
+                                      bom, encoding.encode()))
+        os.replace(tmp, index_path(path))
+        return cls(path, st.st_size, st.st_mtime_ns, stride, total_lines, bom, encoding)
+
+    def line_offset(self, mm, line):
+        """第 line 行（从 0 开始）行首的字节偏移"""
+        k = line // self.stride
+        with open(index_path(self.path), 'rb') as f:
+            (offset,) = struct.unpack('<Q', os.pread(f.fileno(), 8, HEADER.size + 8 * k))
+        for _ in range(line - k * self.stride):
+            offset = _line_end(mm, offset, len(mm), self.encoding, self.bom)
+        return offset
+
+
+def _find_newline(mm, start, end, encoding, bom):
+    """start 之后第一个换行符的位置，没有时返回 -1"""
+    newline = _NEWLINES.get(encoding)
+    if newline is None:
+        return mm.find(b'\n', start, end)
+    pos = mm.find(newline, start, end)
+    while pos >= 0 and (pos - bom) % 2:
+        pos = mm.find(newline, pos + 1, end)
+    return pos
+
+
+def _line_end(mm, start, size, encoding, bom):
+    """下一行行首的偏移（最后一行没有换行符时为文件末尾）"""
+    pos = _find_newline(mm, start, size, encoding, bom)
+    return size if pos < 0 else pos + len(_NEWLINES.get(encoding, b'\n'))
+
+
+def _write_offsets(mm, out, bom, size, stride, encoding):
+    """扫描全文，把每 stride 行的行首偏移写到 out，返回总行数"""
+    out.write(struct.pack('<Q', bom))
+    line = 0
+    pos = bom
+    if encoding in _NEWLINES:
+        while pos < size:
+            pos = _line_end(mm, pos, size, encoding, bom)
+            line += 1
+            if line % stride == 0 and pos < size:
+                out.write(struct.pack('<Q', pos))
+        return line
+    # 单字节换行的编码按块数换行符，只在跨过 stride 边界的块里逐个定位
+    next_mark = stride
+    while pos < size:
+        end = min(pos + SCAN_CHUNK, size)
+        count = mm[pos:end].count(b'\n')
+        if line + count < next_mark:
+            line += count
+            pos = end
+            continue
+        while pos < end:
+            nl = mm.find(b'\n', pos, end)
+            if nl < 0:
+                pos = end
+                break
+            pos = nl + 1
+            line += 1
+            if line == next_mark:
+                if pos < size:
+                    out.write(struct.pack('<Q', pos))
+                next_mark += stride
+    # 最后一行没有换行符也算一行
+    if size > bom and mm[size - 1:size] != b'\n':
+        line += 1
+    return line
+
+
+def read_page(path, start, max_lines, max_line_bytes=16 * 1024, stride=STRIDE):
+    """
+    从第 start 行起读至多 max_lines 行，返回 dict：
+    lines（已解码，去掉换行符）、start、next（下一页起始行，没有时为 None）、
+    total_lines、encoding、truncated（被截断的行号列表）
+    """
+    index = LineIndex.load(path, stride)
+    start = max(0, min(start, max(index.total_lines - 1, 0)))
+    page = {'start': start, 'lines': [], 'next': None, 'total_lines': index.total_lines,
+            'encoding': index.encoding, 'truncated': []}
+    if index.total_lines == 0:
+        return page
+    with text_store.open_buffer(path) as mm:
+        size = len(mm)
+        offset = index.line_offset(mm, start)
+        newline = _NEWLINES.get(index.encoding, b'\n')
+        line = start
+        while line < index.total_lines and len(page['lines']) < max_lines and offset < size:
+            nl = _find_newline(mm, offset, size, index.encoding, index.bom)
+            end = size if nl < 0 else nl
+            raw = mm[offset:min(end, offset + max_line_bytes)]
+            decoder = codecs.getincrementaldecoder(index.encoding)(errors='replace')
+            text = decoder.decode(raw, final=end <= offset + max_line_bytes)
+            if end > offset + max_line_bytes:
+                page['truncated'].append(line)
+            page['lines'].append(text.rstrip('\r'))
+            offset = size if nl < 0 else nl + len(newline)
+            line += 1
+    if line < index.total_lines:
+        page['next'] = line
+    return page
+
+
+def remove_index(path):
+    try:
+        os.remove(index_path(path))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,143 @@
+"""
+文本文件全文检索（SQLite FTS5）
+
+text_fts 的 rowid 即 files.id，列为 filename 和 body。分词器用 FTS5 自带的 trigram：
+按 Unicode 字符切成三字组，中文、日文等不分词的文字也能做子串匹配。
+代价是索引体积约为原文的 3 倍（正文本身也存在表里，用来截取结果片段），
+查询词至少 3 个字符才能走索引；1~2 个字符时退回对 body 的 LIKE 扫描（有 LIMIT，命中多时很快结束）。
+
+索引随上传/覆盖/删除在同一个事务里增删（index_document / remove_document），
+已有文件用 bulk_index() 流式导入：一次只读一个文件，每 batch 个提交一次。
+"""
+
+import html
+import time
+
+import text_store
+from sqlite_pool import write_transaction
+
+SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS text_fts USING fts5(filename, body, tokenize='trigram')
+'''
+
+# 单个文件最多索引的字节数，超出部分不参与检索
+MAX_INDEX_BYTES = 8 * 1024 * 1024
+# 片段中标记命中位置的占位符，转义后再换成 <mark>
+_OPEN, _CLOSE = '\x02', '\x03'
+# 结果片段在命中位置前后各截取的字符数
+_CONTEXT = 40
+
+
+def read_text(path, max_bytes=MAX_INDEX_BYTES):
+    with text_store.open_text(path) as f:
+        data = f.read(max_bytes)
+    return data.decode('utf-8', errors='ignore')
+
+
+def index_document(conn, file_id, filename, body):
+    """在调用方的事务里写入（或替换）一个文件的索引"""
+    conn.execute('DELETE FROM text_fts WHERE rowid = ?', (file_id,))
+    conn.execute('INSERT INTO text_fts (rowid, filename, body) VALUES (?, ?, ?)', (file_id, filename, body))
+
+
+def remove_document(conn, file_id):
+    conn.execute('DELETE FROM text_fts WHERE rowid = ?', (file_id,))
+
+
+def _phrase(q):
+    """把用户输入当作一个短语，不解析 FTS5 的 AND/OR/NEAR 语法"""
+    return '"' + q.replace('"', '""') + '"'
+
+
+def _like_pattern(q):
+    return '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _render_snippet(text):
+    return html.escape(text).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def search(conn, q, limit=20, offset=0):
+    """
+    返回 (结果列表, 是否还有下一页)。每条结果含 file_id、user_id、username、filename、
+    snippet_html（已转义，命中处为 <mark>）。3 个字符以上按 bm25 排序，文件名命中权重更高。
+    """
+    q = q.strip()
+    if not q:
+        return [], False
+    if len(q) >= 3:
+        hits = ('SELECT rowid, bm25(text_fts, 5.0, 1.0) AS score FROM text_fts WHERE text_fts MATCH ? '
+                'ORDER BY score LIMIT ? OFFSET ?')
+        params = (_phrase(q), limit + 1, offset)
+    else:
+        # trigram 无法索引太短的词，只能逐行扫描正文和文件名；按 rowid 倒序（新上传的在前），取够一页就停
+        hits = ("SELECT rowid, -rowid AS score FROM text_fts WHERE body LIKE ? ESCAPE '\\' "
+                "OR filename LIKE ? ESCAPE '\\' ORDER BY rowid DESC LIMIT ? OFFSET ?")
+        params = (_like_pattern(q), _like_pattern(q), limit + 1, offset)
+    # 先只按 rowid 排序分页，再给这一页取片段：snippet() 要把整篇正文重新分词，
+    # 大文件命中多时一篇上百毫秒，放在排序前会对所有命中的文件都算一遍。
+    # 片段取正文中第一次命中处前后各 _CONTEXT 个字符
+    rows = conn.execute(
+        'WITH hits AS (' + hits + ') '
+        'SELECT file_id, user_id, username, filename, substr(body, max(1, pos - ?), ?) AS snippet, '
+        'pos > ? AS head_clipped, length(body) >= pos + ? AS tail_clipped FROM ('
+        'SELECT hits.rowid AS file_id, files.user_id, users.username, files.filename, text_fts.body, '
+        'instr(lower(text_fts.body), lower(?)) AS pos, hits.score '
+        'FROM hits JOIN text_fts ON text_fts.rowid = hits.rowid '
+        'JOIN files ON files.id = hits.rowid JOIN users ON users.id = files.user_id) '
+        'ORDER BY score',
+        params + (_CONTEXT, 2 * _CONTEXT + len(q), _CONTEXT + 1, _CONTEXT + len(q), q)).fetchall()
+    results = []
+    for r in rows[:limit]:
+        # 只有文件名命中时 pos 为 0，显示正文开头
+        text = ('…' if r['head_clipped'] else '') + _mark_first(r['snippet'], q) + ('…' if r['tail_clipped'] else '')
+        results.append({
+            'file_id': r['file_id'],
+            'user_id': r['user_id'],
+            'username': r['username'],
+            'filename': r['filename'],
+            'snippet_html': _render_snippet(text),
+        })
+    return results, len(rows) > limit
+
+
+def _mark_first(text, q):
+    i = text.lower().find(q.lower())
+    if i < 0:
+        return text
+    return text[:i] + _OPEN + text[i:i + len(q)] + _CLOSE + text[i + len(q):]
+
+
+def bulk_index(conn, documents, batch=200, reindex=False, max_bytes=MAX_INDEX_BYTES, progress=None):
+    """
+    documents 为 (file_id, filename, path) 的迭代器，逐个读文件写入索引，每 batch 个提交一次。
+    reindex=False 时跳过已经在索引里的文件，中断后可以接着跑。返回 (写入数, 跳过数)。
+    """
+    indexed = skipped = 0
+    pending = []
+    started = time.monotonic()
+
+    def flush():
+        with write_transaction(conn):
+            for file_id, filename, body in pending:
+                index_document(conn, file_id, filename, body)
+        pending.clear()
+        if progress:
+            progress(indexed, skipped, time.monotonic() - started)
+
+    for file_id, filename, path in documents:
+        if not reindex and conn.execute('SELECT 1 FROM text_fts WHERE rowid = ?', (file_id,)).fetchone():
+            skipped += 1
+            continue
+        try:
+            body = read_text(path, max_bytes)
+        except OSError:
+            skipped += 1
+            continue
+        pending.append((file_id, filename, body))
+        indexed += 1
+        if len(pending) >= batch:
+            flush()
+    if pending:
+        flush()
+    return indexed, skipped
@@ -0,0 +1,240 @@
+"""
+文本文件压缩存储（gzip）
+
+上传的文本存成 <文件名>.gz：标准的单成员 gzip，客户端支持 gzip 时原样发送并带
+Content-Encoding: gzip，不支持的才在服务端边读边解压。
+
+为了分页查看时不必从头解压，压缩时每 BLOCK 字节原文做一次 zlib 全刷新（Z_FULL_FLUSH）：
+刷新点之后的压缩数据不依赖之前的内容，可以从该处直接开始解压。各刷新点的压缩偏移存在
+同目录的 .<文件名>.gz.blocks 里：
+
+    头部 HEADER（魔数、版本、BLOCK、原文大小、压缩后大小、块数）
+    之后是 uint64 小端数组，第 k 项为第 k 块（原文偏移 k*BLOCK）的压缩偏移
+
+GzipBlockReader 按块解压并缓存最近用到的两块，提供 len()、切片和 find()，
+text_pages 把它当作 mmap 使用，每次请求的内存与文件大小无关。
+预览、全文索引只需要开头一段，用 open_text() 读前缀即可，只解压读到的部分。
+ZIP 打包下载时 deflate_span() 给出其中 deflate 数据的位置，原样作为 ZIP 条目的数据。
+"""
+
+import gzip
+import mmap
+import os
+import struct
+import uuid
+import zlib
+from contextlib import contextmanager
+
+SUFFIX = '.gz'
+BLOCK = 1024 * 1024
+MAGIC = b'TXGZ'
+VERSION = 1
+HEADER = struct.Struct('<4sHIQQQ')
+# gzip 头：无文件名、mtime 为 0（同样内容压出同样的字节），OS 为 unknown
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def is_compressed(path):
+    return path.endswith(SUFFIX)
+
+
+def blocks_path(path):
+    head, tail = os.path.split(path)
+    return os.path.join(head, '.' + tail + '.blocks')
+
+
+def compress_file(src, dst, level=6):
+    """
+    把 src 压缩成 dst（及其 .blocks），先写临时文件再改名。
+    返回 (原文字节数, 压缩后字节数)
+    """
+    tmp = dst + '.tmp-' + uuid.uuid4().hex[:8]
+    tmp_blocks = blocks_path(dst) + '.tmp-' + uuid.uuid4().hex[:8]
+    offsets = []
+    crc = 0
+    raw_size = 0
+    try:
+        with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+            fout.write(_GZIP_HEADER)
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            while True:
+                block = fin.read(BLOCK)
+                if not block:
+                    break
+                offsets.append(fout.tell())
+                crc = zlib.crc32(block, crc)
+                raw_size += len(block)
+                fout.write(compressor.compress(block))
+                fout.write(compressor.flush(zlib.Z_FULL_FLUSH))
+            fout.write(compressor.flush(zlib.Z_FINISH))
+            fout.write(struct.pack('<II', crc, raw_size & 0xFFFFFFFF))
+            compressed_size = fout.tell()
+        with open(tmp_blocks, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, BLOCK, raw_size, compressed_size, len(offsets)))
+            f.write(struct.pack('<%dQ' % len(offsets), *offsets))
+        os.replace(tmp_blocks, blocks_path(dst))
+        os.replace(tmp, dst)
+    except BaseException:
+        for path in (tmp, tmp_blocks):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        raise
+    return raw_size, compressed_size
+
+
+def replace(src, dst):
+    """把 compress_file() 写出的 src 连同块索引改名为 dst"""
+    os.replace(blocks_path(src), blocks_path(dst))
+    os.replace(src, dst)
+
+
+def remove(path):
+    """删除压缩文件及其块索引，不存在时忽略"""
+    for p in (path, blocks_path(path)):
+        try:
+            os.remove(p)
+        except FileNotFoundError:
+            pass
+
+
+def deflate_span(path):
+    """
+    compress_file() 写出的文件里 deflate 数据的位置和校验信息，ZIP 打包时直接引用。
+    返回 (偏移, 长度, CRC-32, 原文大小)
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(_GZIP_HEADER) + 8 or os.pread(f.fileno(), len(_GZIP_HEADER), 0) != _GZIP_HEADER:
+            raise ValueError('不是 compress_file() 写出的文件: %s' % path)
+        crc, raw_size = struct.unpack('<II', os.pread(f.fileno(), 8, size - 8))
+    # gzip 尾部的原文大小只有低 32 位，块索引里有完整的
+    try:
+        with open(blocks_path(path), 'rb') as f:
+            magic, version, _, full_size, compressed_size, _ = HEADER.unpack(f.read(HEADER.size))
+        if (magic, version, compressed_size) == (MAGIC, VERSION, size):
+            raw_size = full_size
+    except (OSError, struct.error):
+        pass
+    return len(_GZIP_HEADER), size - len(_GZIP_HEADER) - 8, crc, raw_size
+
+
+def open_text(path):
+    """按原文读取的二进制文件对象，压缩文件只解压实际读到的部分"""
+    return gzip.open(path, 'rb') if is_compressed(path) else open(path, 'rb')
+
+
+class GzipBlockReader:
+    """按块随机读取 compress_file() 写出的文件，接口与 text_pages 用到的 mmap 子集一致"""
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._blocks = open(blocks_path(path), 'rb')
+        magic, version, self.block_size, self.size, compressed_size, self.count = HEADER.unpack(
+            self._blocks.read(HEADER.size))
+        # 块索引和压缩文件分两次改名，中间被读到时大小对不上
+        if (magic, version, compressed_size) != (MAGIC, VERSION, os.fstat(self._file.fileno()).st_size):
+            self.close()
+            raise ValueError('块索引与文件不匹配: %s' % path)
+        self._cache = {}
+
+    def close(self):
+        self._file.close()
+        self._blocks.close()
+
+    def __len__(self):
+        return self.size
+
+    def _block(self, k):
+        data = self._cache.get(k)
+        if data is not None:
+            return data
+        (offset,) = struct.unpack('<Q', os.pread(self._blocks.fileno(), 8, HEADER.size + 8 * k))
+        want = min(self.block_size, self.size - k * self.block_size)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._file.seek(offset)
+        parts = []
+        got = 0
+        while got < want:
+            chunk = self._file.read(64 * 1024)
+            if not chunk:
+                break
+            out = decompressor.decompress(chunk, want - got)
+            parts.append(out)
+            got += len(out)
+            # 输出达到上限后剩余的输入留在 unconsumed_tail 里
+            while got < want and decompressor.unconsumed_tail:
+                out = decompressor.decompress(decompressor.unconsumed_tail, want - got)
+                if not out:
+                    break
+                parts.append(out)
+                got += len(out)
+        data = b''.join(parts)
+        if len(self._cache) >= 2:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[k] = data
+        return data
+
+    def __getitem__(self, item):
+        start, stop, _ = item.indices(self.size)
+        if start >= stop:
+            return b''
+        parts = []
+        while start < stop:
+            k = start // self.block_size
+            base = k * self.block_size
+            data = self._block(k)
+            if start - base >= len(data):
+                break  # 文件被截断
+            parts.append(data[start - base:stop - base])
+            start = base + len(data)
+        return b''.join(parts)
+
+    def find(self, sub, start=0, end=None):
+        end = self.size if end is None else min(end, self.size)
+        pos = max(start, 0)
+        while pos < end:
+            k = pos // self.block_size
+            base = k * self.block_size
+            data = self._block(k)
+            block_end = base + len(data)
+            if block_end <= pos:
+                break  # 文件被截断
+            # 直接在缓存的块里找，不复制
+            i = data.find(sub, pos - base, min(end, block_end) - base)
+            if i >= 0:
+                return base + i
+            # 再看跨块边界的匹配
+            if len(sub) > 1 and block_end < end:
+                lo = max(pos, block_end - len(sub) + 1)
+                i = self[lo:min(block_end + len(sub) - 1, end)].find(sub)
+                if i >= 0:
+                    return lo + i
+            pos = block_end
+        return -1
+
+
+@contextmanager
+def open_buffer(path):
+    """按原文随机访问的缓冲区：原文文件用 mmap，压缩文件用 GzipBlockReader"""
+    if is_compressed(path):
+        reader = GzipBlockReader(path)
+        try:
+            yield reader
+        finally:
+            reader.close()
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def iter_decompressed(path, chunk_size=64 * 1024):
+    """边读边解压，给不支持 gzip 的客户端"""
+    with open_text(path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
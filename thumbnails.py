@@ -0,0 +1,123 @@
+"""
+视频封面与缩略图生成
+
+上传完成后把视频提交到一个有界的进程池，在请求之外用 moviepy 抽取一帧，
+生成封面（poster，最长边 1280）和小缩略图（宽 320，优先 WebP）。
+图片按内容的 SHA-256 存放在缓存目录下（ab/abcdef....webp），
+同样内容只存一份，文件名不变即可长期缓存。结果写回 videos 表：
+thumbnail / poster 为相对缓存目录的路径，生成失败时记为空字符串，不再重试。
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+POSTER_MAX_SIZE = 1280
+THUMB_WIDTH = 320
+
+
+def _store(cache_dir, data, ext):
+    digest = hashlib.sha256(data).hexdigest()
+    rel = os.path.join(digest[:2], digest + ext)
+    path = os.path.join(cache_dir, rel)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp-' + uuid.uuid4().hex[:8]
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return rel.replace(os.sep, '/')
+
+
+def _encode(image, fmt, **params):
+    buf = io.BytesIO()
+    image.save(buf, fmt, **params)
+    return buf.getvalue()
+
+
+def extract_images(video_path, cache_dir):
+    """在子进程中运行：抽帧并写入缓存，返回 (poster, thumbnail) 相对路径"""
+    try:
+        from moviepy import VideoFileClip
+    except ImportError:
+        from moviepy.editor import VideoFileClip
+    from PIL import Image
+
+    clip = VideoFileClip(video_path, audio=False)
+    try:
+        # 避开开头的黑屏，取 1 秒处或时长的 10%
+        t = min(1.0, (clip.duration or 0) * 0.1)
+        frame = clip.get_frame(t)
+    finally:
+        clip.close()
+
+    image = Image.fromarray(frame).convert('RGB')
+    poster = image.copy()
+    poster.thumbnail((POSTER_MAX_SIZE, POSTER_MAX_SIZE))
+    poster_rel = _store(cache_dir, _encode(poster, 'JPEG', quality=85, optimize=True), '.jpg')
+
+    height = max(1, round(image.height * THUMB_WIDTH / image.width))
+    thumb = image.resize((THUMB_WIDTH, height), Image.LANCZOS)
+    try:
+        thumb_rel = _store(cache_dir, _encode(thumb, 'WEBP', quality=75, method=4), '.webp')
+    except (OSError, KeyError):
+        # Pillow 未编译 WebP 支持
+        thumb_rel = _store(cache_dir, _encode(thumb, 'JPEG', quality=80), '.jpg')
+    return poster_rel, thumb_rel
+
+
+class ThumbnailPipeline:
+    """
+    有界的后台缩略图任务队列。on_done(video_id, poster, thumbnail) 在主进程的
+    回调线程中调用，用于写数据库；同一个视频不会重复排队。
+    """
+
+    def __init__(self, cache_dir, on_done, max_workers=2, max_pending=64):
+        self.cache_dir = cache_dir
+        self.on_done = on_done
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, video_id, video_path):
+        """提交任务；队列已满或已在排队时返回 None，由补全任务稍后处理"""
+        with self._lock:
+            if video_id in self._pending:
+                return self._pending[video_id]
+            if len(self._pending) >= self.max_pending:
+                return None
+            future = self._get_executor().submit(extract_images, video_path, self.cache_dir)
+            self._pending[video_id] = future
+        future.add_done_callback(lambda f: self._finish(video_id, f))
+        return future
+
+    def _finish(self, video_id, future):
+        with self._lock:
+            self._pending.pop(video_id, None)
+        try:
+            poster, thumbnail = future.result()
+        except Exception:
+            logger.exception('生成缩略图失败: video_id=%s', video_id)
+            poster, thumbnail = '', ''
+        try:
+            self.on_done(video_id, poster, thumbnail)
+        except Exception:
+            logger.exception('保存缩略图结果失败: video_id=%s', video_id)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,221 @@
+"""
+并发复制/移动文件（迁移.py 的 OrganizerWorker 使用）
+
+逐个 shutil.move / copy2 时同一时刻只有一个 I/O，NVMe 和网络盘都远远跑不满。这里：
+- 按设备限并发：每个源/目标设备（st_dev）有若干个槽位，机械盘 2 个，其他 8 个；
+  一个任务同时占用源设备和目标设备各一个槽位，多个目录共用同一块盘时不会超额
+- 大文件优先：任务按 (源设备, 目标设备) 分组，每组按大小从大到小排队，
+  每次取能开始的任务里最大的；最大的受字节上限限制开不了时，用同组最小的补空档
+- 在途字节有上限：正在复制、还没写完的字节数之和不超过 max_inflight_bytes，
+  没有任务在跑时不受限（单个文件比上限还大也能开始）；写出一块就归还一块的额度
+- 目标文件名不会被并发的任务抢走或覆盖：一次 run() 里分配过的目标名都登记下来，
+  磁盘上已有的和其他任务占过的名字都跳过。同一设备上的移动直接 os.replace 改名，
+  不复制数据、不占在途字节；复制时以 O_CREAT|O_EXCL 新建目标文件再写入，
+  其他进程抢先建了同名文件时换一个名字
+"""
+
+import collections
+import errno
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+HDD_SLOTS = 2
+DEFAULT_SLOTS = 8
+MAX_WORKERS = 32
+MAX_INFLIGHT_BYTES = 1024 * 1024 * 1024
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# src、dst_dir 为 Path；size 为源文件大小；category 只是透传给回调
+Job = collections.namedtuple('Job', 'src dst_dir size src_dev dst_dev category')
+
+
+def device_slots(dev):
+    """设备的并发槽位：Linux 上按 /sys/dev/block 的 rotational 区分机械盘，其他（网络盘、tmpfs 等）按默认值"""
+    base = '/sys/dev/block/%d:%d' % (os.major(dev), os.minor(dev))
+    # 分区自己没有 queue 目录，看所在的整块盘
+    for path in (base + '/queue/rotational', base + '/../queue/rotational'):
+        try:
+            with open(path) as f:
+                return HDD_SLOTS if f.read().strip() == '1' else DEFAULT_SLOTS
+        except OSError:
+            pass
+    return DEFAULT_SLOTS
+
+
+def _candidates(name):
+    """先试原名，之后每次换一个随机后缀"""
+    yield name
+    stem, suffix = Path(name).stem, Path(name).suffix
+    while True:
+        yield stem + '_' + uuid.uuid4().hex[:8] + suffix
+
+
+def make_job(src, dst_dir, dst_dev, category=None):
+    st = os.stat(src)
+    return Job(Path(src), Path(dst_dir), st.st_size, st.st_dev, dst_dev, category)
+
+
+def _copy_data(src, fout, release, chunk_size):
+    """把 src 的内容写到已打开的 fout，每写出一块调用一次 release(字节数)；Linux 上用 sendfile，不经过用户态缓冲"""
+    with open(src, 'rb') as fin:
+        offset = 0
+        if hasattr(os, 'sendfile'):
+            try:
+                while True:
+                    sent = os.sendfile(fout.fileno(), fin.fileno(), offset, chunk_size)
+                    if not sent:
+                        return
+                    offset += sent
+                    release(sent)
+            except OSError:
+                if offset:
+                    raise
+        # 不支持文件到文件 sendfile 的平台
+        while True:
+            data = fin.read(chunk_size)
+            if not data:
+                return
+            fout.write(data)
+            release(len(data))
+
+
+class TransferEngine:
+    def __init__(self, move, slots=device_slots, max_inflight_bytes=MAX_INFLIGHT_BYTES,
+                 max_workers=MAX_WORKERS, chunk_size=CHUNK_SIZE):
+        self.move = move
+        self.slots = slots
+        self.max_inflight_bytes = max_inflight_bytes
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self._cond = threading.Condition()
+        self._names_lock = threading.Lock()
+
+    def run(self, jobs, on_done):
+        """
+        执行全部任务后返回。每个任务结束时在工作线程里调用
+        on_done(job, 目标路径, 动作, 耗时, 异常)，动作为 'Moved' / 'Copied'，成功时异常为 None
+        """
+        queues = collections.defaultdict(list)
+        for job in jobs:
+            queues[job.src_dev, job.dst_dev].append(job)
+        if not queues:
+            return
+        # 每组按大小升序排，deque 右端最大、左端最小
+        self._queues = {key: collections.deque(sorted(q, key=lambda j: j.size)) for key, q in queues.items()}
+        devices = {dev for key in self._queues for dev in key}
+        self._free = {dev: max(self.slots(dev), 1) for dev in devices}
+        self._inflight = 0
+        self._remaining = sum(len(q) for q in self._queues.values())
+        self._claimed = set()
+        workers = min(self.max_workers, sum(self._free.values()), self._remaining)
+        with ThreadPoolExecutor(workers, thread_name_prefix='transfer') as pool:
+            for future in [pool.submit(self._worker, on_done) for _ in range(workers)]:
+                future.result()
+
+    def _cost(self, job):
+        # 同一设备上的移动只是改名
+        return 0 if self.move and job.src_dev == job.dst_dev else job.size
+
+    def _take(self):
+        """取下一个能开始的任务并占好槽位和在途字节；全部分配完时返回 None"""
+        with self._cond:
+            while True:
+                if not self._remaining:
+                    return None
+                best = None
+                for key, queue in self._queues.items():
+                    if not queue or not all(self._free[dev] > 0 for dev in set(key)):
+                        continue
+                    # 先看组里最大的，字节额度不够时看最小的
+                    for job, pop in ((queue[-1], queue.pop), (queue[0], queue.popleft)):
+                        cost = self._cost(job)
+                        if not self._inflight or self._inflight + cost <= self.max_inflight_bytes:
+                            if best is None or job.size > best[0].size:
+                                best = (job, pop, cost)
+                            break
+                if best is not None:
+                    job, pop, cost = best
+                    pop()
+                    self._remaining -= 1
+                    for dev in {job.src_dev, job.dst_dev}:
+                        self._free[dev] -= 1
+                    self._inflight += cost
+                    return job, cost
+                self._cond.wait()
+
+    def _release(self, nbytes):
+        with self._cond:
+            self._inflight -= nbytes
+            self._cond.notify_all()
+
+    def _worker(self, on_done):
+        while True:
+            taken = self._take()
+            if taken is None:
+                return
+            job, cost = taken
+            released = 0
+
+            def release(nbytes):
+                nonlocal released
+                nbytes = min(nbytes, cost - released)
+                released += nbytes
+                self._release(nbytes)
+
+            t0 = time.perf_counter()
+            target, error = None, None
+            action = 'Moved' if self.move else 'Copied'
+            try:
+                target = self._transfer(job, release)
+            except Exception as e:
+                error = e
+            finally:
+                with self._cond:
+                    for dev in {job.src_dev, job.dst_dev}:
+                        self._free[dev] += 1
+                    self._inflight -= cost - released
+                    self._cond.notify_all()
+            on_done(job, target, action, time.perf_counter() - t0, error)
+
+    def _claim(self, directory, name):
+        """给目标分配一个名字：跳过磁盘上已有的和本次 run() 里其他任务分配过的，重名时加随机后缀"""
+        with self._names_lock:
+            for candidate in _candidates(name):
+                path = os.path.join(directory, candidate)
+                if path not in self._claimed and not os.path.lexists(path):
+                    self._claimed.add(path)
+                    return Path(path)
+
+    def _transfer(self, job, release):
+        target = self._claim(job.dst_dir, job.src.name)
+        if self.move and job.src_dev == job.dst_dev:
+            try:
+                os.replace(job.src, target)
+                return target
+            except OSError as e:
+                # 同一文件系统的不同绑定挂载点之间不能改名，退回复制
+                if e.errno != errno.EXDEV:
+                    raise
+        # 与 shutil.copy2 一样直接写目标文件，没写完就出错时删掉
+        while True:
+            try:
+                fout = open(target, 'xb')
+                break
+            except FileExistsError:
+                # 其他进程刚建了同名文件
+                target = self._claim(job.dst_dir, job.src.name)
+        try:
+            with fout:
+                _copy_data(job.src, fout, release, self.chunk_size)
+            shutil.copystat(job.src, target)
+        except BaseException:
+            os.remove(target)
+            raise
+        if self.move:
+            os.remove(job.src)
+        return target
@@ -0,0 +1,95 @@
+"""
+播放计数的延迟写入与热门榜
+
+每次播放只在进程内存里累加，由后台线程定时（或累计条数达到阈值时）
+把增量合并成一个事务写回数据库，播放请求本身不再争抢 SQLite 写锁。
+
+热门分数按半衰期做时间衰减。为了不必每次刷新都衰减全表，分数统一换算到
+固定起点 EPOCH 的对数尺度上保存：
+    score = log2( sum(增量_i * 2^((t_i - EPOCH) / 半衰期)) )
+任意时刻各视频的衰减后分数都相差同一个因子，所以直接按 score 排序即可，
+每次刷新只需更新本批被播放过的视频。
+"""
+
+import atexit
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+EPOCH = 1735689600  # 2025-01-01 UTC
+
+
+def decayed_log_score(old_score, delta, now, half_life):
+    """把 delta 次播放按时间 now 加到已有的对数分数上"""
+    add = (now - EPOCH) / half_life + math.log2(delta)
+    if old_score is None:
+        return add
+    hi, lo = max(old_score, add), min(old_score, add)
+    return hi + math.log2(1 + 2 ** (lo - hi))
+
+
+def score_floor(now, half_life, min_views=0.01):
+    """衰减后低于 min_views 次播放的分数线，用来清理冷门记录"""
+    return (now - EPOCH) / half_life + math.log2(min_views)
+
+
+class ViewCounter:
+    """
+    线程安全的播放计数缓冲。flush_fn(deltas, now) 接收 {video_id: 次数}，
+    在一个事务里写库；写库失败时增量会合并回缓冲区等待下次刷新。
+    """
+
+    def __init__(self, flush_fn, interval=5.0, max_pending=1000):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def hit(self, video_id, n=1):
+        with self._lock:
+            self._pending[video_id] = self._pending.get(video_id, 0) + n
+            self._count += n
+            full = self._count >= self.max_pending
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                deltas, self._pending = self._pending, {}
+                self._count = 0
+            if not deltas:
+                return 0
+            try:
+                self.flush_fn(deltas, time.time())
+            except Exception:
+                logger.exception('写入播放计数失败，稍后重试')
+                with self._lock:
+                    for video_id, n in deltas.items():
+                        self._pending[video_id] = self._pending.get(video_id, 0) + n
+                        self._count += n
+                return 0
+            return len(deltas)
@@ -0,0 +1,220 @@
+"""
+边读边发的 ZIP64 打包下载，不重新压缩、不落临时文件，支持 Range 断点续传
+
+每个条目的数据直接取自磁盘上的一段字节：
+- stored：图片、视频本身已经压缩过，原样存入
+- deflate：gzip 压缩存储的文本（text_store），gzip 里的 deflate 数据就是 ZIP 要的格式，
+  不用解压再压缩
+CRC-32 和大小在打包前都已知，本地文件头直接写好，不用数据描述符。
+
+ZipLayout 根据条目列表算出整个归档的布局：每个文件头、数据段、中央目录在归档中的偏移，
+只依赖文件名、大小、CRC、修改时间，所以同样的文件集合每次打出完全相同的字节。
+ETag 取中央目录（含结尾记录）的 SHA-1：续传时 If-Range 与之相同，就可以从任意偏移接着发。
+内存里只有各条目的文件头和中央目录，与文件大小无关。
+
+数据段读取时核对打包时的 inode、大小、mtime_ns，文件已被替换或修改时抛出 ArchiveChanged，
+连接随之中断，不会发出与 ETag 不符的内容。
+"""
+
+import bisect
+import hashlib
+import os
+import struct
+import time
+import unicodedata
+import zlib
+from collections import namedtuple
+from urllib.parse import quote
+
+from flask import Response, request
+
+import media_stream
+
+STORED, DEFLATED = 0, 8
+ZIP64_LIMIT = 0xFFFFFFFF
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP64_END = struct.Struct('<IQHHIIQQQQ')
+ZIP64_LOCATOR = struct.Struct('<IIQI')
+END = struct.Struct('<IHHHHIIH')
+
+# 创建系统为 Unix（权限位放在外部属性高 16 位），版本 4.5（ZIP64）
+_MADE_BY = (3 << 8) | 45
+_UTF8_FLAG = 0x800
+_FILE_MODE = 0o100644 << 16
+
+# st：打包时的 stat 结果（读取时核对）；size：原文大小；offset、length：数据在磁盘文件里的位置
+Entry = namedtuple('Entry', 'name path st method crc size offset length')
+
+
+class ArchiveChanged(Exception):
+    pass
+
+
+def stored(name, path, st, crc):
+    return Entry(name, path, st, STORED, crc, st.st_size, 0, st.st_size)
+
+
+def deflated(name, path, st, offset, length, crc, size):
+    return Entry(name, path, st, DEFLATED, crc, size, offset, length)
+
+
+def file_crc32(path, chunk_size=1024 * 1024):
+    crc = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def _dos_time(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    year = min(t.tm_year, 2107)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def _local_header(entry):
+    name = entry.name.encode('utf-8')
+    dos_time, dos_date = _dos_time(entry.st.st_mtime)
+    extra = b''
+    size, length = entry.size, entry.length
+    if size >= ZIP64_LIMIT or length >= ZIP64_LIMIT:
+        # 本地头的 ZIP64 扩展字段必须同时给出原文大小和压缩后大小
+        extra = struct.pack('<HHQQ', 1, 16, size, length)
+        size = length = ZIP64_LIMIT
+    version = 45 if extra else 20 if entry.method == DEFLATED else 10
+    return LOCAL_HEADER.pack(0x04034b50, version, _UTF8_FLAG, entry.method, dos_time, dos_date,
+                             entry.crc, length, size, len(name), len(extra)) + name + extra
+
+
+def _central_header(entry, offset):
+    name = entry.name.encode('utf-8')
+    dos_time, dos_date = _dos_time(entry.st.st_mtime)
+    # 超出 32 位的字段置 0xFFFFFFFF，真实值按原文大小、压缩后大小、偏移的顺序放进扩展字段
+    fields = []
+    size, length = entry.size, entry.length
+    if size >= ZIP64_LIMIT or length >= ZIP64_LIMIT:
+        fields += [size, length]
+        size = length = ZIP64_LIMIT
+    if offset >= ZIP64_LIMIT:
+        fields.append(offset)
+        offset = ZIP64_LIMIT
+    extra = struct.pack('<HH%dQ' % len(fields), 1, 8 * len(fields), *fields) if fields else b''
+    version = 45 if extra else 20 if entry.method == DEFLATED else 10
+    return CENTRAL_HEADER.pack(0x02014b50, _MADE_BY, version, _UTF8_FLAG, entry.method, dos_time, dos_date,
+                               entry.crc, length, size, len(name), len(extra), 0, 0, 0, _FILE_MODE,
+                               offset) + name + extra
+
+
+def _end_records(count, cd_offset, cd_size):
+    """ZIP64 结尾记录 + 定位器 + 普通结尾记录；总是写 ZIP64 的，条目数和偏移不受 16/32 位限制"""
+    zip64_end = ZIP64_END.pack(0x06064b50, ZIP64_END.size - 12, _MADE_BY, 45, 0, 0,
+                               count, count, cd_size, cd_offset)
+    locator = ZIP64_LOCATOR.pack(0x07064b50, 0, cd_offset + cd_size, 1)
+    end = END.pack(0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                   min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+    return zip64_end + locator + end
+
+
+class ZipLayout:
+    """一个归档的完整布局；iter_range() 按归档偏移产出任意一段字节"""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._parts = []  # (归档偏移, bytes 或条目下标)
+        central = []
+        pos = 0
+        for i, entry in enumerate(self.entries):
+            header = _local_header(entry)
+            central.append(_central_header(entry, pos))
+            self._parts.append((pos, header))
+            pos += len(header)
+            self._parts.append((pos, i))
+            pos += entry.length
+        central = b''.join(central)
+        tail = central + _end_records(len(self.entries), pos, len(central))
+        self._parts.append((pos, tail))
+        self._starts = [start for start, _ in self._parts]
+        self.size = pos + len(tail)
+        self.etag = hashlib.sha1(tail).hexdigest()
+        self.mtime = max((entry.st.st_mtime for entry in self.entries), default=0)
+
+    def iter_range(self, start=0, stop=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """产出归档中 [start, stop) 的字节"""
+        stop = self.size if stop is None else min(stop, self.size)
+        k = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        while start < stop and k < len(self._parts):
+            base, part = self._parts[k]
+            if isinstance(part, bytes):
+                end = base + len(part)
+                if start < end:
+                    yield part[start - base:min(stop, end) - base]
+            else:
+                entry = self.entries[part]
+                end = base + entry.length
+                if start < end:
+                    yield from _read_span(entry, entry.offset + start - base, min(stop, end) - start, chunk_size)
+            start = max(start, end)
+            k += 1
+
+
+def _read_span(entry, offset, length, chunk_size):
+    fd = os.open(entry.path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        if (st.st_ino, st.st_size, st.st_mtime_ns) != (entry.st.st_ino, entry.st.st_size, entry.st.st_mtime_ns):
+            raise ArchiveChanged(entry.path)
+        while length > 0:
+            data = os.pread(fd, min(chunk_size, length), offset)
+            if not data:
+                raise ArchiveChanged(entry.path)
+            offset += len(data)
+            length -= len(data)
+            yield data
+    finally:
+        os.close(fd)
+
+
+def _content_disposition(response, download_name):
+    # 与 send_file 相同：非 ASCII 文件名另给一个 filename* 参数
+    if download_name.isascii():
+        response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    else:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        if not simple.rsplit('.', 1)[0]:
+            simple = 'export' + simple  # 整个名字都是中文时只剩扩展名
+        response.headers.set('Content-Disposition', 'attachment', filename=simple,
+                             **{'filename*': "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~")})
+
+
+def send_archive(layout, download_name, chunk_size=DEFAULT_CHUNK_SIZE):
+    """按当前请求的 Range / If-Range / If-None-Match 返回归档的全部或一段"""
+    if request.if_none_match.contains(layout.etag):
+        response = Response(status=304)
+        response.set_etag(layout.etag)
+        return response
+    start, stop, status = 0, layout.size, 200
+    headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache'}
+    # If-Range 只认 ETag：给日期的一律按整个文件返回
+    if not request.headers.get('If-Range') or request.if_range.etag == layout.etag:
+        try:
+            ranges = media_stream.parse_range(request.headers.get('Range'), layout.size)
+        except media_stream.RangeNotSatisfiable:
+            headers['Content-Range'] = 'bytes */%d' % layout.size
+            return Response(status=416, headers=headers)
+        if ranges:
+            # 多个区间合并成一个覆盖区间（RFC 7233 允许），续传只会用到单个区间
+            start, stop, status = min(r[0] for r in ranges), max(r[1] for r in ranges) + 1, 206
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, layout.size)
+    headers['Content-Length'] = str(stop - start)
+    response = Response(layout.iter_range(start, stop, chunk_size), status=status, headers=headers,
+                        mimetype='application/zip', direct_passthrough=True)
+    response.set_etag(layout.etag)
+    response.last_modified = int(layout.mtime)
+    _content_disposition(response, download_name)
+    return response
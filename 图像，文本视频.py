@@ -1,13 +1,49 @@
+import hashlib
+import http_cache
 import os
 import sqlite3
-from flask import Flask, render_template_string, request, redirect, url_for, abort, g, flash, send_file, session
+import click
+from flask import Flask, render_template, request, redirect, url_for, abort, g, flash, send_file, session, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+import image_variants
+import metrics
+import quota
+import sqlite_pool
+import template_registry
+import text_pages
+import text_search
+import text_store
+import zip_stream
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key_here'
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max upload size
+app.config['TEMPLATE_CACHE_DIR'] = None  # jinja字节码缓存目录，None为系统临时目录
+app.config['METRICS_PROFILE_SLOW_MS'] = int(os.environ.get('METRICS_PROFILE_SLOW_MS', 0))  # 慢请求采样阈值，0为关闭
+app.config['QUOTA_MAX_BYTES'] = 1024 * 1024 * 1024  # 每个用户的存储配额，None为不限制
+app.config['QUOTA_MAX_FILES'] = 500
+app.config['QUOTA_RECONCILE_INTERVAL'] = 3600  # 后台按files表重算用量计数器的间隔（秒）
+app.config['TEXT_SNIPPET_BYTES'] = 2048  # 文本预览：上传时截取开头若干字节/行存进files.snippet
+app.config['TEXT_SNIPPET_LINES'] = 20
+app.config['SEARCH_PAGE_SIZE'] = 20  # 搜索结果每页用户数
+app.config['SEARCH_FILES_PER_TYPE'] = 6  # 每个用户每种类型最多预览的文件数
+app.config['TEXT_INDEX_MAX_BYTES'] = 8 * 1024 * 1024  # 全文索引只收录每个文本文件开头的这么多字节
+app.config['TEXT_SEARCH_PAGE_SIZE'] = 20  # 全文搜索每页结果数
+app.config['TEXT_VIEW_PAGE_LINES'] = 200  # 文本查看每页行数
+app.config['TEXT_VIEW_MAX_LINES'] = 1000  # /lines 接口一次最多返回的行数
+app.config['TEXT_VIEW_MAX_LINE_BYTES'] = 16 * 1024  # 超过这个长度的行截断显示
+app.config['TEXT_GZIP_LEVEL'] = 6  # 文本文件上传时 gzip 压缩存储的级别
+# 图片派生图（多宽度 WebP/JPEG）缓存目录、生成进程数，以及按需生成时请求最多等待的秒数
+app.config['IMAGE_VARIANT_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_variants')
+app.config['IMAGE_VARIANT_WORKERS'] = 2
+app.config['IMAGE_VARIANT_WAIT'] = 5.0
+app.config['MEDIA_CACHE_MAX_AGE'] = 365 * 24 * 3600  # 带版本号的图片/视频链接的缓存时间
+
+# 请求、SQL、模板耗时与媒体字节数，/metrics 输出
+metrics.init_app(app, video_endpoints={'user_file'})
 
 DATABASE = 'users.db'
 
@@ -18,7 +54,7 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'txt'}
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = g._database = sqlite3.connect(DATABASE, factory=metrics.TimedConnection)
         db.row_factory = sqlite3.Row
     return db
 
@@ -40,21 +76,252 @@ def create_user_file_dirs(username):
         dir_path = os.path.join(base, folder)
         os.makedirs(dir_path, exist_ok=True)
 
-# 读取文本文件内容辅助函数（用于搜索页面显示文本文件内容）
-def get_text_content(username, filename):
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], username, 'text', filename)
+# 文本文件压缩存储为 <文件名>.gz，早于压缩存储上传、还没转换的仍是原文
+def stored_path(username, filetype, filename):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], username, filetype, filename)
+    if filetype == 'text' and os.path.exists(path + text_store.SUFFIX):
+        return path + text_store.SUFFIX
+    return path
+
+# 文本预览：只读（解压）文件开头 TEXT_SNIPPET_BYTES 字节，再截到 TEXT_SNIPPET_LINES 行
+def read_snippet(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            text = f.read()
-            return text
-    except Exception:
-        return '[无内容或文件读取失败]'
+        with text_store.open_text(file_path) as f:
+            data = f.read(app.config['TEXT_SNIPPET_BYTES'])
+    except OSError:
+        return None
+    # 截断处可能落在多字节字符中间，errors='ignore' 丢掉半个字符
+    lines = data.decode('utf-8', errors='ignore').splitlines(keepends=True)
+    return ''.join(lines[:app.config['TEXT_SNIPPET_LINES']])
+
+# 列表页和搜索页显示的文本预览；旧记录没有存预览时读文件开头
+def text_snippet(username, f):
+    if f['snippet'] is not None:
+        return f['snippet']
+    snippet = read_snippet(stored_path(username, 'text', f['filename']))
+    return '[无内容或文件读取失败]' if snippet is None else snippet
+
+# 给旧的文本记录补上预览
+@app.cli.command('backfill-snippets')
+def backfill_snippets_command():
+    conn = get_db()
+    rows = conn.execute("SELECT files.id, files.filename, users.username FROM files "
+                        "JOIN users ON users.id = files.user_id "
+                        "WHERE files.filetype = 'text' AND files.snippet IS NULL").fetchall()
+    done = 0
+    for row in rows:
+        snippet = read_snippet(stored_path(row['username'], 'text', row['filename']))
+        if snippet is not None:
+            conn.execute('UPDATE files SET snippet=? WHERE id=?', (snippet, row['id']))
+            done += 1
+    conn.commit()
+    print(f'已补齐 {done} 个文本预览，{len(rows) - done} 个文件不存在')
+
+# 遍历 uploads/<用户>/text 下有记录的文件，逐个产出 (files.id, 文件名, 路径)，不一次性列出全部
+def iter_text_documents(conn):
+    with os.scandir(app.config['UPLOAD_FOLDER']) as users:
+        for user_entry in users:
+            text_dir = os.path.join(user_entry.path, 'text')
+            if not user_entry.is_dir() or not os.path.isdir(text_dir):
+                continue
+            ids = {row['filename']: row['id'] for row in conn.execute(
+                "SELECT files.id, files.filename FROM files JOIN users ON users.id = files.user_id "
+                "WHERE users.username = ? AND files.filetype = 'text'", (user_entry.name,))}
+            with os.scandir(text_dir) as entries:
+                for entry in entries:
+                    # 压缩存储的多一个 .gz 后缀；转换过程中原文和 .gz 同时存在时只取 .gz
+                    name = entry.name
+                    if name.endswith(text_store.SUFFIX):
+                        name = name[:-len(text_store.SUFFIX)]
+                    elif os.path.exists(entry.path + text_store.SUFFIX):
+                        continue
+                    if name in ids and entry.is_file():
+                        yield ids[name], name, entry.path
+
+# 给已有的文本文件建立全文索引，每批提交一次，中断后重跑会跳过已索引的文件
+@app.cli.command('index-texts')
+@click.option('--batch', default=200, show_default=True, help='每个事务索引的文件数')
+@click.option('--rebuild', is_flag=True, help='清空索引后全部重建')
+def index_texts_command(batch, rebuild):
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    if rebuild:
+        with sqlite_pool.write_transaction(conn):
+            conn.execute('DELETE FROM text_fts')
+
+    def progress(indexed, skipped, elapsed):
+        print(f'已索引 {indexed} 个，跳过 {skipped} 个，{elapsed:.1f}s')
+    indexed, skipped = text_search.bulk_index(conn, iter_text_documents(conn), batch=batch,
+                                              max_bytes=app.config['TEXT_INDEX_MAX_BYTES'], progress=progress)
+    conn.close()
+    print(f'完成：索引 {indexed} 个文件，跳过 {skipped} 个')
+
+# 把压缩存储之前上传的文本文件转成 .gz，逐个文件提交，用量计数器按压缩后的大小更新
+@app.cli.command('compress-texts')
+def compress_texts_command():
+    conn = sqlite3.connect(DATABASE)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("SELECT files.id, files.user_id, files.filename, users.username FROM files "
+                        "JOIN users ON users.id = files.user_id WHERE files.filetype = 'text'").fetchall()
+    done = raw_total = stored_total = 0
+    for row in rows:
+        raw_path = os.path.join(app.config['UPLOAD_FOLDER'], row['username'], 'text', row['filename'])
+        gz_path = raw_path + text_store.SUFFIX
+        if not os.path.exists(raw_path) or os.path.exists(gz_path):
+            continue
+        tmp_path = raw_path + '.part' + text_store.SUFFIX
+        raw_size, size = text_store.compress_file(raw_path, tmp_path, app.config['TEXT_GZIP_LEVEL'])
+        mtime_ns = os.stat(tmp_path).st_mtime_ns
+        replaced = False
+        with sqlite_pool.write_transaction(conn):
+            # 期间被删除或重新上传（已经是 .gz）的跳过
+            old = conn.execute('SELECT size FROM files WHERE id=?', (row['id'],)).fetchone()
+            if old is not None and os.path.exists(raw_path) and not os.path.exists(gz_path):
+                old_size = old['size'] if old['size'] is not None else raw_size
+                quota.charge(conn, row['user_id'], size - old_size, 0)
+                conn.execute('UPDATE files SET size=?, mtime_ns=? WHERE id=?', (size, mtime_ns, row['id']))
+                text_store.replace(tmp_path, gz_path)
+                replaced = True
+        if not replaced:
+            text_store.remove(tmp_path)
+            continue
+        os.remove(raw_path)
+        text_pages.remove_index(raw_path)
+        done += 1
+        raw_total += raw_size
+        stored_total += size
+    conn.close()
+    saved = 100 * (1 - stored_total / raw_total) if raw_total else 0
+    print(f'已压缩 {done} 个文本文件：{quota.format_bytes(raw_total)} -> {quota.format_bytes(stored_total)}，节省 {saved:.1f}%')
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# --- 图片派生图 ---
+variant_pipeline = image_variants.VariantPipeline(app.config['IMAGE_VARIANT_FOLDER'],
+                                                  max_workers=app.config['IMAGE_VARIANT_WORKERS'])
+
+def has_variants(f):
+    return f['filename'].rsplit('.', 1)[-1].lower() in image_variants.SOURCE_EXTENSIONS
+
+def image_srcset(username, f, fmt):
+    """srcset 里只列出不超过原图宽度的尺寸，原图宽度未知时全部列出"""
+    original = f['width']
+    widths = [w for w in image_variants.WIDTHS if original is None or w < original]
+    if original is not None and len(widths) < len(image_variants.WIDTHS):
+        widths.append(image_variants.snap_width(original))
+    return ', '.join('%s %dw' % (media_url(username, 'image', f, w=w, fmt=fmt), min(w, original or w)) for w in widths)
+
+# 图片/视频链接带上版本号，内容变了链接跟着变，浏览器可以一直缓存
+def media_url(username, filetype, f, **params):
+    return url_for('user_file', username=username, filetype=filetype, filename=f['filename'],
+                   v=http_cache.version(f['size'], f['mtime_ns']), **params)
+
+app.jinja_env.globals.update(has_variants=has_variants, image_srcset=image_srcset, media_url=media_url)
+
+def send_media(path, etag, mtime, immutable):
+    response = send_file(path, etag=etag, last_modified=mtime)
+    return http_cache.apply(response, etag, mtime, immutable, app.config['MEDIA_CACHE_MAX_AGE'])
+
+# 派生图：按需生成，早于本功能上传、还没有哈希的图片先补上哈希。
+# 派生图由原图内容和宽度、格式决定，ETag 在原图的基础上加上这两项，验证时不用查库
+def send_image_variant(username, filename, file_path, width, fmt, st, immutable):
+    etag = http_cache.make_etag(st)
+    variant_etag = '%s-%d-%s' % (etag, image_variants.snap_width(width), fmt)
+    if http_cache.is_not_modified(variant_etag, st.st_mtime):
+        return http_cache.not_modified_response(app, variant_etag, st.st_mtime, immutable,
+                                                app.config['MEDIA_CACHE_MAX_AGE'])
+    conn = get_db()
+    row = conn.execute('SELECT files.id, files.sha256 FROM files JOIN users ON users.id = files.user_id '
+                       "WHERE users.username=? AND files.filetype='image' AND files.filename=?",
+                       (username, filename)).fetchone()
+    if row is None or fmt not in image_variants.FORMATS or not has_variants({'filename': filename}):
+        return send_media(file_path, etag, st.st_mtime, immutable)
+    digest = row['sha256']
+    if digest is None:
+        digest = file_sha256(file_path)
+        original_width, original_height = image_variants.image_size(file_path)
+        conn.execute('UPDATE files SET sha256=?, width=?, height=? WHERE id=?',
+                     (digest, original_width, original_height, row['id']))
+        conn.commit()
+    path = variant_pipeline.ensure(digest, file_path, image_variants.snap_width(width), fmt,
+                                   timeout=app.config['IMAGE_VARIANT_WAIT'])
+    # 生成失败、超时或队列已满时先给原图，这个回复不能长期缓存
+    if path is None:
+        return send_media(file_path, etag, st.st_mtime, False)
+    return send_media(path, variant_etag, st.st_mtime, immutable)
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# 按files表重算所有用户的存储用量，在后台线程中执行，自己打开连接
+def reconcile_usage():
+    conn = sqlite3.connect(DATABASE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        # 旧记录没有大小或修改时间，stat一次补上
+        rows = conn.execute('SELECT files.id, files.filename, files.filetype, users.username FROM files '
+                            'JOIN users ON users.id = files.user_id '
+                            'WHERE files.size IS NULL OR files.mtime_ns IS NULL').fetchall()
+        for row in rows:
+            path = stored_path(row['username'], row['filetype'], row['filename'])
+            try:
+                st = os.stat(path)
+            except OSError:
+                conn.execute('UPDATE files SET size=COALESCE(size, 0) WHERE id=?', (row['id'],))
+                continue
+            conn.execute('UPDATE files SET size=COALESCE(size, ?), mtime_ns=? WHERE id=?',
+                         (st.st_size, st.st_mtime_ns, row['id']))
+        conn.commit()
+        # 汇总和覆盖在同一个写事务里，期间的上传/删除不会被覆盖掉
+        with sqlite_pool.write_transaction(conn):
+            usage = conn.execute('SELECT users.id, COALESCE(SUM(files.size), 0), COUNT(files.id) FROM users '
+                                 'LEFT JOIN files ON files.user_id = users.id GROUP BY users.id').fetchall()
+            drifted = quota.reset_usage(conn, usage)
+        if drifted:
+            app.logger.warning('重算存储用量：%d 个用户的计数器有偏差，已修正', drifted)
+        return drifted
+    finally:
+        conn.close()
+
+usage_reconciler = quota.Reconciler(reconcile_usage, interval=app.config['QUOTA_RECONCILE_INTERVAL'])
+app.jinja_env.globals['format_bytes'] = quota.format_bytes
+
+def current_usage(user_id):
+    usage_reconciler.start()
+    return quota.get_usage(get_db(), user_id)
+
+# 立即重算存储用量
+@app.cli.command('reconcile-usage')
+def reconcile_usage_command():
+    print(f'已重算存储用量，{reconcile_usage()} 个用户的计数器有偏差')
 
 # 应用主页，简单重定向到搜索页面
 @app.route('/')
 def index():
     return redirect(url_for('search'))
 
+# 注册页面模板
+REGISTER_HTML = '''
+{% extends "base.html" %}
+{% block body %}
+<h2>注册</h2>
+<form method="post">
+  用户名: <input type="text" name="username"><br>
+  密码: <input type="password" name="password"><br>
+  <input type="submit" value="注册">
+</form>
+<p>已有账号？<a href="{{ url_for('login') }}">登录</a></p>
+{% endblock %}
+'''
+
 # 用户注册
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -85,19 +352,21 @@ def register():
         flash('注册成功，请登录')
         return redirect(url_for('login'))
     
-    # 注册页面HTML模板
-    return render_template_string('''
-    {% extends "base.html" %}
-    {% block body %}
-    <h2>注册</h2>
-    <form method="post">
-      用户名: <input type="text" name="username"><br>
-      密码: <input type="password" name="password"><br>
-      <input type="submit" value="注册">
-    </form>
-    <p>已有账号？<a href="{{ url_for('login') }}">登录</a></p>
-    {% endblock %}
-    ''')
+    return render_template('register.html')
+
+# 登录页面模板
+LOGIN_HTML = '''
+{% extends "base.html" %}
+{% block body %}
+<h2>登录</h2>
+<form method="post">
+  用户名: <input type="text" name="username"><br>
+  密码: <input type="password" name="password"><br>
+  <input type="submit" value="登录">
+</form>
+<p>没有账号？<a href="{{ url_for('register') }}">注册</a></p>
+{% endblock %}
+'''
 
 # 用户登录
 @app.route('/login', methods=['GET', 'POST'])
@@ -121,19 +390,7 @@ def login():
             flash('用户名或密码错误')
             return redirect(url_for('login'))
     
-    # 登录页面HTML模板
-    return render_template_string('''
-    {% extends "base.html" %}
-    {% block body %}
-    <h2>登录</h2>
-    <form method="post">
-      用户名: <input type="text" name="username"><br>
-      密码: <input type="password" name="password"><br>
-      <input type="submit" value="登录">
-    </form>
-    <p>没有账号？<a href="{{ url_for('register') }}">注册</a></p>
-    {% endblock %}
-    ''')
+    return render_template('login.html')
 
 # 用户登出
 @app.route('/logout')
@@ -142,6 +399,84 @@ def logout():
     flash('已登出')
     return redirect(url_for('login'))
 
+# 用户文件列表页面模板，支持在线浏览文件
+USER_FILES_HTML = '''
+{% extends "base.html" %}
+{% from "image_macros.html" import responsive_image with context %}
+{% block head %}
+<style>
+.file-item {
+    margin-bottom: 10px;
+    border: 1px solid #ddd;
+    padding: 5px;
+    max-width: 400px;
+}
+pre {
+    white-space: pre-wrap;
+    max-height: 200px;
+    overflow: auto;
+    border:1px solid #ccc;
+    padding: 5px;
+    background-color: #f9f9f9;
+}
+</style>
+{% endblock %}
+{% macro delete_button(filetype, f) %}
+{% if usage %}
+<form method="post" action="{{ url_for('delete_file', filetype=filetype, filename=f['filename']) }}" style="display:inline;" onsubmit="return confirm('确认删除？');">
+  <button type="submit">删除</button>
+</form>
+{% endif %}
+{% endmacro %}
+{% block body %}
+<h2>{{ username }}的文件列表</h2>
+{% if usage %}
+<p>存储用量：{{ format_bytes(usage[0]) }}{% if max_bytes %} / {{ format_bytes(max_bytes) }}{% endif %}，
+{{ usage[1] }} 个文件{% if max_files %} / 上限 {{ max_files }} 个{% endif %}</p>
+{% endif %}
+<p><a href="{{ url_for('export_files', username=username) }}">打包下载全部文件（ZIP）</a></p>
+
+<h3>图片</h3>
+{% if images %}
+  {% for f in images %}
+    <div class="file-item">
+      <p>{{ f['filename'] }}{{ delete_button('image', f) }}</p>
+      {{ responsive_image(username, f) }}
+    </div>
+  {% endfor %}
+{% else %}
+  <p>无</p>
+{% endif %}
+
+<h3>视频</h3>
+{% if videos %}
+  {% for f in videos %}
+    <div class="file-item">
+      <p>{{ f['filename'] }}{{ delete_button('video', f) }}</p>
+      <video width="320" controls>
+        <source src="{{ media_url(username, 'video', f) }}" type="video/mp4">
+        您的浏览器不支持视频播放
+      </video>
+    </div>
+  {% endfor %}
+{% else %}
+  <p>无</p>
+{% endif %}
+
+<h3>文本</h3>
+{% if texts %}
+  {% for f in texts %}
+    <div class="file-item">
+      <p>{{ f['filename'] }}{{ delete_button('text', f) }}</p>
+      <pre>{{ text_snippet(username, f) }}</pre>
+    </div>
+  {% endfor %}
+{% else %}
+  <p>无</p>
+{% endif %}
+{% endblock %}
+'''
+
 # 用户文件列表页面，可以在线浏览图像、视频、文本
 @app.route('/user/<username>')
 def user_files(username):
@@ -155,8 +490,10 @@ def user_files(username):
     user_id = user['id']
 
     # 查询用户文件
-    c.execute('SELECT id, filename, filetype FROM files WHERE user_id=?', (user_id,))
+    c.execute('SELECT id, filename, filetype, snippet, width, size, mtime_ns FROM files WHERE user_id=?', (user_id,))
     files = c.fetchall()
+    # 本人查看时显示存储用量（只读计数器）
+    usage = current_usage(user_id) if session.get('user_id') == user_id else None
     conn.close()
 
     # 根据文件类型列表分类
@@ -164,70 +501,61 @@ def user_files(username):
     videos = [f for f in files if f['filetype'] == 'video']
     texts = [f for f in files if f['filetype'] == 'text']
 
-    # 页面模板，支持在线浏览文件
-    return render_template_string('''
-    {% extends "base.html" %}
-    {% block head %}
-    <style>
-    .file-item {
-        margin-bottom: 10px;
-        border: 1px solid #ddd;
-        padding: 5px;
-        max-width: 400px;
-    }
-    pre {
-        white-space: pre-wrap;
-        max-height: 200px;
-        overflow: auto;
-        border:1px solid #ccc;
-        padding: 5px;
-        background-color: #f9f9f9;
-    }
-    </style>
-    {% endblock %}
-    {% block body %}
-    <h2>{{ username }}的文件列表</h2>
-
-    <h3>图片</h3>
-    {% if images %}
-      {% for f in images %}
-        <div class="file-item">
-          <p>{{ f['filename'] }}</p>
-          <img src="{{ url_for('user_file', username=username, filetype='image', filename=f['filename']) }}" style="max-width: 300px;" alt="{{ f['filename'] }}"/>
-        </div>
-      {% endfor %}
-    {% else %}
-      <p>无</p>
-    {% endif %}
+    return render_template('user_files.html', username=username, images=images, videos=videos, texts=texts,
+                           text_snippet=text_snippet, usage=usage,
+                           max_bytes=app.config['QUOTA_MAX_BYTES'], max_files=app.config['QUOTA_MAX_FILES'])
 
-    <h3>视频</h3>
-    {% if videos %}
-      {% for f in videos %}
-        <div class="file-item">
-          <p>{{ f['filename'] }}</p>
-          <video width="320" controls>
-            <source src="{{ url_for('user_file', username=username, filetype='video', filename=f['filename']) }}" type="video/mp4">
-            您的浏览器不支持视频播放
-          </video>
-        </div>
-      {% endfor %}
-    {% else %}
-      <p>无</p>
-    {% endif %}
-
-    <h3>文本</h3>
-    {% if texts %}
-      {% for f in texts %}
-        <div class="file-item">
-          <p>{{ f['filename'] }}</p>
-          <pre>{{ get_text_content(username, f['filename']) }}</pre>
-        </div>
-      {% endfor %}
-    {% else %}
-      <p>无</p>
-    {% endif %}
-    {% endblock %}
-    ''', username=username, images=images, videos=videos, texts=texts, get_text_content=get_text_content)
+# 单个文本文件展示页面模板
+TEXT_FILE_HTML = '''
+{% extends "base.html" %}
+{% block body %}
+<h2>{{ filename }}</h2>
+<p>共 {{ page.total_lines }} 行，编码 {{ page.encoding }}</p>
+<form id="jump-form" method="get">
+  跳到第 <input type="number" name="line" min="1" max="{{ page.total_lines or 1 }}" value="{{ page.start + 1 }}"> 行
+  <input type="submit" value="跳转">
+</form>
+<pre id="text-lines" style="white-space: pre-wrap; border:1px solid #ccc; padding:10px; max-width:800px;">
+{%- for line in page.lines %}{{ line }}{% if page.start + loop.index0 in page.truncated %} …[行过长，已截断]{% endif %}
+{% endfor -%}
+</pre>
+{% if page.next is not none %}
+<p><a id="next-page" href="{{ url_for('user_file', username=username, filetype='text', filename=filename, line=page.next + 1) }}">下一页</a></p>
+{% endif %}
+<p><a href="{{ url_for('user_text_raw', username=username, filename=filename) }}">原文</a> |
+   <a href="{{ url_for('user_files', username=username) }}">返回文件列表</a></p>
+<script>
+// 下一页追加在当前内容后面，跳转替换当前内容；都走 /lines 接口，不重新加载整页
+(function () {
+  const api = {{ url_for('user_text_lines', username=username, filename=filename) | tojson }};
+  const pre = document.getElementById('text-lines');
+  let next = {{ page.next | tojson }};
+  function render(page, append) {
+    const text = page.lines.map(function (line, i) {
+      return line + (page.truncated.indexOf(page.start + i) >= 0 ? ' …[行过长，已截断]' : '') + '\\n';
+    }).join('');
+    if (append) pre.textContent += text; else pre.textContent = text;
+    next = page.next;
+    const link = document.getElementById('next-page');
+    if (link) link.style.display = next === null ? 'none' : '';
+  }
+  async function load(start, append) {
+    const resp = await fetch(api + '?start=' + start);
+    if (resp.ok) render(await resp.json(), append);
+  }
+  const link = document.getElementById('next-page');
+  if (link) link.addEventListener('click', function (e) {
+    e.preventDefault();
+    if (next !== null) load(next, true);
+  });
+  document.getElementById('jump-form').addEventListener('submit', function (e) {
+    e.preventDefault();
+    load(Math.max(0, parseInt(this.line.value, 10) - 1), false);
+  });
+})();
+</script>
+{% endblock %}
+'''
 
 # 静态文件的在线访问，比如图片、视频、文本内容读取
 @app.route('/user/<username>/<filetype>/<filename>')
@@ -236,27 +564,116 @@ def user_file(username, filetype, filename):
     if filetype not in ['image', 'video', 'text']:
         abort(404)
     # 组合文件路径
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], username, filetype, filename)
+    file_path = stored_path(username, filetype, filename)
     if not os.path.exists(file_path):
         abort(404)
-    # 对文本直接读取后渲染，图片视频直接发送文件
+    # 文本分页显示，?line= 为起始行号（从 1 开始）
     if filetype == 'text':
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            # 使用render_template_string返回简单页面展示文本
-            return render_template_string('''
-                {% extends "base.html" %}
-                {% block body %}
-                <h2>{{ filename }}</h2>
-                <pre style="white-space: pre-wrap; border:1px solid #ccc; padding:10px; max-width:800px;">{{ content }}</pre>
-                <p><a href="{{ url_for('user_files', username=username) }}">返回文件列表</a></p>
-                {% endblock %}
-            ''', content=content, filename=filename, username=username)
-        except Exception:
-            abort(500)
+        start = max(request.args.get('line', 1, type=int) - 1, 0)
+        page = read_text_page(file_path, start, app.config['TEXT_VIEW_PAGE_LINES'])
+        return render_template('text_file.html', page=page, filename=filename, username=username)
+    # 图片视频按 stat 得到 ETag，客户端缓存仍有效时直接 304，不打开文件；
+    # 链接里的版本号与当前文件一致时允许长期缓存
+    st = os.stat(file_path)
+    etag = http_cache.make_etag(st)
+    immutable = request.args.get('v') == etag
+    # 图片带 ?w= 时返回对应宽度的派生图
+    width = request.args.get('w', type=int)
+    if filetype == 'image' and width:
+        return send_image_variant(username, filename, file_path, width, request.args.get('fmt', 'jpeg'), st, immutable)
+    if http_cache.is_not_modified(etag, st.st_mtime):
+        return http_cache.not_modified_response(app, etag, st.st_mtime, immutable, app.config['MEDIA_CACHE_MAX_AGE'])
+    return send_media(file_path, etag, st.st_mtime, immutable)
+
+# 文本分页接口：返回 {start, lines, next, total_lines, encoding, truncated}，行号从 0 开始
+@app.route('/user/<username>/text/<filename>/lines')
+def user_text_lines(username, filename):
+    file_path = stored_path(username, 'text', filename)
+    if not os.path.exists(file_path):
+        abort(404)
+    start = max(request.args.get('start', 0, type=int), 0)
+    count = request.args.get('count', app.config['TEXT_VIEW_PAGE_LINES'], type=int)
+    count = max(1, min(count, app.config['TEXT_VIEW_MAX_LINES']))
+    return jsonify(read_text_page(file_path, start, count))
+
+# 文本原文：压缩存储的文件对支持 gzip 的客户端原样发送，其他客户端边读边解压
+@app.route('/user/<username>/text/<filename>/raw')
+def user_text_raw(username, filename):
+    file_path = stored_path(username, 'text', filename)
+    if not os.path.exists(file_path):
+        abort(404)
+    with text_store.open_text(file_path) as f:
+        encoding, _ = text_pages.detect_encoding(f.read(text_pages.PREFIX_BYTES))
+    st = os.stat(file_path)
+    gzip_ok = text_store.is_compressed(file_path) and request.accept_encodings['gzip'] > 0
+    # 同一个 URL 有压缩和不压缩两种表示，ETag 要区分开
+    etag = http_cache.make_etag(st) + ('-gzip' if gzip_ok else '')
+    if http_cache.is_not_modified(etag, st.st_mtime):
+        response = http_cache.not_modified_response(app, etag, st.st_mtime, False)
+    elif gzip_ok or not text_store.is_compressed(file_path):
+        response = send_file(file_path, mimetype='text/plain', etag=etag, last_modified=st.st_mtime)
+        if gzip_ok:
+            response.content_encoding = 'gzip'
+        http_cache.apply(response, etag, st.st_mtime, False)
     else:
-        return send_file(file_path)
+        response = app.response_class(text_store.iter_decompressed(file_path), mimetype='text/plain')
+        http_cache.apply(response, etag, st.st_mtime, False)
+    if response.status_code != 304:
+        response.mimetype_params['charset'] = encoding.replace('utf-16-', 'utf-16')
+    response.vary.add('Accept-Encoding')
+    return response
+
+# 整个用户的文件打包成一个 ZIP 下载：边读边发、不落临时文件，同样的文件集合每次字节相同，可以断点续传
+@app.route('/user/<username>/export.zip')
+def export_files(username):
+    conn = get_db()
+    user = conn.execute('SELECT id FROM users WHERE username=?', (username,)).fetchone()
+    if not user:
+        abort(404)
+    rows = conn.execute('SELECT id, filename, filetype, mtime_ns, crc32 FROM files WHERE user_id=? '
+                        'ORDER BY filetype, filename', (user['id'],)).fetchall()
+    entries = [entry for entry in (export_entry(conn, username, row) for row in rows) if entry is not None]
+    conn.commit()
+    return zip_stream.send_archive(zip_stream.ZipLayout(entries), username + '.zip')
+
+# 压缩存储的文本直接引用 .gz 里的 deflate 数据；图片视频原样存入，
+# CRC 上传时算好，旧记录或文件被改过时在这里补算一次
+def export_entry(conn, username, row):
+    path = stored_path(username, row['filetype'], row['filename'])
+    name = row['filetype'] + '/' + row['filename']
+    try:
+        st = os.stat(path)
+        if text_store.is_compressed(path):
+            offset, length, crc, size = text_store.deflate_span(path)
+            return zip_stream.deflated(name, path, st, offset, length, crc, size)
+        crc = row['crc32']
+        if crc is None or row['mtime_ns'] != st.st_mtime_ns:
+            crc = zip_stream.file_crc32(path)
+            conn.execute('UPDATE files SET crc32=?, mtime_ns=? WHERE id=?', (crc, st.st_mtime_ns, row['id']))
+        return zip_stream.stored(name, path, st, crc)
+    except (OSError, ValueError) as e:
+        app.logger.warning('打包下载时跳过 %s: %s', path, e)
+        return None
+
+# 大文件第一次查看时要建行偏移索引，之后每页只读用到的部分
+def read_text_page(file_path, start, count):
+    try:
+        return text_pages.read_page(file_path, start, count, max_line_bytes=app.config['TEXT_VIEW_MAX_LINE_BYTES'])
+    except (OSError, ValueError):
+        abort(500)
+
+# 上传页面模板
+UPLOAD_HTML = '''
+{% extends "base.html" %}
+{% block body %}
+<h2>上传文件（仅限登录用户）</h2>
+<form method="post" enctype="multipart/form-data">
+  选择文件: <input type="file" name="file"><br>
+  <input type="submit" value="上传">
+</form>
+<p><a href="{{ url_for('user_files', username=session.get('username')) }}">返回首页</a></p>
+{% endblock %}
+'''
 
 # 文件上传，只允许登录用户上传自己的文件
 @app.route('/upload', methods=['GET', 'POST'])
@@ -266,7 +683,17 @@ def upload():
         return redirect(url_for('login'))
 
     if request.method == 'POST':
-        if 'file' not in request.files:
+        # 读请求体之前先按 Content-Length 检查配额，读取时超过剩余额度立即中止
+        used_bytes, used_files = current_usage(session['user_id'])
+        max_bytes, max_files = app.config['QUOTA_MAX_BYTES'], app.config['QUOTA_MAX_FILES']
+        try:
+            quota.precheck(used_bytes, used_files, request.content_length, max_bytes, max_files)
+            request.max_content_length = quota.body_limit(used_bytes, max_bytes, app.config['MAX_CONTENT_LENGTH'])
+            has_file = 'file' in request.files
+        except RequestEntityTooLarge as e:
+            flash(e.description if isinstance(e, quota.QuotaExceeded) else '文件过大或超出存储配额')
+            return redirect(request.url)
+        if not has_file:
             flash('未选择文件')
             return redirect(request.url)
         file = request.files['file']
@@ -292,7 +719,28 @@ def upload():
             # 确保用户目录存在
             create_user_file_dirs(session['username'])
             save_path = os.path.join(app.config['UPLOAD_FOLDER'], session['username'], filetype, filename)
-            file.save(save_path)
+            # 先存到同目录的临时文件，配额检查通过后再改名覆盖
+            tmp_path = save_path + '.part'
+            file.save(tmp_path)
+            snippet = read_snippet(tmp_path) if filetype == 'text' else None
+            # 全文索引与记录在同一个事务里写入，正文在事务外先读好
+            body = text_search.read_text(tmp_path, app.config['TEXT_INDEX_MAX_BYTES']) if filetype == 'text' else None
+            # 文本压缩后存储，配额按压缩后的大小计
+            final_path, upload_path = save_path, tmp_path
+            if filetype == 'text':
+                final_path, upload_path = save_path + text_store.SUFFIX, tmp_path + text_store.SUFFIX
+                text_store.compress_file(tmp_path, upload_path, app.config['TEXT_GZIP_LEVEL'])
+                os.remove(tmp_path)
+            # 改名不改变 mtime，大小和 mtime 一起记下作为链接的版本号
+            st = os.stat(upload_path)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+            # 图片记下内容哈希和宽高：派生图按哈希缓存，srcset 按原图宽度取舍
+            digest, width, height = None, None, None
+            if filetype == 'image':
+                digest = file_sha256(tmp_path)
+                width, height = image_variants.image_size(tmp_path)
+            # 打包下载时原样存入的文件要用 CRC，趁文件还在页缓存里算好；文本的 CRC 在 gzip 尾部
+            crc = zip_stream.file_crc32(upload_path) if filetype != 'text' else None
 
             # 记录入数据库
             conn = get_db()
@@ -301,13 +749,46 @@ def upload():
             c.execute('SELECT id FROM users WHERE username=?', (session['username'],))
             user = c.fetchone()
             if not user:
+                text_store.remove(upload_path)
                 flash('用户不存在')
                 return redirect(url_for('logout'))
             user_id = user['id']
-            # 插入文件记录
-            c.execute('INSERT INTO files (user_id, filename, filetype) VALUES (?,?,?)', (user_id, filename, filetype))
-            conn.commit()
+            try:
+                with sqlite_pool.write_transaction(conn):
+                    # 同名文件会被覆盖：只按大小差值计入配额，不重复插入记录
+                    old = conn.execute('SELECT id, size FROM files WHERE user_id=? AND filetype=? AND filename=?',
+                                       (user_id, filetype, filename)).fetchone()
+                    if old:
+                        old_size = old['size'] if old['size'] is not None else file_size(stored_path(session['username'], filetype, filename))
+                        quota.charge(conn, user_id, size - old_size, 0, max_bytes, max_files)
+                        conn.execute('UPDATE files SET size=?, mtime_ns=?, snippet=?, sha256=?, width=?, height=?, '
+                                     'crc32=? WHERE id=?',
+                                     (size, mtime_ns, snippet, digest, width, height, crc, old['id']))
+                        file_id = old['id']
+                    else:
+                        quota.charge(conn, user_id, size, 1, max_bytes, max_files)
+                        file_id = conn.execute('INSERT INTO files (user_id, filename, filetype, size, mtime_ns, snippet, '
+                                               'sha256, width, height, crc32) VALUES (?,?,?,?,?,?,?,?,?,?)',
+                                               (user_id, filename, filetype, size, mtime_ns, snippet, digest,
+                                                width, height, crc)).lastrowid
+                    if body is not None:
+                        text_search.index_document(conn, file_id, filename, body)
+                    if filetype == 'text':
+                        text_store.replace(upload_path, final_path)
+                    else:
+                        os.replace(upload_path, final_path)
+            except quota.QuotaExceeded as e:
+                text_store.remove(upload_path)
+                flash(e.description)
+                return redirect(request.url)
             conn.close()
+            # 覆盖了压缩存储之前上传的原文
+            if filetype == 'text' and os.path.exists(save_path):
+                os.remove(save_path)
+                text_pages.remove_index(save_path)
+            # 派生图在后台进程池里生成，队列满时等第一次请求再按需生成
+            if digest and has_variants({'filename': filename}):
+                variant_pipeline.submit(digest, save_path)
 
             flash('上传成功')
             return redirect(url_for('user_files', username=session['username']))
@@ -315,134 +796,233 @@ def upload():
             flash('不允许该类型文件或文件名异常')
             return redirect(request.url)
 
-    # 上传页面HTML模板
-    return render_template_string('''
-    {% extends "base.html" %}
-    {% block body %}
-    <h2>上传文件（仅限登录用户）</h2>
-    <form method="post" enctype="multipart/form-data">
-      选择文件: <input type="file" name="file"><br>
-      <input type="submit" value="上传">
-    </form>
-    <p><a href="{{ url_for('user_files', username=session.get('username')) }}">返回首页</a></p>
-    {% endblock %}
-    ''')
+    return render_template('upload.html')
+
+# 删除自己的文件，用量计数器与记录在同一个事务里更新
+@app.route('/delete/<filetype>/<filename>', methods=['POST'])
+def delete_file(filetype, filename):
+    if 'username' not in session:
+        flash('请先登录')
+        return redirect(url_for('login'))
+    conn = get_db()
+    path = stored_path(session['username'], filetype, secure_filename(filename))
+    with sqlite_pool.write_transaction(conn):
+        row = conn.execute('SELECT id, size FROM files WHERE user_id=? AND filetype=? AND filename=?',
+                           (session['user_id'], filetype, secure_filename(filename))).fetchone()
+        if row:
+            size = row['size'] if row['size'] is not None else file_size(path)
+            conn.execute('DELETE FROM files WHERE id=?', (row['id'],))
+            text_search.remove_document(conn, row['id'])
+            quota.charge(conn, session['user_id'], -size, -1)
+    if not row:
+        flash('文件不存在')
+    else:
+        if filetype == 'text':
+            text_store.remove(path)
+            text_pages.remove_index(path)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        flash('删除成功')
+    return redirect(url_for('user_files', username=session['username']))
+
+# 搜索结果模板，支持在线查看对应文件
+SEARCH_HTML = '''
+{% extends "base.html" %}
+{% from "image_macros.html" import responsive_image with context %}
+{% block head %}
+<style>
+.file-item {
+    margin-bottom: 10px;
+    border: 1px solid #ddd;
+    padding: 5px;
+    position: relative;
+    max-width: 400px;
+}
+pre {
+    white-space: pre-wrap;
+    max-height: 200px;
+    overflow: auto;
+    border:1px solid #ccc;
+    padding:5px;
+    background:#f9f9f9;
+}
+</style>
+{% endblock %}
+{% macro more(user, filetype) %}
+{% if user.totals[filetype] > user[filetype + 's'] | length %}
+<p><a href="{{ url_for('user_files', username=user.username) }}">共 {{ user.totals[filetype] }} 个，查看全部</a></p>
+{% endif %}
+{% endmacro %}
+{% block body %}
+<form method="get" action="{{ url_for('search') }}">
+  <input type="text" name="q" value="{{ query }}">
+  <select name="mode">
+    <option value="user"{% if mode != 'text' %} selected{% endif %}>用户</option>
+    <option value="text"{% if mode == 'text' %} selected{% endif %}>文本内容</option>
+  </select>
+  <input type="submit" value="搜索">
+</form>
+{% if mode == 'text' %}
+<h2>搜索文本内容： {{ query }}</h2>
+{% if hits %}
+  {% for hit in hits %}
+    <div class="file-item">
+      <p><a href="{{ url_for('user_file', username=hit.username, filetype='text', filename=hit.filename) }}">{{ hit.filename }}</a>
+         （<a href="{{ url_for('user_files', username=hit.username) }}">{{ hit.username }}</a>）</p>
+      <pre>{{ hit.snippet_html | safe }}</pre>
+    </div>
+  {% endfor %}
+  {% if next_page %}
+  <p><a href="{{ url_for('search', q=query, mode='text', page=next_page) }}">下一页</a></p>
+  {% endif %}
+{% elif query %}
+  <p>没有文本包含该内容</p>
+{% endif %}
+{% else %}
+<h2>搜索用户： {{ query }}</h2>
+{% if users %}
+  {% for user in users %}
+    <h3><a href="{{ url_for('user_files', username=user.username) }}">{{ user.username }}</a></h3>
+    <div>
+      <strong>图片:</strong>
+      {% if user.images %}
+        {% for f in user.images %}
+          <div class="file-item">
+            <p>{{ f['filename'] }}</p>
+            {{ responsive_image(user.username, f) }}
+          </div>
+        {% endfor %}
+        {{ more(user, 'image') }}
+      {% else %}
+      <p>无</p>
+      {% endif %}
+    </div>
+    <div>
+      <strong>视频:</strong>
+      {% if user.videos %}
+        {% for f in user.videos %}
+          <div class="file-item">
+            <p>{{ f['filename'] }}</p>
+            <video width="320" controls>
+              <source src="{{ media_url(user.username, 'video', f) }}" type="video/mp4">
+              您的浏览器不支持视频播放
+            </video>
+          </div>
+        {% endfor %}
+        {{ more(user, 'video') }}
+      {% else %}
+      <p>无</p>
+      {% endif %}
+    </div>
+    <div>
+      <strong>文本:</strong>
+      {% if user.texts %}
+        {% for f in user.texts %}
+          <div class="file-item">
+            <p>{{ f['filename'] }}</p>
+            <pre>{{ text_snippet(user.username, f) }}</pre>
+          </div>
+        {% endfor %}
+        {{ more(user, 'text') }}
+      {% else %}
+      <p>无</p>
+      {% endif %}
+    </div>
+    <hr>
+  {% endfor %}
+  {% if next_after %}
+  <p><a href="{{ url_for('search', q=query, after=next_after) }}">下一页</a></p>
+  {% endif %}
+{% else %}
+  <p>无匹配用户</p>
+{% endif %}
+{% endif %}
+{% endblock %}
+'''
 
-# 搜索用户，匹配用户名并显示文件预览（图片、视频、文本）
+# 搜索用户，匹配用户名并显示文件预览（图片、视频、文本）；mode=text 时搜索文本文件内容
 @app.route('/search')
 def search():
     q = request.args.get('q', '').strip()
-    conn = get_db()
-    c = conn.cursor()
+    if request.args.get('mode') == 'text':
+        return search_texts(q)
+    after = request.args.get('after', '')
+    page_size = app.config['SEARCH_PAGE_SIZE']
     users = []
+    next_after = None
     if q != '':
-        param = '%' + q + '%'
-        c.execute('SELECT id, username FROM users WHERE username LIKE ?', (param,))
-        rows = c.fetchall()
+        # 一条查询取一页用户及其文件：按用户名键集分页，每个用户每种类型只取最新的若干个，
+        # 同时用窗口函数带出每种类型的总数
+        rows = get_db().execute('''
+            WITH page AS (
+                SELECT id, username FROM users
+                WHERE username LIKE ? AND username > ?
+                ORDER BY username LIMIT ?
+            ), ranked AS (
+                SELECT files.id, files.user_id, files.filename, files.filetype, files.snippet, files.width,
+                       files.size, files.mtime_ns,
+                       ROW_NUMBER() OVER (PARTITION BY files.user_id, files.filetype ORDER BY files.id DESC) AS rn,
+                       COUNT(*) OVER (PARTITION BY files.user_id, files.filetype) AS total
+                FROM files JOIN page ON page.id = files.user_id
+            )
+            SELECT page.id AS user_id, page.username, ranked.id, ranked.filename, ranked.filetype,
+                   ranked.snippet, ranked.width, ranked.size, ranked.mtime_ns, ranked.total
+            FROM page LEFT JOIN ranked ON ranked.user_id = page.id AND ranked.rn <= ?
+            ORDER BY page.username, ranked.filetype, ranked.id DESC
+        ''', ('%' + q + '%', after, page_size + 1, app.config['SEARCH_FILES_PER_TYPE'])).fetchall()
+        by_id = {}
         for row in rows:
-            user_id = row['id']
-            username = row['username']
-            # 查询该用户所有文件
-            c.execute('SELECT id, filename, filetype FROM files WHERE user_id=?', (user_id,))
-            files = c.fetchall()
-            images = []
-            videos = []
-            texts = []
-            for f in files:
-                if f['filetype'] == 'image':
-                    images.append(f)
-                elif f['filetype'] == 'video':
-                    videos.append(f)
-                elif f['filetype'] == 'text':
-                    texts.append(f)
-            users.append({
-                'id': user_id,
-                'username': username,
-                'images': images,
-                'videos': videos,
-                'texts': texts
-            })
-    conn.close()
+            user = by_id.get(row['user_id'])
+            if user is None:
+                user = by_id[row['user_id']] = {
+                    'id': row['user_id'],
+                    'username': row['username'],
+                    'images': [],
+                    'videos': [],
+                    'texts': [],
+                    'totals': {'image': 0, 'video': 0, 'text': 0},
+                }
+                users.append(user)
+            if row['filetype'] in user['totals']:
+                user[row['filetype'] + 's'].append(row)
+                user['totals'][row['filetype']] = row['total']
+        if len(users) > page_size:
+            users = users[:page_size]
+            next_after = users[-1]['username']
 
-    # 搜索结果模板，支持在线查看对应文件
-    return render_template_string('''
-    {% extends "base.html" %}
-    {% block head %}
-    <style>
-    .file-item {
-        margin-bottom: 10px;
-        border: 1px solid #ddd;
-        padding: 5px;
-        position: relative;
-        max-width: 400px;
-    }
-    pre {
-        white-space: pre-wrap;
-        max-height: 200px;
-        overflow: auto;
-        border:1px solid #ccc;
-        padding:5px;
-        background:#f9f9f9;
-    }
-    </style>
-    {% endblock %}
-    {% block body %}
-    <h2>搜索用户： {{ query }}</h2>
-    {% if users %}
-      {% for user in users %}
-        <h3><a href="{{ url_for('user_files', username=user.username) }}">{{ user.username }}</a></h3>
-        <div>
-          <strong>图片:</strong>
-          {% if user.images %}
-            {% for f in user.images %}
-              <div class="file-item">
-                <p>{{ f['filename'] }}</p>
-                <img src="{{ url_for('user_file', username=user.username, filetype='image', filename=f['filename']) }}" style="max-width: 300px;" alt="{{ f['filename'] }}"/>
-              </div>
-            {% endfor %}
-          {% else %}
-          <p>无</p>
-          {% endif %}
-        </div>
-        <div>
-          <strong>视频:</strong>
-          {% if user.videos %}
-            {% for f in user.videos %}
-              <div class="file-item">
-                <p>{{ f['filename'] }}</p>
-                <video width="320" controls>
-                  <source src="{{ url_for('user_file', username=user.username, filetype='video', filename=f['filename']) }}" type="video/mp4">
-                  您的浏览器不支持视频播放
-                </video>
-              </div>
-            {% endfor %}
-          {% else %}
-          <p>无</p>
-          {% endif %}
-        </div>
-        <div>
-          <strong>文本:</strong>
-          {% if user.texts %}
-            {% for f in user.texts %}
-              <div class="file-item">
-                <p>{{ f['filename'] }}</p>
-                <pre>{{ get_text_content(user.username, f['filename']) }}</pre>
-              </div>
-            {% endfor %}
-          {% else %}
-          <p>无</p>
-          {% endif %}
-        </div>
-        <hr>
-      {% endfor %}
-    {% else %}
-      <p>无匹配用户</p>
-    {% endif %}
-    {% endblock %}
-    ''', users=users, query=q, get_text_content=get_text_content)
+    return render_template('search.html', users=users, query=q, next_after=next_after, text_snippet=text_snippet)
+
+# 全文搜索：按相关度排序，每条结果带命中处高亮的片段
+def search_texts(q):
+    page = request.args.get('page', 1, type=int)
+    page = page if page and page > 0 else 1
+    page_size = app.config['TEXT_SEARCH_PAGE_SIZE']
+    hits, has_more = text_search.search(get_db(), q, limit=page_size, offset=(page - 1) * page_size)
+    return render_template('search.html', mode='text', hits=hits, query=q,
+                           next_page=page + 1 if has_more else None)
+
+# 图片预览：按显示宽度（300px，高分屏 600px）从 srcset 中挑派生图，WebP 优先，进入视口才加载
+IMAGE_MACROS_HTML = '''
+{% macro responsive_image(username, f) %}
+{% if has_variants(f) %}
+<picture>
+  <source type="image/webp" srcset="{{ image_srcset(username, f, 'webp') }}" sizes="300px">
+  <img src="{{ media_url(username, 'image', f, w=640, fmt='jpeg') }}"
+       srcset="{{ image_srcset(username, f, 'jpeg') }}" sizes="300px"
+       loading="lazy" decoding="async" style="max-width: 300px;" alt="{{ f['filename'] }}"/>
+</picture>
+{% else %}
+<img src="{{ media_url(username, 'image', f) }}"
+     loading="lazy" style="max-width: 300px;" alt="{{ f['filename'] }}"/>
+{% endif %}
+{% endmacro %}
+'''
 
 # 基础HTML模板，所有页面继承这个
-app.jinja_env.globals['base_template'] = '''
+BASE_HTML = '''
 <!doctype html>
 <html lang="zh-CN">
 <head>
@@ -478,24 +1058,17 @@ app.jinja_env.globals['base_template'] = '''
 </html>
 '''
 
-# 定制模板继承机制，所有页面都继承base.html
-@app.context_processor
-def base_template_processor():
-    def base():
-        return app.jinja_env.globals['base_template']
-    return dict(base=base)
-
-# 重写render_template_string函数，使其支持 {% extends "base.html" %}
-original_render_template_string = render_template_string
-def my_render_template_string(source, **context):
-    if '{% extends "base.html" %}' in source:
-        # 插入base模板作为底层模板
-        base = app.jinja_env.from_string(app.jinja_env.globals['base_template'])
-        tmpl = app.jinja_env.from_string(source)
-        return tmpl.render(**context)
-    else:
-        return original_render_template_string(source, **context)
-app.jinja_env.globals['render_template_string'] = my_render_template_string
+# 所有页面模板启动时注册并预编译，路由直接按名字渲染
+template_registry.register_templates(app, {
+    'base.html': BASE_HTML,
+    'register.html': REGISTER_HTML,
+    'login.html': LOGIN_HTML,
+    'user_files.html': USER_FILES_HTML,
+    'text_file.html': TEXT_FILE_HTML,
+    'upload.html': UPLOAD_HTML,
+    'search.html': SEARCH_HTML,
+    'image_macros.html': IMAGE_MACROS_HTML,
+}, cache_dir=app.config['TEMPLATE_CACHE_DIR'])
 
 # 创建数据库以及表结构，首次运行时调用此函数初始化
 def init_db():
@@ -519,6 +1092,28 @@ def init_db():
             FOREIGN KEY(user_id) REFERENCES users(id)
         )
     ''')
+    # 文件大小（计入配额），旧记录为NULL，由用量重算补齐
+    columns = {row[1] for row in c.execute('PRAGMA table_info(files)')}
+    if 'size' not in columns:
+        c.execute('ALTER TABLE files ADD COLUMN size INTEGER')
+    # 文本文件开头的预览，上传时写入，列表和搜索页不再读文件
+    if 'snippet' not in columns:
+        c.execute('ALTER TABLE files ADD COLUMN snippet TEXT')
+    # 图片的内容哈希（派生图缓存的键）和原图宽高
+    for name, decl in (('sha256', 'TEXT'), ('width', 'INTEGER'), ('height', 'INTEGER')):
+        if name not in columns:
+            c.execute(f'ALTER TABLE files ADD COLUMN {name} {decl}')
+    # 文件的修改时间，与大小一起作为媒体链接的版本号
+    if 'mtime_ns' not in columns:
+        c.execute('ALTER TABLE files ADD COLUMN mtime_ns INTEGER')
+    # 文件内容的 CRC-32（打包下载时原样存入的文件用），对应 mtime_ns 那一版
+    if 'crc32' not in columns:
+        c.execute('ALTER TABLE files ADD COLUMN crc32 INTEGER')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_user ON files (user_id, filetype, filename)')
+    # 每个用户的存储用量计数器
+    c.execute(quota.SCHEMA)
+    # 文本文件全文索引，rowid 与 files.id 相同
+    c.execute(text_search.SCHEMA)
     conn.commit()
     conn.close()
 
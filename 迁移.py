@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import sys
-import shutil
-import uuid
+import threading
 from pathlib import Path
 
 from PyQt5.QtCore import Qt, QObject, QThread, pyqtSignal
@@ -13,6 +13,19 @@ from PyQt5.QtWidgets import (
     QMessageBox, QCheckBox, QProgressBar, QLabel
 )
 
+import metrics
+import transfer_engine
+
+# 桌面程序没有 HTTP 接口：每个文件的复制/移动耗时和字节数记入直方图，
+# 设置了 ORGANIZER_METRICS_FILE 时结束后写成 Prometheus 文本文件（node_exporter textfile 采集）
+FILE_OP_LATENCY = metrics.REGISTRY.histogram(
+    "organizer_file_op_duration_seconds", "单个文件复制/移动耗时", ("action", "category"))
+FILE_OP_BYTES = metrics.REGISTRY.counter(
+    "organizer_file_op_bytes_total", "复制/移动的字节数", ("action", "category"))
+METRICS_FILE = os.environ.get("ORGANIZER_METRICS_FILE")
+# 同时在复制、还没写完的字节数上限，见 transfer_engine.py
+MAX_INFLIGHT_BYTES = int(os.environ.get("ORGANIZER_MAX_INFLIGHT_MB", 1024)) * 1024 * 1024
+
 FILE_CATEGORIES = {
     "Images": {"jpg", "jpeg", "png", "gif", "bmp", "tiff", "svg"},
     "Videos": {"mp4", "mkv", "avi", "mov", "wmv", "flv"},
@@ -35,15 +48,6 @@ def ensure_directory(path: Path):
     if not path.exists():
         path.mkdir(parents=True, exist_ok=True)
 
-def unique_filename(directory: Path, name: str) -> str:
-    target = directory / name
-    if not target.exists():
-        return name
-    stem = Path(name).stem
-    suffix = Path(name).suffix
-    new_name = stem + "_" + uuid.uuid4().hex[:8] + suffix
-    return new_name
-
 class OrganizerWorker(QObject):
     progress_updated = pyqtSignal(int)
     log_updated = pyqtSignal(str)
@@ -70,28 +74,57 @@ class OrganizerWorker(QObject):
             self.log_updated.emit("⚠️ No files found. Aborting.")
             self.work_finished.emit()
             return
+        # 按源/目标设备并发执行，大文件先开始，见 transfer_engine.py
+        jobs = []
+        target_devices = {}
         processed = 0
+        lock = threading.Lock()
+
+        def finish_one():
+            nonlocal processed
+            with lock:
+                processed = processed + 1
+                pct = int(processed / total_files * 100)
+            self.progress_updated.emit(pct)
+
         for file_path in file_list:
             try:
                 category = categorize(file_path.name)
                 target_folder = self.destination / category
-                ensure_directory(target_folder)
-                safe_name = unique_filename(target_folder, file_path.name)
-                target_path = target_folder / safe_name
-                if self.move_files:
-                    shutil.move(str(file_path), str(target_path))
-                    action = "Moved"
-                else:
-                    shutil.copy2(str(file_path), str(target_path))
-                    action = "Copied"
-                self.log_updated.emit(f"{action}: {file_path} → {target_path}")
+                if category not in target_devices:
+                    ensure_directory(target_folder)
+                    target_devices[category] = target_folder.stat().st_dev
+                jobs.append(transfer_engine.make_job(file_path, target_folder, target_devices[category], category))
             except Exception as e:
                 self.log_updated.emit(f"❌ Error processing {file_path}: {e}")
-            processed = processed + 1
-            pct = int(processed / total_files * 100)
-            self.progress_updated.emit(pct)
+                finish_one()
+
+        # 在工作线程里调用；信号跨线程发送，由界面线程排队处理
+        def on_done(job, target_path, action, elapsed, error):
+            if error is None:
+                FILE_OP_LATENCY.observe(elapsed, action, job.category)
+                FILE_OP_BYTES.inc(job.size, action, job.category)
+                self.log_updated.emit(f"{action}: {job.src} → {target_path}")
+            else:
+                self.log_updated.emit(f"❌ Error processing {job.src}: {error}")
+            finish_one()
+
+        engine = transfer_engine.TransferEngine(self.move_files, max_inflight_bytes=MAX_INFLIGHT_BYTES)
+        engine.run(jobs, on_done)
+        if METRICS_FILE:
+            self.write_metrics()
         self.work_finished.emit()
 
+    def write_metrics(self):
+        # 先写临时文件再替换，采集方不会读到半个文件
+        tmp = METRICS_FILE + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(metrics.REGISTRY.render())
+            os.replace(tmp, METRICS_FILE)
+        except OSError as e:
+            self.log_updated.emit(f"⚠️ Failed to write metrics: {e}")
+
 class FileOrganizerApp(QWidget):
     def __init__(self):
         super().__init__()